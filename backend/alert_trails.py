@@ -0,0 +1,227 @@
+"""Location trails of alerts, in a bucketed collection.
+
+Live positions would swamp ``emergency_alerts`` if each were a write there.
+Instead, points go to ``alert_trails`` where one document holds a bucket of
+at most ``bucket_size`` points of one alert::
+
+    {"alert_id", "user_id", "start", "end", "count", "points": [{"t", "lat", "lon", "acc"}]}
+
+``TrailWriter`` buffers points in memory and flushes every
+``flush_interval`` seconds (or once an alert has ``max_batch`` pending),
+writing all alerts' pending points with a single ``bulk_write``: per chunk
+an upsert that ``$push``/``$each``es into an open bucket of the alert with
+room for the whole chunk (``count <= bucket_size - len(chunk)``) or starts a
+new one. If the ordered write fails part-way, only the chunks from the first
+failed operation on go back to the buffer.
+
+Reads flatten the buckets (plus still-buffered points) and reduce them with
+``downsample``: by time (one point per ``resolution`` seconds), by distance
+(drop points closer than ``resolution`` metres to the last kept one), then
+capped to ``max_points`` evenly. First and last points are always kept.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from background import BackgroundLoop
+from geo import haversine_m
+
+logger = logging.getLogger(__name__)
+
+TRAILS_COLLECTION = "alert_trails"
+
+
+def distance_m(a: Dict[str, Any], b: Dict[str, Any]) -> float:
+    """Haversine distance between two trail points"""
+    return haversine_m(a["lat"], a["lon"], b["lat"], b["lon"])
+
+
+def downsample_by_time(points: List[Dict[str, Any]], seconds: float) -> List[Dict[str, Any]]:
+    """The first point of every ``seconds`` window, plus the last point"""
+    if len(points) <= 2 or seconds <= 0:
+        return points
+    kept = [points[0]]
+    for point in points[1:-1]:
+        if (point["t"] - kept[-1]["t"]).total_seconds() >= seconds:
+            kept.append(point)
+    kept.append(points[-1])
+    return kept
+
+
+def downsample_by_distance(points: List[Dict[str, Any]], meters: float) -> List[Dict[str, Any]]:
+    """Drop points closer than ``meters`` to the last kept point, keep the last"""
+    if len(points) <= 2 or meters <= 0:
+        return points
+    kept = [points[0]]
+    for point in points[1:-1]:
+        if distance_m(kept[-1], point) >= meters:
+            kept.append(point)
+    kept.append(points[-1])
+    return kept
+
+
+def cap_points(points: List[Dict[str, Any]], max_points: int) -> List[Dict[str, Any]]:
+    """At most ``max_points`` evenly spread points, first and last included"""
+    if len(points) <= max_points:
+        return points
+    if max_points < 2:
+        return points[-1:]
+    step = (len(points) - 1) / (max_points - 1)
+    return [points[round(i * step)] for i in range(max_points)]
+
+
+def downsample(
+    points: List[Dict[str, Any]],
+    mode: str = "time",
+    resolution: float = 0,
+    max_points: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    if mode == "distance":
+        points = downsample_by_distance(points, resolution)
+    else:
+        points = downsample_by_time(points, resolution)
+    return cap_points(points, max_points) if max_points else points
+
+
+def trail_point(latitude: float, longitude: float, accuracy: Optional[float] = None,
+                timestamp: Optional[datetime] = None) -> Dict[str, Any]:
+    return {
+        "t": timestamp or datetime.now(timezone.utc),
+        "lat": latitude,
+        "lon": longitude,
+        "acc": accuracy,
+    }
+
+
+class TrailWriter(BackgroundLoop):
+    def __init__(
+        self,
+        db,
+        bucket_size: int = 200,
+        flush_interval: float = 2.0,
+        max_batch: int = 50,
+        max_pending: int = 10000
+    ):
+        self.collection = db[TRAILS_COLLECTION]
+        self.bucket_size = bucket_size
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        # Beyond this many buffered points (e.g. Mongo is down) new ones are dropped
+        self.max_pending = max_pending
+        self._pending: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._owners: Dict[str, str] = {}
+        self._pending_count = 0
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self.dropped = 0
+
+    def add(self, alert_id: str, user_id: str, point: Dict[str, Any]) -> None:
+        if self._pending_count >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending[alert_id].append(point)
+        self._owners[alert_id] = user_id
+        self._pending_count += 1
+        if len(self._pending[alert_id]) >= self.max_batch:
+            self._wakeup.set()
+
+    def pending(self, alert_id: str) -> List[Dict[str, Any]]:
+        return list(self._pending.get(alert_id, ()))
+
+    async def flush(self, alert_ids: Optional[Iterable[str]] = None) -> None:
+        """Write the buffered points of ``alert_ids`` (all by default) in one bulk_write"""
+        async with self._flush_lock:
+            ids = list(self._pending) if alert_ids is None else [a for a in alert_ids if a in self._pending]
+            batches = {alert_id: self._pending.pop(alert_id) for alert_id in ids}
+            if not batches:
+                return
+            self._pending_count -= sum(len(points) for points in batches.values())
+
+            operations = []
+            # operation index -> (alert_id, chunk), to re-buffer what wasn't written
+            chunks: List[Tuple[str, List[Dict[str, Any]]]] = []
+            for alert_id, points in batches.items():
+                for i in range(0, len(points), self.bucket_size):
+                    chunk = points[i:i + self.bucket_size]
+                    operations.append(UpdateOne(
+                        # Only a bucket with room for the whole chunk, so none outgrows bucket_size
+                        {"alert_id": alert_id, "count": {"$lte": self.bucket_size - len(chunk)}},
+                        {
+                            "$push": {"points": {"$each": chunk}},
+                            "$inc": {"count": len(chunk)},
+                            "$min": {"start": chunk[0]["t"]},
+                            "$max": {"end": chunk[-1]["t"]},
+                            "$setOnInsert": {"user_id": self._owners.get(alert_id)},
+                        },
+                        upsert=True
+                    ))
+                    chunks.append((alert_id, chunk))
+            try:
+                # Ordered, so an alert's chunks land in sequence
+                await self.collection.bulk_write(operations, ordered=True)
+            except Exception as e:
+                # Ordered: everything before the first write error was applied.
+                # Any other failure may have applied nothing, so keep it all
+                failed_at = 0
+                if isinstance(e, BulkWriteError):
+                    write_errors = e.details.get("writeErrors") or []
+                    failed_at = write_errors[0]["index"] if write_errors else len(operations)
+                logger.error(f"Trail flush failed, keeping {len(operations) - failed_at} of {len(operations)} chunks buffered: {e}")
+                unwritten: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+                for alert_id, chunk in chunks[failed_at:]:
+                    unwritten[alert_id].extend(chunk)
+                for alert_id, points in unwritten.items():
+                    self._pending[alert_id][:0] = points
+                    self._pending_count += len(points)
+            for alert_id in batches:
+                if alert_id not in self._pending:
+                    self._owners.pop(alert_id, None)
+
+    async def read(self, alert_id: str) -> List[Dict[str, Any]]:
+        """Every stored and buffered point of an alert, oldest first"""
+        points: List[Dict[str, Any]] = []
+        async for bucket in self.collection.find(
+            {"alert_id": alert_id}, {"_id": 0, "points": 1}
+        ).sort("start", 1):
+            points.extend(bucket["points"])
+        points.extend(self.pending(alert_id))
+        return _in_order(points)
+
+    async def read_many(self, alert_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """``read`` for a page of alerts in one query"""
+        trails: Dict[str, List[Dict[str, Any]]] = {alert_id: [] for alert_id in alert_ids}
+        async for bucket in self.collection.find(
+            {"alert_id": {"$in": alert_ids}}, {"_id": 0, "alert_id": 1, "points": 1}
+        ).sort([("alert_id", 1), ("start", 1)]):
+            trails[bucket["alert_id"]].extend(bucket["points"])
+        for alert_id, points in trails.items():
+            points.extend(self.pending(alert_id))
+            trails[alert_id] = _in_order(points)
+        return trails
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def stop(self) -> None:
+        await super().stop()
+        await self.flush()
+
+
+def _in_order(points: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Points read back from Mongo are naive UTC, buffered ones are aware
+    for point in points:
+        if point["t"].tzinfo is None:
+            point["t"] = point["t"].replace(tzinfo=timezone.utc)
+    points.sort(key=lambda point: point["t"])
+    return points
@@ -0,0 +1,72 @@
+"""Per-app resources, reachable from module-level names.
+
+Each app built by ``create_app`` keeps its clients, caches and background
+workers on ``app.state.resources``, so two apps in one process (tests, an
+embedding server) never share or overwrite each other's. Handlers still
+write ``db.users`` or ``sessions.find(...)``: those names are
+``ResourceProxy`` objects that forward to the resources of the app currently
+being served. That app is found through a context variable, which
+``BindResources`` sets for every HTTP and WebSocket request and the lifespan
+sets with ``bind`` for startup, shutdown and the background tasks it starts
+(tasks copy the context they were created in).
+"""
+from contextvars import ContextVar, Token
+from types import SimpleNamespace
+from typing import Any, Optional
+
+current_resources: ContextVar[Optional[SimpleNamespace]] = ContextVar("current_resources", default=None)
+
+
+def bind(resources: SimpleNamespace) -> Token:
+    return current_resources.set(resources)
+
+
+class ResourceProxy:
+    """Stands in for one attribute of the current app's resources"""
+
+    __slots__ = ("_name",)
+
+    def __init__(self, name: str):
+        object.__setattr__(self, "_name", name)
+
+    def resolve(self) -> Any:
+        resources = current_resources.get()
+        if resources is None:
+            raise RuntimeError(f"{self._name} used outside an app; resources are built by the app's lifespan")
+        return getattr(resources, self._name)
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(self.resolve(), attribute)
+
+    def __setattr__(self, attribute: str, value: Any) -> None:
+        setattr(self.resolve(), attribute, value)
+
+    def __getitem__(self, key: Any) -> Any:
+        return self.resolve()[key]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self.resolve()[key] = value
+
+    def __bool__(self) -> bool:
+        return bool(self.resolve())
+
+    def __repr__(self) -> str:
+        return f"<ResourceProxy {self._name}>"
+
+
+class BindResources:
+    """ASGI middleware: serve each request with its own app's resources"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        resources = getattr(scope["app"].state, "resources", None) if "app" in scope else None
+        if scope["type"] not in ("http", "websocket") or resources is None:
+            await self.app(scope, receive, send)
+            return
+        token = current_resources.set(resources)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_resources.reset(token)
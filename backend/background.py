@@ -0,0 +1,37 @@
+"""Long-running loops of the app's background workers, and their retry delay.
+
+The outbox dispatcher, the image job scheduler, lease renewal, cache pollers
+and the like each run one loop for the lifetime of the app. They subclass
+``BackgroundLoop`` and implement ``_run``; the lifespan calls ``start`` and,
+on shutdown, ``stop``, which cancels the loop and waits for it to unwind.
+"""
+import asyncio
+import random
+from typing import Optional
+
+
+def retry_delay(attempts: int, base: float, maximum: float) -> float:
+    """Delay before retry number ``attempts``: doubling from ``base``, capped at ``maximum``"""
+    delay = min(maximum, base * (2 ** max(attempts - 1, 0)))
+    # Jitter keeps work that failed together from retrying in lockstep
+    return delay * random.uniform(0.5, 1.0)
+
+
+class BackgroundLoop:
+    _task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        raise NotImplementedError
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
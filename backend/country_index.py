@@ -0,0 +1,270 @@
+"""Offline point-in-country lookup over a memory-mapped boundary index.
+
+``build`` turns country polygons (e.g. Natural Earth admin-0, as GeoJSON)
+into one binary file; ``CountryIndex`` maps that file and answers
+``lookup(lat, lon)`` with an ISO 3166 alpha-2 code, without network or
+parsing at start-up::
+
+    python backend/country_index.py countries.geojson backend/content/countries.idx
+
+Rings are simplified (Douglas-Peucker, ``tolerance`` degrees) and then cut
+along a ``cell_degrees`` grid. A cell that a single country covers entirely
+stores just that country, and open sea stores none, so most lookups read one
+cell entry. Border cells store the rings clipped to the cell, a handful of
+points each, tested with the even-odd rule per country; holes and enclaves
+work out by parity.
+
+Layout, little-endian: header, country codes (2 bytes each), cells
+(row-major from -90/-180), pieces (clipped rings) and float32 lon/lat points.
+"""
+import argparse
+import json
+import mmap
+import struct
+import sys
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+MAGIC = b"AIDLYCI1"
+HEADER = struct.Struct("<8sd10I")
+# whole-cell country (-1: none), piece count, first piece
+CELL = struct.Struct("<hHI")
+# country, point count, first point
+PIECE = struct.Struct("<HHI")
+NO_COUNTRY = -1
+
+ISO_PROPERTIES = ("ISO_A2_EH", "ISO_A2", "iso_a2")
+
+Ring = List[Tuple[float, float]]
+
+
+class CountryIndex:
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise ValueError("country index points are read as native little-endian floats")
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.cell_degrees, self.rows, self.cols, n_countries, n_pieces, n_points,
+         countries_at, self._cells_at, self._pieces_at, points_at, _) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a country index")
+        self.countries = [
+            self._mmap[countries_at + 2 * i:countries_at + 2 * i + 2].decode("ascii")
+            for i in range(n_countries)
+        ]
+        self.pieces = n_pieces
+        self._points = memoryview(self._mmap)[points_at:points_at + 8 * n_points].cast("f")
+
+    def lookup(self, latitude: float, longitude: float) -> Optional[str]:
+        """ISO alpha-2 code of the country at the point, or None at sea"""
+        row = min(max(int((latitude + 90) / self.cell_degrees), 0), self.rows - 1)
+        col = min(max(int((longitude + 180) / self.cell_degrees), 0), self.cols - 1)
+        whole, count, first = CELL.unpack_from(self._mmap, self._cells_at + (row * self.cols + col) * CELL.size)
+        if whole != NO_COUNTRY:
+            return self.countries[whole]
+        inside: Dict[int, bool] = {}
+        for piece in range(first, first + count):
+            country, n, start = PIECE.unpack_from(self._mmap, self._pieces_at + piece * PIECE.size)
+            if _contains(self._points, start, n, longitude, latitude):
+                inside[country] = not inside.get(country, False)
+        for country, is_inside in inside.items():
+            if is_inside:
+                return self.countries[country]
+        return None
+
+    def close(self) -> None:
+        self._points.release()
+        self._mmap.close()
+
+
+def _contains(points, start: int, n: int, x: float, y: float) -> bool:
+    """Even-odd test of (x, y) against ring ``points[start:start + n]``"""
+    inside = False
+    j = start + n - 1
+    xj, yj = points[2 * j], points[2 * j + 1]
+    for i in range(start, start + n):
+        xi, yi = points[2 * i], points[2 * i + 1]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        xj, yj = xi, yi
+    return inside
+
+
+# Building
+
+def simplify(ring: Ring, tolerance: float) -> Ring:
+    """Douglas-Peucker on a closed ring; endpoints are kept"""
+    if tolerance <= 0 or len(ring) < 4:
+        return ring
+    keep = [False] * len(ring)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(ring) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = ring[first], ring[last]
+        dx, dy = x2 - x1, y2 - y1
+        norm = (dx * dx + dy * dy) ** 0.5
+        farthest, index = 0.0, -1
+        for i in range(first + 1, last):
+            x, y = ring[i]
+            if norm:
+                d = abs(dy * x - dx * y + x2 * y1 - y2 * x1) / norm
+            else:
+                d = ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+            if d > farthest:
+                farthest, index = d, i
+        if index != -1 and farthest > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(ring, keep) if kept]
+
+
+def _clip(ring: Ring, axis: int, bound: float, keep_above: bool) -> Ring:
+    """Sutherland-Hodgman against one axis-aligned half-plane"""
+    out: Ring = []
+    if not ring:
+        return out
+    prev = ring[-1]
+    prev_in = (prev[axis] >= bound) if keep_above else (prev[axis] <= bound)
+    for point in ring:
+        point_in = (point[axis] >= bound) if keep_above else (point[axis] <= bound)
+        if point_in != prev_in:
+            t = (bound - prev[axis]) / (point[axis] - prev[axis])
+            crossing = (prev[0] + t * (point[0] - prev[0]), prev[1] + t * (point[1] - prev[1]))
+            out.append((bound, crossing[1]) if axis == 0 else (crossing[0], bound))
+        if point_in:
+            out.append(point)
+        prev, prev_in = point, point_in
+    return out
+
+
+def _area(ring: Ring) -> float:
+    return abs(sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]))) / 2
+
+
+def _rings(geometry: Dict[str, Any]) -> Iterator[Ring]:
+    polygons = geometry["coordinates"]
+    if geometry["type"] == "Polygon":
+        polygons = [polygons]
+    elif geometry["type"] != "MultiPolygon":
+        return
+    for polygon in polygons:
+        for ring in polygon:
+            points = [(float(x), float(y)) for x, y, *_ in ring]
+            if len(points) > 1 and points[0] == points[-1]:
+                points.pop()
+            yield points
+
+
+def features_from_geojson(data: Dict[str, Any]) -> Iterator[Tuple[str, List[Ring]]]:
+    """``(iso, rings)`` per feature that has a usable alpha-2 code"""
+    for feature in data["features"]:
+        properties = feature.get("properties") or {}
+        iso = next((properties[key] for key in ISO_PROPERTIES if key in properties), None)
+        if not isinstance(iso, str) or len(iso) != 2 or not iso.isalpha() or not feature.get("geometry"):
+            continue
+        yield iso.upper(), list(_rings(feature["geometry"]))
+
+
+def build(
+    features: Iterable[Tuple[str, Sequence[Ring]]],
+    cell_degrees: float = 1.0,
+    tolerance: float = 0.01
+) -> bytes:
+    rows, cols = int(round(180 / cell_degrees)), int(round(360 / cell_degrees))
+    countries: List[str] = []
+    country_ids: Dict[str, int] = {}
+    # cell -> countries whose rings cover it entirely, by parity
+    covered: Dict[int, Dict[int, bool]] = defaultdict(dict)
+    clipped: Dict[int, List[Tuple[int, Ring]]] = defaultdict(list)
+    cell_area = cell_degrees * cell_degrees
+
+    for iso, rings in features:
+        if iso not in country_ids:
+            country_ids[iso] = len(countries)
+            countries.append(iso)
+        country = country_ids[iso]
+        for ring in rings:
+            ring = simplify(ring, tolerance)
+            if len(ring) < 3:
+                continue
+            ys = [y for _, y in ring]
+            for row in range(max(int((min(ys) + 90) // cell_degrees), 0), min(int((max(ys) + 90) // cell_degrees), rows - 1) + 1):
+                south = row * cell_degrees - 90
+                band = _clip(_clip(ring, 1, south, True), 1, south + cell_degrees, False)
+                if len(band) < 3:
+                    continue
+                xs = [x for x, _ in band]
+                for col in range(max(int((min(xs) + 180) // cell_degrees), 0), min(int((max(xs) + 180) // cell_degrees), cols - 1) + 1):
+                    west = col * cell_degrees - 180
+                    piece = _clip(_clip(band, 0, west, True), 0, west + cell_degrees, False)
+                    if len(piece) < 3:
+                        continue
+                    cell = row * cols + col
+                    if _area(piece) >= cell_area * (1 - 1e-9):
+                        covered[cell][country] = not covered[cell].get(country, False)
+                    else:
+                        clipped[cell].append((country, piece))
+
+    cells = bytearray()
+    pieces = bytearray()
+    points: List[float] = []
+    n_pieces = 0
+    for cell in range(rows * cols):
+        full = [country for country, odd in covered.get(cell, {}).items() if odd]
+        cell_pieces = clipped.get(cell, [])
+        if not cell_pieces:
+            cells += CELL.pack(full[0] if full else NO_COUNTRY, 0, 0)
+            continue
+        row, col = divmod(cell, cols)
+        south, west = row * cell_degrees - 90, col * cell_degrees - 180
+        square = [(west, south), (west + cell_degrees, south),
+                  (west + cell_degrees, south + cell_degrees), (west, south + cell_degrees)]
+        cell_pieces = sorted(cell_pieces + [(country, square) for country in full], key=lambda p: p[0])
+        cells += CELL.pack(NO_COUNTRY, len(cell_pieces), n_pieces)
+        for country, ring in cell_pieces:
+            if len(ring) > 0xFFFF:
+                raise ValueError(f"cell {cell} ring has {len(ring)} points; use a smaller cell_degrees")
+            pieces += PIECE.pack(country, len(ring), len(points) // 2)
+            for x, y in ring:
+                points += (x, y)
+            n_pieces += 1
+
+    codes = "".join(countries).encode("ascii")
+    countries_at = HEADER.size
+    cells_at = _align(countries_at + len(codes))
+    pieces_at = _align(cells_at + len(cells))
+    points_at = _align(pieces_at + len(pieces))
+    out = bytearray(HEADER.pack(
+        MAGIC, cell_degrees, rows, cols, len(countries), n_pieces, len(points) // 2,
+        countries_at, cells_at, pieces_at, points_at, 0
+    ))
+    for at, section in ((countries_at, codes), (cells_at, cells), (pieces_at, pieces)):
+        out += bytes(at - len(out)) + section
+    out += bytes(points_at - len(out)) + struct.pack(f"<{len(points)}f", *points)
+    return bytes(out)
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the country index from GeoJSON boundaries")
+    parser.add_argument("geojson")
+    parser.add_argument("output")
+    parser.add_argument("--cell-degrees", type=float, default=1.0)
+    parser.add_argument("--tolerance", type=float, default=0.01, help="simplification, in degrees")
+    args = parser.parse_args()
+    with open(args.geojson, encoding="utf-8") as f:
+        data = json.load(f)
+    index = build(features_from_geojson(data), args.cell_degrees, args.tolerance)
+    with open(args.output, "wb") as f:
+        f.write(index)
+    print(f"Wrote {len(index) / 1e6:.1f} MB to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""Opaque keyset-pagination tokens.
+
+A cursor is the sort key of the last row of a page, as a small JSON object
+in unpadded URL-safe base64. Callers choose the keys and parse the values;
+clients only hand the token back.
+"""
+import base64
+import json
+from typing import Any, Dict
+
+
+def encode_cursor(values: Dict[str, Any]) -> str:
+    raw = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Raises ValueError on a malformed token"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, dict):
+        raise ValueError("Invalid cursor")
+    return values
@@ -0,0 +1,100 @@
+"""Emergency numbers by ISO 3166 alpha-2 country code.
+
+Maintained by hand; check the national authority before editing an entry.
+``general`` is the single number that reaches every service, where the
+country has one. Elsewhere the ambulance number is the one to dial, since
+Aidly guides first aid. Countries missing here fall back to the user's
+stored number.
+"""
+from typing import Dict, NamedTuple, Optional
+
+
+class EmergencyNumbers(NamedTuple):
+    general: Optional[str] = None
+    ambulance: Optional[str] = None
+    police: Optional[str] = None
+    fire: Optional[str] = None
+
+    @property
+    def primary(self) -> Optional[str]:
+        return self.general or self.ambulance or self.police
+
+
+_112 = EmergencyNumbers(general="112")
+_911 = EmergencyNumbers(general="911")
+
+EMERGENCY_NUMBERS: Dict[str, EmergencyNumbers] = {
+    # Americas
+    "US": _911,
+    "CA": _911,
+    "PR": _911,
+    "MX": _911,
+    "CR": _911,
+    "PA": _911,
+    "SV": _911,
+    "HN": _911,
+    "DO": _911,
+    "VE": _911,
+    "EC": _911,
+    "UY": _911,
+    "PY": _911,
+    "CO": EmergencyNumbers(general="123"),
+    "AR": EmergencyNumbers(ambulance="107", police="911", fire="100"),
+    "BR": EmergencyNumbers(ambulance="192", police="190", fire="193"),
+    "CL": EmergencyNumbers(ambulance="131", police="133", fire="132"),
+    "PE": EmergencyNumbers(ambulance="106", police="105", fire="116"),
+    "BO": EmergencyNumbers(ambulance="118", police="110", fire="119"),
+    "CU": EmergencyNumbers(ambulance="104", police="106", fire="105"),
+    # Europe
+    "AT": _112, "BE": _112, "BG": _112, "HR": _112, "CY": _112, "CZ": _112,
+    "DK": _112, "EE": _112, "FI": _112, "FR": _112, "DE": _112, "GR": _112,
+    "HU": _112, "IE": _112, "IT": _112, "LV": _112, "LT": _112, "LU": _112,
+    "MT": _112, "NL": _112, "PL": _112, "PT": _112, "RO": _112, "SK": _112,
+    "SI": _112, "ES": _112, "SE": _112, "IS": _112, "NO": _112, "LI": _112,
+    "CH": _112, "TR": _112, "UA": _112, "RU": _112, "MD": _112, "ME": _112,
+    "MK": _112, "GE": _112, "AM": _112,
+    "GB": EmergencyNumbers(general="999"),
+    "RS": EmergencyNumbers(ambulance="194", police="192", fire="193"),
+    "BA": EmergencyNumbers(ambulance="124", police="122", fire="123"),
+    # Asia
+    "IN": _112,
+    "ID": _112,
+    "PH": _911,
+    "HK": EmergencyNumbers(general="999"),
+    "MY": EmergencyNumbers(general="999"),
+    "BD": EmergencyNumbers(general="999"),
+    "CN": EmergencyNumbers(ambulance="120", police="110", fire="119"),
+    "JP": EmergencyNumbers(ambulance="119", police="110", fire="119"),
+    "KR": EmergencyNumbers(ambulance="119", police="112", fire="119"),
+    "TW": EmergencyNumbers(ambulance="119", police="110", fire="119"),
+    "SG": EmergencyNumbers(ambulance="995", police="999", fire="995"),
+    "TH": EmergencyNumbers(ambulance="1669", police="191", fire="199"),
+    "VN": EmergencyNumbers(ambulance="115", police="113", fire="114"),
+    "PK": EmergencyNumbers(ambulance="1122", police="15", fire="16"),
+    "NP": EmergencyNumbers(ambulance="102", police="100", fire="101"),
+    # Middle East
+    "SA": _911,
+    "JO": _911,
+    "KW": _112,
+    "QA": EmergencyNumbers(general="999"),
+    "AE": EmergencyNumbers(ambulance="998", police="999", fire="997"),
+    "IL": EmergencyNumbers(ambulance="101", police="100", fire="102"),
+    # Africa
+    "NG": _112,
+    "GH": _112,
+    "KE": EmergencyNumbers(general="999"),
+    "ZA": EmergencyNumbers(general="112", ambulance="10177", police="10111"),
+    "EG": EmergencyNumbers(ambulance="123", police="122", fire="180"),
+    "MA": EmergencyNumbers(ambulance="15", police="19", fire="15"),
+    "TN": EmergencyNumbers(ambulance="190", police="197", fire="198"),
+    "DZ": EmergencyNumbers(ambulance="14", police="17", fire="14"),
+    # Oceania
+    "AU": EmergencyNumbers(general="000"),
+    "NZ": EmergencyNumbers(general="111"),
+}
+
+
+def emergency_number(country: Optional[str]) -> Optional[str]:
+    """Number to dial in ``country``, or None when it isn't in the table"""
+    numbers = EMERGENCY_NUMBERS.get(country or "")
+    return numbers.primary if numbers else None
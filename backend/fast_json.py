@@ -0,0 +1,62 @@
+"""Opt-in fast JSON responses for hot endpoints.
+
+FastAPI's default path validates a handler's return value against its
+response model, walks it with ``jsonable_encoder`` and then serializes it with
+``json.dumps``. For data that is already trusted (documents we projected out
+of Mongo ourselves, models we just built) that is all redundant work.
+``FastJSONResponse`` serializes dicts directly with orjson, which handles
+datetimes and UUIDs natively; without orjson installed it falls back to the
+stdlib encoder.
+
+``fast_response`` is what handlers call. With ``validate=True`` (a debug mode)
+the content is still checked against the declared model first, so fast
+handlers can be verified to keep their response contract.
+"""
+import json
+import uuid
+from datetime import date, datetime
+from typing import Any, Optional
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+_adapters: dict = {}
+
+
+def _adapter(model: Any) -> TypeAdapter:
+    adapter = _adapters.get(model)
+    if adapter is None:
+        adapter = _adapters[model] = TypeAdapter(model)
+    return adapter
+
+
+def fast_response(content: Any, model: Optional[Any] = None, validate: bool = False, **kwargs: Any) -> FastJSONResponse:
+    """Serialize trusted content directly, optionally validating it against ``model``."""
+    if validate and model is not None:
+        _adapter(model).validate_python(content)
+    return FastJSONResponse(content, **kwargs)
@@ -0,0 +1,13 @@
+"""Great-circle distances, shared by trail downsampling and nearby search."""
+import math
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distance in metres between two points given in degrees"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    h = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    # Rounding can push h a hair past 1 for antipodal points
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(h)))
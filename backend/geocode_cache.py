@@ -0,0 +1,127 @@
+"""Two-tier cache in front of Nominatim reverse geocoding.
+
+Coordinates are snapped to a bucket (``precision`` decimal places, 3 is about
+110 m) and the bucket centre is what gets geocoded, so every lookup in the same
+bucket shares one answer. Tier 1 is an in-process LRU, tier 2 the
+``geocode_cache`` collection (expired by a TTL index, see ``indexes.py``).
+Concurrent misses for one bucket share a single lookup, and calls to Nominatim
+are spaced at least ``min_interval`` seconds apart to respect its usage policy.
+That spacing is per process unless a shared ``limiter`` (see ``rate_limits.py``)
+is given, which spaces calls across every worker instead.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+GEOCODE_COLLECTION = "geocode_cache"
+
+
+class ReverseGeocodeCache:
+    def __init__(
+        self,
+        db,
+        reverse: Callable[[str], Any],
+        precision: int = 3,
+        max_size: int = 10000,
+        ttl_seconds: float = 24 * 3600,
+        min_interval: float = 1.0,
+        limiter: Optional[Any] = None
+    ):
+        self.collection = db[GEOCODE_COLLECTION]
+        self.reverse = reverse
+        self.precision = precision
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.min_interval = min_interval
+        self.limiter = limiter
+        # bucket -> (address, monotonic deadline)
+        self._memory: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self._flights = SingleFlight()
+        self._throttle = asyncio.Lock()
+        self._last_call = 0.0
+        self.memory_hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+
+    def bucket(self, latitude: float, longitude: float) -> Tuple[str, float, float]:
+        lat = round(latitude, self.precision)
+        lon = round(longitude, self.precision)
+        return f"{lat:.{self.precision}f},{lon:.{self.precision}f}", lat, lon
+
+    def peek(self, latitude: float, longitude: float) -> Optional[str]:
+        """Memory-only lookup; never does I/O."""
+        key, _, _ = self.bucket(latitude, longitude)
+        entry = self._memory.get(key)
+        if entry is None or time.monotonic() >= entry[1]:
+            return None
+        return entry[0]
+
+    async def lookup(self, latitude: float, longitude: float) -> Optional[str]:
+        """Address for the coordinates' bucket, or None if Nominatim has none."""
+        key, lat, lon = self.bucket(latitude, longitude)
+
+        entry = self._memory.get(key)
+        if entry is not None and time.monotonic() < entry[1]:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return entry[0]
+
+        return await self._flights.run(key, lambda: self._resolve(key, lat, lon))
+
+    async def _resolve(self, key: str, lat: float, lon: float) -> Optional[str]:
+        cached = await self.collection.find_one({"_id": key}, {"_id": 0, "address": 1})
+        if cached is not None:
+            self.mongo_hits += 1
+            self._remember(key, cached["address"])
+            return cached["address"]
+
+        self.misses += 1
+        location = await self._call_nominatim(f"{lat}, {lon}")
+        address = location.address if location else None
+        self._remember(key, address)
+        try:
+            await self.collection.update_one(
+                {"_id": key},
+                {"$set": {"address": address, "created_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to persist geocode cache entry {key}: {e}")
+        return address
+
+    async def _call_nominatim(self, query: str) -> Any:
+        if self.limiter is not None:
+            await self.limiter.acquire()
+            return await asyncio.to_thread(self.reverse, query)
+        async with self._throttle:
+            wait = self._last_call + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                # geopy is blocking; keep it off the event loop
+                return await asyncio.to_thread(self.reverse, query)
+            finally:
+                self._last_call = time.monotonic()
+
+    def _remember(self, key: str, address: Optional[str]) -> None:
+        self._memory[key] = (address, time.monotonic() + self.ttl_seconds)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.memory_hits + self.mongo_hits + self.misses
+        return {
+            "size": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "mongo_hits": self.mongo_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.mongo_hits) / total, 4) if total else 0.0,
+        }
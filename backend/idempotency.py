@@ -0,0 +1,254 @@
+"""Idempotency keys for retried writes.
+
+The PWA replays queued requests (Background Sync) when connectivity returns,
+so the same SOS or contact write can arrive several times. A client that
+sends an ``Idempotency-Key`` header gets the first execution's response back
+on every replay, and the side effects run once.
+
+Keys live in the ``idempotency_keys`` collection, ``_id`` being
+``user:route:key``, and expire through a TTL index on ``created_at`` (see
+``indexes.py``). The first request inserts the key as ``in_progress``, runs
+the handler and stores its response as ``done``. If the handler raises, the
+key is deleted so a retry executes again. A duplicate that arrives while the
+first is still running waits for it: on the same worker through an in-memory
+future, on other workers by polling the key, until ``wait_timeout``.
+
+An ``in_progress`` key is leased: while its handler runs, the owning worker
+refreshes ``heartbeat_at`` every third of ``lease_seconds`` (``start``), and
+a duplicate only takes the key over once the heartbeat is older than the
+lease, i.e. once its worker died. A slow handler therefore never runs twice.
+
+``run`` wraps one handler. Batched writes use ``claim_many``, ``complete``
+and ``release`` directly so a whole batch of keys costs a round trip each.
+Both of the latter always hand their keys back, even when the write fails:
+the keys stop being renewed, local duplicates are woken, and a key whose
+response could not be stored is taken over once its lease runs out.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from background import BackgroundLoop
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different body"""
+
+
+class IdempotencyInProgress(Exception):
+    """The original request is still running after ``wait_timeout``"""
+
+
+def request_hash(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore(BackgroundLoop):
+    def __init__(
+        self,
+        db,
+        wait_timeout: float = 10.0,
+        poll_interval: float = 0.1,
+        lease_seconds: float = 60.0
+    ):
+        self.collection = db[IDEMPOTENCY_COLLECTION]
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        # An in_progress key whose heartbeat is older than this belongs to a crashed worker
+        self.lease = timedelta(seconds=lease_seconds)
+        # Keys this worker owns, with the future their duplicates wait on
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.replays = 0
+
+    @staticmethod
+    def key_id(user_id: str, route: str, key: str) -> str:
+        return f"{user_id}:{route}:{key}"
+
+    async def run(
+        self,
+        user_id: str,
+        route: str,
+        key: str,
+        payload: Any,
+        handler: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Tuple[Dict[str, Any], bool]:
+        """``(response, replayed)``; ``handler`` runs at most once per key"""
+        key_id = self.key_id(user_id, route, key)
+        replay = await self.claim(key_id, request_hash(payload))
+        if replay is not None:
+            return replay, True
+        try:
+            response = await handler()
+        except BaseException:
+            await self.release([key_id])
+            raise
+        await self.complete({key_id: response})
+        return response, False
+
+    async def claim(self, key_id: str, digest: str) -> Optional[Dict[str, Any]]:
+        """Own ``key_id`` (returns None) or get the stored response of the original"""
+        deadline = asyncio.get_running_loop().time() + self.wait_timeout
+        while True:
+            try:
+                await self.collection.insert_one(self._claim_doc(key_id, digest))
+            except DuplicateKeyError:
+                response = await self._existing(key_id, digest, deadline)
+                if response is not None:
+                    self.replays += 1
+                    return response
+                # The key was released (handler failed or lease expired); claim it
+                continue
+            self._inflight[key_id] = asyncio.get_running_loop().create_future()
+            return None
+
+    async def claim_many(self, claims: Dict[str, str]) -> Dict[str, Any]:
+        """``claim`` for several ``key_id -> digest`` at once, in one insert when none exist.
+
+        Per key: None when owned, the stored response for a replay, or the
+        ``IdempotencyKeyReused``/``IdempotencyInProgress`` it would have raised.
+        """
+        key_ids = list(claims)
+        duplicates = set()
+        try:
+            await self.collection.insert_many(
+                [self._claim_doc(key_id, claims[key_id]) for key_id in key_ids],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                if error["code"] != 11000:
+                    raise
+                duplicates.add(key_ids[error["index"]])
+
+        results: Dict[str, Any] = {}
+        loop = asyncio.get_running_loop()
+        for key_id in key_ids:
+            if key_id not in duplicates:
+                self._inflight[key_id] = loop.create_future()
+                results[key_id] = None
+        for key_id in duplicates:
+            try:
+                results[key_id] = await self.claim(key_id, claims[key_id])
+            except (IdempotencyKeyReused, IdempotencyInProgress) as e:
+                results[key_id] = e
+        return results
+
+    async def complete(self, responses: Dict[str, Dict[str, Any]]) -> None:
+        """Store the responses of owned keys; later replays get them back.
+
+        Never raises: the handlers already ran, so a failed write is logged
+        and the request still gets its response.
+        """
+        if not responses:
+            return
+        try:
+            await self.collection.bulk_write([
+                UpdateOne({"_id": key_id}, {"$set": {"status": "done", "response": response}})
+                for key_id, response in responses.items()
+            ], ordered=False)
+        except Exception as e:
+            logger.error(f"Storing idempotent responses failed, keys left to expire: {e}")
+        finally:
+            for key_id, response in responses.items():
+                self._settle(key_id, response)
+
+    async def release(self, key_ids: List[str]) -> None:
+        """Give up owned keys after a failure, so a retry executes again"""
+        if not key_ids:
+            return
+        try:
+            await self.collection.delete_many({"_id": {"$in": key_ids}, "status": "in_progress"})
+        finally:
+            for key_id in key_ids:
+                self._settle(key_id, None)
+
+    def _settle(self, key_id: str, response: Optional[Dict[str, Any]]) -> None:
+        future = self._inflight.pop(key_id, None)
+        if future is not None and not future.done():
+            future.set_result(response)
+
+    @staticmethod
+    def _claim_doc(key_id: str, digest: str) -> Dict[str, Any]:
+        now = datetime.now(timezone.utc)
+        return {
+            "_id": key_id,
+            "status": "in_progress",
+            "request_hash": digest,
+            "created_at": now,
+            "heartbeat_at": now
+        }
+
+    async def renew(self) -> int:
+        """Refresh the lease of every key this worker owns; returns how many"""
+        key_ids = list(self._inflight)
+        if not key_ids:
+            return 0
+        result = await self.collection.update_many(
+            {"_id": {"$in": key_ids}, "status": "in_progress"},
+            {"$set": {"heartbeat_at": datetime.now(timezone.utc)}}
+        )
+        return result.modified_count
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 3)
+            try:
+                await self.renew()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Idempotency lease renewal failed: {e}")
+
+    async def _existing(self, key_id: str, digest: str, deadline: float):
+        """Stored response for a duplicate, or None once the key is free to claim"""
+        loop = asyncio.get_running_loop()
+        while True:
+            future = self._inflight.get(key_id)
+            if future is not None:
+                # Same worker: wait on the original execution directly
+                remaining = deadline - loop.time()
+                try:
+                    response = await asyncio.wait_for(asyncio.shield(future), timeout=max(remaining, 0))
+                except asyncio.TimeoutError:
+                    raise IdempotencyInProgress(key_id)
+                if response is None:
+                    return None
+                # The original's response, even if storing it failed; only
+                # the request hash needs checking
+                doc = await self.collection.find_one({"_id": key_id}, {"request_hash": 1})
+                if doc is not None and doc["request_hash"] != digest:
+                    raise IdempotencyKeyReused(key_id)
+                return response
+
+            doc = await self.collection.find_one({"_id": key_id})
+            if doc is None:
+                return None
+            if doc["request_hash"] != digest:
+                raise IdempotencyKeyReused(key_id)
+            if doc["status"] == "done":
+                return doc["response"]
+
+            # Keys claimed before heartbeats existed only have created_at
+            field = "heartbeat_at" if "heartbeat_at" in doc else "created_at"
+            heartbeat = doc[field]
+            if heartbeat.tzinfo is None:
+                heartbeat = heartbeat.replace(tzinfo=timezone.utc)
+            if datetime.now(timezone.utc) - heartbeat > self.lease:
+                # Unless the owner renewed meanwhile
+                await self.collection.delete_one(
+                    {"_id": key_id, "status": "in_progress", field: doc[field]}
+                )
+                return None
+            if loop.time() >= deadline:
+                raise IdempotencyInProgress(key_id)
+            await asyncio.sleep(self.poll_interval)
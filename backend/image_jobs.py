@@ -0,0 +1,255 @@
+"""Image-generation job queue.
+
+Jobs are documents in ``image_jobs``, so any worker can report on or serve a
+job another worker ran. Each worker runs a scheduler that claims queued jobs
+under a lease and runs at most ``concurrency`` generations at a time; a job
+whose worker died becomes claimable again once its lease expires. A failed
+attempt is retried after an exponential backoff (``next_attempt_at``).
+
+Submitting is refused once a user has ``per_user_limit`` unfinished jobs.
+The limit is enforced atomically on a per-user counter in
+``image_job_quotas``: a submit takes a slot with a conditional ``$inc`` and
+the worker that finishes the job gives it back. A counter that drifted (e.g.
+a worker died between the two) is recounted from ``image_jobs`` when it
+refuses a submit.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from background import BackgroundLoop, retry_delay
+from image_store import ImageStore
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = "image_jobs"
+QUOTAS_COLLECTION = "image_job_quotas"
+TERMINAL_STATUSES = ("done", "failed")
+JOB_PROJECTION = {"_id": 0, "prompt": 0, "lease_owner": 0, "lease_expires_at": 0}
+
+
+class QuotaExceeded(Exception):
+    """The user already has the maximum number of unfinished jobs."""
+
+
+class ImageJobQueue(BackgroundLoop):
+    def __init__(
+        self,
+        db,
+        store: ImageStore,
+        generate: Callable[[str], Awaitable[bytes]],
+        concurrency: int = 2,
+        per_user_limit: int = 3,
+        lease_seconds: float = 300.0,
+        max_attempts: int = 3,
+        base_backoff: float = 5.0,
+        max_backoff: float = 300.0,
+        poll_interval: float = 1.0
+    ):
+        self.jobs = db[JOBS_COLLECTION]
+        self.quotas = db[QUOTAS_COLLECTION]
+        self.store = store
+        self.generate = generate
+        self.concurrency = concurrency
+        self.per_user_limit = per_user_limit
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.worker_id = uuid.uuid4().hex
+        self._slots = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        # One event per watcher, so a watcher leaving never strands the others
+        self._finished: Dict[str, Set[asyncio.Event]] = {}
+        self._running: set = set()
+
+    def backoff(self, attempts: int) -> float:
+        return retry_delay(attempts, self.base_backoff, self.max_backoff)
+
+    async def _take_slot(self, user_id: str) -> bool:
+        try:
+            # Upsert: no counter yet means no active jobs. A full counter makes
+            # the filter miss and the upsert collide with the existing _id
+            await self.quotas.update_one(
+                {"_id": user_id, "active": {"$lt": self.per_user_limit}},
+                {"$inc": {"active": 1}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def _release_slot(self, user_id: str) -> None:
+        await self.quotas.update_one({"_id": user_id, "active": {"$gt": 0}}, {"$inc": {"active": -1}})
+
+    async def _recount(self, user_id: str) -> None:
+        """Bring a drifted counter back to the user's unfinished job count"""
+        counter = await self.quotas.find_one({"_id": user_id})
+        active = await self.jobs.count_documents(
+            {"user_id": user_id, "status": {"$in": ["queued", "running"]}}
+        )
+        if counter and counter["active"] > active:
+            logger.warning(f"Image job quota of user {user_id} drifted: {counter['active']} counted, {active} active")
+            # Only if no submit or finish moved it since it was read
+            await self.quotas.update_one(
+                {"_id": user_id, "active": counter["active"]}, {"$set": {"active": active}}
+            )
+
+    async def submit(self, user_id: str, image_id: str, prompt: str) -> Dict[str, Any]:
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "image_id": image_id,
+            "prompt": prompt,
+            "status": "queued",  # "queued", "running", "done", "failed"
+            "attempts": 0,
+            "error": None,
+            "created_at": now,
+            "next_attempt_at": now,
+            "finished_at": None,
+            "lease_owner": None,
+            "lease_expires_at": None,
+        }
+        # Already generated: nothing to schedule, and no slot taken
+        if await self.store.get(image_id) is not None:
+            job.update(status="done", finished_at=now)
+        elif not await self._take_slot(user_id):
+            await self._recount(user_id)
+            if not await self._take_slot(user_id):
+                raise QuotaExceeded(f"At most {self.per_user_limit} image jobs may be pending")
+
+        try:
+            await self.jobs.insert_one(dict(job))
+        except Exception:
+            if job["status"] == "queued":
+                await self._release_slot(user_id)
+            raise
+        self._wakeup.set()
+        return {k: v for k, v in job.items() if k not in JOB_PROJECTION}
+
+    async def get(self, job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.jobs.find_one({"id": job_id, "user_id": user_id}, JOB_PROJECTION)
+
+    async def watch(self, job_id: str, user_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the job every time its status changes, until it finishes."""
+        last_status = None
+        event = asyncio.Event()
+        try:
+            while True:
+                job = await self.get(job_id, user_id)
+                if job is None:
+                    return
+                if job["status"] != last_status:
+                    last_status = job["status"]
+                    yield job
+                if job["status"] in TERMINAL_STATUSES:
+                    return
+                # Woken early when this worker finishes the job, else poll
+                event.clear()
+                self._finished.setdefault(job_id, set()).add(event)
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            watchers = self._finished.get(job_id)
+            if watchers is not None:
+                watchers.discard(event)
+                if not watchers:
+                    del self._finished[job_id]
+
+    async def wait(self, job_id: str, user_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Block until the job finishes or ``timeout`` passes; returns the last state."""
+        job = None
+
+        async def follow():
+            nonlocal job
+            async for job in self.watch(job_id, user_id):
+                pass
+
+        try:
+            await asyncio.wait_for(follow(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        now = datetime.now(timezone.utc)
+        return await self.jobs.find_one_and_update(
+            {
+                "$or": [
+                    # $not/$gt also matches jobs queued before next_attempt_at existed
+                    {"status": "queued", "next_attempt_at": {"$not": {"$gt": now}}},
+                    {"status": "running", "lease_expires_at": {"$lte": now}},
+                ]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_owner": self.worker_id,
+                    "lease_expires_at": now + self.lease,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _execute(self, job: Dict[str, Any]) -> None:
+        owned = {"id": job["id"], "lease_owner": self.worker_id}
+        try:
+            await self.store.get_or_create(job["image_id"], lambda: self.generate(job["prompt"]))
+            update = {"status": "done", "error": None}
+        except Exception as e:
+            logger.error(f"Image job {job['id']} failed (attempt {job['attempts']}): {e}")
+            update = {"status": "failed", "error": str(e)}
+            if job["attempts"] < self.max_attempts:
+                delay = timedelta(seconds=self.backoff(job["attempts"]))
+                update.update(status="queued", next_attempt_at=datetime.now(timezone.utc) + delay)
+        if update["status"] in TERMINAL_STATUSES:
+            update["finished_at"] = datetime.now(timezone.utc)
+        update["lease_expires_at"] = None
+        try:
+            result = await self.jobs.update_one(owned, {"$set": update})
+            # Only the lease owner's terminal write gives the slot back, once
+            if update["status"] in TERMINAL_STATUSES and result.modified_count:
+                await self._release_slot(job["user_id"])
+        finally:
+            self._slots.release()
+            for event in self._finished.pop(job["id"], ()):
+                event.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self._slots.acquire()
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                self._slots.release()
+                raise
+            except Exception as e:
+                logger.error(f"Image job claim failed: {e}")
+                job = None
+            if job is None:
+                self._slots.release()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            task = asyncio.create_task(self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def stop(self) -> None:
+        await super().stop()
+        for task in list(self._running):
+            task.cancel()
@@ -0,0 +1,127 @@
+"""Content-addressed blob store for generated images.
+
+Images are keyed by a hash of the model and the normalized prompt, so an
+identical request is a file read instead of a model call. Files live under
+``directory/<key[:2]>/<key>``; reads refresh the file's mtime and the store
+evicts least-recently-used files once it grows past ``max_bytes``. Concurrent
+misses for the same key share a single generation.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+_MEDIA_TYPES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+)
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.casefold().split())
+
+
+def image_key(prompt: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\n{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+
+def is_image_key(value: str) -> bool:
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+def sniff_media_type(data: bytes) -> str:
+    for magic, media_type in _MEDIA_TYPES:
+        if data.startswith(magic):
+            return media_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class ImageStore:
+    def __init__(self, directory: Path, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._total_bytes: Optional[int] = None
+        self._flights = SingleFlight()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def _read(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used for eviction
+        except OSError:
+            pass
+        return data
+
+    def _write(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        existed = path.exists()
+        # Write then rename so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        if not existed and self._total_bytes is not None:
+            self._total_bytes += len(data)
+        self._evict()
+
+    def _evict(self) -> None:
+        if self._total_bytes is not None and self._total_bytes <= self.max_bytes:
+            return
+        files = []
+        for path in self.directory.glob("*/*"):
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._total_bytes = total
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._read, key)
+
+    async def put(self, key: str, data: bytes) -> None:
+        await asyncio.to_thread(self._write, key, data)
+
+    async def get_or_create(self, key: str, generate: Callable[[], Awaitable[bytes]]) -> Tuple[bytes, bool]:
+        """Return (image bytes, served_from_store)."""
+        data = await self.get(key)
+        if data is not None:
+            return data, True
+
+        return await self._flights.run(key, lambda: self._create(key, generate)), False
+
+    async def _create(self, key: str, generate: Callable[[], Awaitable[bytes]]) -> bytes:
+        data = await generate()
+        try:
+            await self.put(key, data)
+        except OSError as e:
+            logger.error(f"Failed to store generated image {key}: {e}")
+        return data
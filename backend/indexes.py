@@ -0,0 +1,203 @@
+"""Index declarations and query-plan verification.
+
+``ensure_indexes`` runs from the app lifespan and creates every index below
+(``create_index`` is a no-op when an identical index already exists).
+``verify_query_plans`` runs ``explain()`` on each query shape the handlers
+issue and raises if any of them would scan a whole collection.
+
+Check mode from the command line::
+
+    python indexes.py --check
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, IndexModel
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        # Only for tokens issued before the sessions collection (LEGACY_SESSIONS)
+        IndexModel([("session_token", ASCENDING)], name="session_token", sparse=True),
+        IndexModel([("email", ASCENDING)], name="email", unique=True),
+        IndexModel([("id", ASCENDING)], name="id", unique=True),
+    ],
+    "emergency_alerts": [
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user_id", unique=True),
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="user_id_created_at_id"
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="user_id_status_created_at_id"
+        ),
+        IndexModel([("share_token", ASCENDING)], name="share_token", unique=True, sparse=True),
+        # Only active alerts, so dispatch searches don't grow with the history
+        IndexModel(
+            [("geo", GEOSPHERE)],
+            name="geo_active",
+            partialFilterExpression={"status": "active"}
+        ),
+    ],
+    # _id is the token hash; Mongo removes sessions once expires_at passes
+    "sessions": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING)], name="user_id_created_at"),
+    ],
+    "notification_outbox": [
+        IndexModel([("id", ASCENDING)], name="id", unique=True),
+        # Claims: both $or branches walk this in (priority, next_attempt_at) order
+        IndexModel(
+            [("status", ASCENDING), ("priority", ASCENDING), ("next_attempt_at", ASCENDING)],
+            name="status_priority_next_attempt_at"
+        ),
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)], name="status_lease_expires_at"),
+        IndexModel([("alert_id", ASCENDING)], name="alert_id"),
+        # Delivered entries are kept a week for auditing; failed ones stay
+        IndexModel([("sent_at", ASCENDING)], name="sent_at_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "geocode_cache": [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=30 * 24 * 3600),
+    ],
+    "image_jobs": [
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user_id", unique=True),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_id_status"),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+        IndexModel([("finished_at", ASCENDING)], name="finished_at_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "session_invalidations": [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=3600),
+    ],
+    "alert_trails": [
+        IndexModel([("alert_id", ASCENDING), ("start", ASCENDING)], name="alert_id_start"),
+    ],
+    # Replays of queued offline requests arrive within hours; keep keys a day
+    "idempotency_keys": [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=24 * 3600),
+    ],
+}
+
+# (collection, filter, sort) for every read the handlers issue. Values only
+# need the right types; the planner picks an index from the shape.
+_now = datetime.now(timezone.utc)
+QUERY_SHAPES: List[Tuple[str, Dict[str, Any], List[Tuple[str, int]]]] = [
+    ("sessions", {"_id": "x", "expires_at": {"$gt": _now}}, []),
+    ("sessions", {"user_id": "x", "expires_at": {"$gt": _now}}, [("created_at", ASCENDING)]),
+    ("sessions", {"user_id": "x", "id": "x"}, []),
+    ("users", {"session_token": "x", "session_expires": {"$gt": _now}}, []),
+    ("users", {"email": "x@example.com"}, []),
+    ("users", {"id": "x"}, []),
+    ("emergency_alerts", {"user_id": "x"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("emergency_alerts", {"user_id": "x", "status": "active"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    (
+        "emergency_alerts",
+        {"user_id": "x", "$or": [{"created_at": {"$lt": _now}}, {"created_at": _now, "id": {"$lt": "x"}}]},
+        [("created_at", DESCENDING), ("id", DESCENDING)]
+    ),
+    ("emergency_alerts", {"id": "x", "user_id": "x"}, []),
+    ("emergency_alerts", {"id": "x", "status": "active"}, []),
+    ("emergency_alerts", {"share_token": "x", "status": "active"}, []),
+    (
+        "emergency_alerts",
+        {"status": "active", "geo": {"$nearSphere": {
+            "$geometry": {"type": "Point", "coordinates": [0.0, 0.0]}, "$maxDistance": 1000
+        }}},
+        []
+    ),
+    ("alert_trails", {"alert_id": "x"}, [("start", ASCENDING)]),
+    ("alert_trails", {"alert_id": {"$in": ["x", "y"]}}, [("alert_id", ASCENDING), ("start", ASCENDING)]),
+    (
+        "notification_outbox",
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": _now}},
+            {"status": "in_flight", "lease_expires_at": {"$lte": _now}},
+        ]},
+        [("priority", ASCENDING), ("next_attempt_at", ASCENDING)]
+    ),
+    ("image_jobs", {"user_id": "x", "status": {"$in": ["queued", "running"]}}, []),
+    ("image_jobs", {"id": "x", "user_id": "x"}, []),
+    (
+        "image_jobs",
+        {"$or": [
+            {"status": "queued", "next_attempt_at": {"$not": {"$gt": _now}}},
+            {"status": "running", "lease_expires_at": {"$lte": _now}},
+        ]},
+        [("created_at", ASCENDING)]
+    ),
+]
+
+
+class CollectionScanError(RuntimeError):
+    """A handler query shape is not served by any index."""
+
+
+async def ensure_indexes(db) -> None:
+    """Create all declared indexes; failures are logged, not raised."""
+    for collection, models in INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except Exception as e:
+            logger.error(f"Index creation failed on {collection}: {e}")
+
+
+def _plan_stages(plan: Any) -> List[str]:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+async def verify_query_plans(db) -> List[Dict[str, Any]]:
+    """Explain every query shape; raise CollectionScanError on any COLLSCAN."""
+    report = []
+    for collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        stages = _plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        report.append({"collection": collection, "query": list(query), "stages": stages})
+        if "COLLSCAN" in stages:
+            raise CollectionScanError(
+                f"{collection} query on {list(query)} does a COLLSCAN ({' > '.join(stages)})"
+            )
+    return report
+
+
+async def _check() -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        await ensure_indexes(db)
+        for entry in await verify_query_plans(db):
+            print(f"OK   {entry['collection']} {entry['query']}: {' > '.join(entry['stages'])}")
+    except CollectionScanError as e:
+        print(f"FAIL {e}")
+        return 1
+    finally:
+        client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    if "--check" not in sys.argv:
+        print(__doc__)
+        sys.exit(2)
+    sys.exit(asyncio.run(_check()))
@@ -0,0 +1,54 @@
+"""Deferred construction of heavy optional clients.
+
+boto3, geopy and emergentintegrations take a large share of server start-up
+just to import. A ``LazyResource`` wraps the factory that imports and builds
+one of them: it runs once, on first use or when ``warm()`` is called from the
+lifespan so the work happens in the background after the server is already
+accepting requests. A factory returns ``None`` when the service isn't
+configured; a factory that raises is logged and treated the same way.
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+_UNSET = object()
+
+
+class LazyResource(Generic[T]):
+    def __init__(self, name: str, factory: Callable[[], Optional[T]]):
+        self.name = name
+        self.factory = factory
+        self._value: Any = _UNSET
+        self._lock = threading.Lock()
+        self._warming: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not _UNSET
+
+    def get(self) -> Optional[T]:
+        """Build on first call. Blocking; call from a thread or via ``aget``."""
+        if self._value is _UNSET:
+            with self._lock:
+                if self._value is _UNSET:
+                    try:
+                        self._value = self.factory()
+                    except Exception as e:
+                        logging.warning(f"{self.name} not configured: {e}")
+                        self._value = None
+        return self._value
+
+    async def aget(self) -> Optional[T]:
+        """``get`` without blocking the event loop"""
+        if self._value is not _UNSET:
+            return self._value
+        return await asyncio.to_thread(self.get)
+
+    def warm(self) -> asyncio.Task:
+        """Start building in the background; returns the task to await on"""
+        if self._warming is None:
+            self._warming = asyncio.create_task(self.aget())
+        return self._warming
@@ -0,0 +1,131 @@
+"""In-memory fan-out of live positions for active SOS alerts.
+
+The victim's device publishes positions for its alert; watchers holding the
+alert's share link subscribe. Per alert the hub keeps only the latest
+position and a version counter, never a backlog, so a slow watcher just
+skips intermediate points (coalescing) and each watcher gets at most one
+update per ``min_interval`` (throttling). A publish resolves one shared
+future that every waiting watcher awaits, so fan-out costs one wakeup per
+watcher and nothing per queued point. ``close`` ends every stream of an
+alert, e.g. when it is resolved.
+
+Channels live in the worker's memory: the publisher and the watchers of an
+alert must be served by the same worker process. With several workers, route
+``/api/emergency/alerts/{id}/live`` and ``/api/live/...`` to one worker, or
+stick them by alert. Watchers also re-check the alert's status on every
+heartbeat (``is_active``), so a resolve handled by another worker still ends
+their stream.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+
+class AlertChannel:
+    def __init__(self):
+        self.latest: Optional[Dict[str, Any]] = None
+        self.version = 0
+        self.closed = False
+        self.subscribers = 0
+        self.publishers = 0
+        self._changed: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def publish(self, position: Dict[str, Any]) -> None:
+        self.latest = position
+        self.version += 1
+        self._notify()
+
+    def close(self) -> None:
+        self.closed = True
+        self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.get_running_loop().create_future()
+        changed.set_result(None)
+
+    async def wait(self, timeout: float) -> bool:
+        """True when something changed, False on timeout"""
+        try:
+            await asyncio.wait_for(asyncio.shield(self._changed), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class LiveLocationHub:
+    def __init__(self, min_interval: float = 1.0, heartbeat: float = 15.0):
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+        self._channels: Dict[str, AlertChannel] = {}
+
+    def _channel(self, alert_id: str) -> AlertChannel:
+        channel = self._channels.get(alert_id)
+        if channel is None:
+            channel = self._channels[alert_id] = AlertChannel()
+        return channel
+
+    def _release(self, alert_id: str, channel: AlertChannel) -> None:
+        if channel.subscribers == 0 and channel.publishers == 0 and self._channels.get(alert_id) is channel:
+            del self._channels[alert_id]
+
+    def latest(self, alert_id: str) -> Optional[Dict[str, Any]]:
+        channel = self._channels.get(alert_id)
+        return channel.latest if channel else None
+
+    def attach_publisher(self, alert_id: str) -> AlertChannel:
+        channel = self._channel(alert_id)
+        channel.publishers += 1
+        return channel
+
+    def detach_publisher(self, alert_id: str, channel: AlertChannel) -> None:
+        channel.publishers -= 1
+        self._release(alert_id, channel)
+
+    def close(self, alert_id: str) -> None:
+        channel = self._channels.pop(alert_id, None)
+        if channel is not None:
+            channel.close()
+
+    def close_all(self) -> None:
+        for alert_id in list(self._channels):
+            self.close(alert_id)
+
+    async def watch(
+        self,
+        alert_id: str,
+        is_active: Callable[[], Awaitable[bool]],
+        initial: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Yield the latest position whenever it changes, at most once per
+        ``min_interval``; yields None as a heartbeat. Ends when the alert closes."""
+        loop = asyncio.get_running_loop()
+        channel = self._channel(alert_id)
+        channel.subscribers += 1
+        try:
+            seen = 0
+            if channel.latest is None and initial is not None:
+                yield initial
+            last_sent = loop.time() - self.min_interval
+            while not channel.closed:
+                if channel.version != seen:
+                    wait = last_sent + self.min_interval - loop.time()
+                    if wait > 0:
+                        # Anything published meanwhile replaces this point
+                        await asyncio.sleep(wait)
+                    seen = channel.version
+                    last_sent = loop.time()
+                    yield channel.latest
+                    continue
+                if not await channel.wait(self.heartbeat):
+                    if not await is_active():
+                        return
+                    yield None
+        finally:
+            channel.subscribers -= 1
+            self._release(alert_id, channel)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "channels": len(self._channels),
+            "subscribers": sum(c.subscribers for c in self._channels.values()),
+            "publishers": sum(c.publishers for c in self._channels.values()),
+        }
@@ -0,0 +1,183 @@
+"""Prometheus metrics for the API, MongoDB and external services.
+
+Everything lives in one registry, exposed by ``/api/metrics``:
+
+* ``aidly_http_request_duration_seconds`` / ``aidly_http_responses_total`` -
+  per route template (``/api/emergency/alerts/{alert_id}/resolve``, not the
+  raw path, so label cardinality stays bounded)
+* ``aidly_mongo_command_duration_seconds`` - every driver command, per
+  collection and command name, via pymongo command monitoring
+* ``aidly_external_call_duration_seconds`` - SNS publish, Nominatim, Emergent
+  Auth and image generation, with an outcome (ok/error; SNS reports
+  sent/timeout/failed)
+* ``aidly_event_loop_lag_seconds`` - how late a periodic wakeup fires; high
+  lag means something is blocking the loop
+
+Each worker process keeps its own values. When several workers serve the
+app, set ``PROMETHEUS_MULTIPROC_DIR`` to an empty directory shared by them
+and every scrape reports the aggregate of all workers.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from pymongo import monitoring
+
+from background import BackgroundLoop
+
+REGISTRY = CollectorRegistry()
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HTTP_LATENCY = Histogram(
+    "aidly_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY
+)
+HTTP_RESPONSES = Counter(
+    "aidly_http_responses_total",
+    "HTTP responses by route template and status code",
+    ["method", "route", "status"],
+    registry=REGISTRY
+)
+MONGO_LATENCY = Histogram(
+    "aidly_mongo_command_duration_seconds",
+    "MongoDB command latency as reported by the driver",
+    ["collection", "command"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY
+)
+MONGO_FAILURES = Counter(
+    "aidly_mongo_command_failures_total",
+    "MongoDB commands that failed",
+    ["collection", "command"],
+    registry=REGISTRY
+)
+EXTERNAL_LATENCY = Histogram(
+    "aidly_external_call_duration_seconds",
+    "Latency of calls to external services",
+    ["service", "outcome"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY
+)
+LOOP_LAG = Histogram(
+    "aidly_event_loop_lag_seconds",
+    "Delay between a scheduled event loop wakeup and when it ran",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+    registry=REGISTRY
+)
+LOOP_LAG_LAST = Gauge(
+    "aidly_event_loop_lag_last_seconds",
+    "Most recent event loop lag sample",
+    multiprocess_mode="livemax",
+    registry=REGISTRY
+)
+
+
+def render() -> Tuple[bytes, str]:
+    """Exposition body and content type"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """Drop this worker's live gauges on shutdown in multi-process mode"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def observe_request(method: str, route: str, status: int, seconds: float) -> None:
+    HTTP_LATENCY.labels(method, route).observe(seconds)
+    HTTP_RESPONSES.labels(method, route, str(status)).inc()
+
+
+def observe_external(service: str, outcome: str, seconds: float) -> None:
+    EXTERNAL_LATENCY.labels(service, outcome).observe(seconds)
+
+
+@contextmanager
+def track_external(service: str) -> Iterator[None]:
+    """Time a block calling ``service``; an exception marks it as an error"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        observe_external(service, outcome, time.perf_counter() - start)
+
+
+def timed(service: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap a blocking callable so each call is tracked as ``service``"""
+    def wrapper(*args, **kwargs):
+        with track_external(service):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Pass as ``event_listeners`` to the Motor client.
+
+    Succeeded/failed events don't carry the collection, so it is remembered
+    from the started event. Callbacks run on the driver's threads.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Tuple[int, Any], Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _collection(event: monitoring.CommandStartedEvent) -> str:
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        return target if isinstance(target, str) else "-"
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        with self._lock:
+            self._inflight[(event.request_id, event.connection_id)] = (
+                self._collection(event), event.command_name
+            )
+
+    def _finish(self, event) -> Tuple[str, str]:
+        with self._lock:
+            labels = self._inflight.pop((event.request_id, event.connection_id), None)
+        return labels or ("-", event.command_name)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        MONGO_LATENCY.labels(*self._finish(event)).observe(event.duration_micros / 1e6)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        labels = self._finish(event)
+        MONGO_LATENCY.labels(*labels).observe(event.duration_micros / 1e6)
+        MONGO_FAILURES.labels(*labels).inc()
+
+
+class EventLoopLagMonitor(BackgroundLoop):
+    """Sleeps ``interval`` seconds in a loop and records how late it wakes up"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_LAST.set(lag)
+            if lag > 1:
+                logging.warning(f"Event loop blocked for {lag:.2f}s")
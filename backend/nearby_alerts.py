@@ -0,0 +1,290 @@
+"""Active alerts near a point, for coordinator dispatch views.
+
+Alerts store their position twice: ``location`` as the client sent it, and
+``geo``, a GeoJSON point. ``geo`` has a 2dsphere index that only holds
+``status: active`` alerts (see ``indexes.py``), so a search costs in
+proportion to the active alerts rather than the whole history.
+``NearbyAlerts.search`` runs one ``$geoNear`` per page. It covers a radius
+or a bounding box, returns the nearest alerts first, and pages on a
+``(distance, id)`` keyset.
+
+Pages are cached per exact query. The map is divided into cells of
+``cell_degrees`` and each cell has a generation counter in
+``alert_area_generations``. Creating or resolving an alert bumps the
+counter of its cell (``touch``). A cached page records the generations of
+the cells under its area and is served only while they are unchanged. That
+check is one ``_id`` lookup, on every worker, instead of the ``$geoNear``.
+Areas spanning more than ``max_cells`` cells are not cached, and ``ttl``
+bounds staleness if a bump is lost.
+"""
+import logging
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from cachetools import TTLCache
+from pymongo import UpdateOne
+
+from cursors import decode_cursor, encode_cursor
+from geo import EARTH_RADIUS_M, haversine_m
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+AREA_GENERATIONS_COLLECTION = "alert_area_generations"
+
+METERS_PER_DEGREE = 111320.0
+
+# (min_lon, min_lat, max_lon, max_lat)
+BBox = Tuple[float, float, float, float]
+
+NEARBY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "user_id": 1,
+    "emergency_type": 1,
+    "location": 1,
+    "message": 1,
+    "created_at": 1,
+    "status": 1,
+    "distance": 1,
+}
+
+
+def geo_point(latitude: float, longitude: float) -> Dict[str, Any]:
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+def alert_geo(latitude: float, longitude: float) -> Optional[Dict[str, Any]]:
+    """``geo`` for an alert, or None for coordinates the 2dsphere index would
+    reject (a GPS glitch must never make the SOS insert fail)"""
+    if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+        return geo_point(latitude, longitude)
+    return None
+
+
+def parse_bbox(raw: str) -> BBox:
+    """``min_lon,min_lat,max_lon,max_lat``; raises ValueError"""
+    parts = [float(part) for part in raw.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox needs four numbers")
+    min_lon, min_lat, max_lon, max_lat = parts
+    if not (-180 <= min_lon < max_lon <= 180 and -90 <= min_lat < max_lat <= 90):
+        raise ValueError("bbox out of range")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def radius_bbox(latitude: float, longitude: float, radius_m: float) -> BBox:
+    """A box containing the circle; whole longitude range near poles or the antimeridian"""
+    dlat = radius_m / METERS_PER_DEGREE
+    cos_lat = math.cos(math.radians(latitude))
+    dlon = dlat / cos_lat if cos_lat > 1e-6 else 360.0
+    min_lon, max_lon = longitude - dlon, longitude + dlon
+    if min_lon < -180 or max_lon > 180:
+        min_lon, max_lon = -180.0, 180.0
+    return min_lon, max(-90.0, latitude - dlat), max_lon, min(90.0, latitude + dlat)
+
+
+def bbox_radius(latitude: float, longitude: float, bbox: BBox) -> float:
+    """Distance from the point to the farthest corner of ``bbox``, so a
+    ``$geoNear`` bounded by it covers the whole box"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    farthest = max(
+        haversine_m(latitude, longitude, lat, lon)
+        for lat in (min_lat, max_lat) for lon in (min_lon, max_lon)
+    )
+    # Headroom for rounding differences with the server's distance
+    return min(farthest * 1.001 + 1, math.pi * EARTH_RADIUS_M)
+
+
+def encode_nearby_cursor(alert: Dict[str, Any]) -> str:
+    """Opaque continuation token for the (distance, id) keyset"""
+    return encode_cursor({"d": alert["distance"], "i": alert["id"]})
+
+
+def decode_nearby_cursor(cursor: str) -> Tuple[float, str]:
+    """Raises ValueError on a malformed token"""
+    raw = decode_cursor(cursor)
+    try:
+        return float(raw["d"]), str(raw["i"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+class NearbyAlerts:
+    def __init__(
+        self,
+        db,
+        cell_degrees: float = 0.5,
+        max_cells: int = 16,
+        max_size: int = 1024,
+        ttl: float = 30.0
+    ):
+        self.alerts = db.emergency_alerts
+        self.generations = db[AREA_GENERATIONS_COLLECTION]
+        self.cell_degrees = cell_degrees
+        self.max_cells = max_cells
+        # query -> (cell generations, page)
+        self._pages: TTLCache = TTLCache(maxsize=max_size, ttl=ttl)
+        self._flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def cell(self, latitude: float, longitude: float) -> str:
+        return f"{math.floor(latitude / self.cell_degrees)}:{math.floor(longitude / self.cell_degrees)}"
+
+    def cells(self, bbox: BBox) -> Optional[List[str]]:
+        """Cells under ``bbox``, or None when there are more than ``max_cells``"""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        rows = range(math.floor(min_lat / self.cell_degrees), math.floor(max_lat / self.cell_degrees) + 1)
+        cols = range(math.floor(min_lon / self.cell_degrees), math.floor(max_lon / self.cell_degrees) + 1)
+        if len(rows) * len(cols) > self.max_cells:
+            return None
+        return [f"{row}:{col}" for row in rows for col in cols]
+
+    async def touch(self, points: Iterable[Optional[Dict[str, Any]]]) -> None:
+        """Bump the cells of changed alerts' ``geo`` points; call after the write"""
+        cells = sorted({
+            self.cell(point["coordinates"][1], point["coordinates"][0])
+            for point in points if point
+        })
+        if not cells:
+            return
+        try:
+            await self.generations.bulk_write([
+                UpdateOne({"_id": cell}, {"$inc": {"generation": 1}}, upsert=True)
+                for cell in cells
+            ], ordered=False)
+        except Exception as e:
+            # Cached pages of these cells stay stale until they expire
+            logger.error(f"Failed to bump alert area generations {cells}: {e}")
+
+    async def backfill(self) -> int:
+        """Add ``geo`` to active alerts stored before it existed"""
+        result = await self.alerts.update_many(
+            {
+                "status": "active",
+                "geo": {"$exists": False},
+                "location.latitude": {"$type": "number", "$gte": -90, "$lte": 90},
+                "location.longitude": {"$type": "number", "$gte": -180, "$lte": 180},
+            },
+            [{"$set": {"geo": {
+                "type": "Point",
+                "coordinates": ["$location.longitude", "$location.latitude"],
+            }}}]
+        )
+        if result.modified_count:
+            logger.info(f"Backfilled geo on {result.modified_count} active alerts")
+        return result.modified_count
+
+    async def search(
+        self,
+        latitude: float,
+        longitude: float,
+        radius_m: Optional[float] = None,
+        bbox: Optional[BBox] = None,
+        limit: int = 50,
+        after: Optional[Tuple[float, str]] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """``(alerts nearest first, next cursor)`` within ``radius_m`` and/or ``bbox``"""
+        area = bbox if bbox is not None else radius_bbox(latitude, longitude, radius_m)
+        cells = self.cells(area)
+        if cells is None:
+            self.misses += 1
+            return await self._query(latitude, longitude, radius_m, bbox, limit, after)
+
+        generations = await self._generations(cells)
+        key = (latitude, longitude, radius_m, bbox, limit, after)
+        entry = self._pages.get(key)
+        if entry is not None and entry[0] == generations:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        page = await self._flights.run(
+            (key, generations), lambda: self._query(latitude, longitude, radius_m, bbox, limit, after)
+        )
+        self._pages[key] = (generations, page)
+        return page
+
+    async def _generations(self, cells: List[str]) -> Tuple[int, ...]:
+        found = {
+            doc["_id"]: doc["generation"]
+            async for doc in self.generations.find({"_id": {"$in": cells}})
+        }
+        return tuple(found.get(cell, 0) for cell in cells)
+
+    async def _query(
+        self,
+        latitude: float,
+        longitude: float,
+        radius_m: Optional[float],
+        bbox: Optional[BBox],
+        limit: int,
+        after: Optional[Tuple[float, str]]
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        max_distance = radius_m
+        if bbox is not None:
+            # Bounds the index walk to the box instead of every active alert
+            box_radius = bbox_radius(latitude, longitude, bbox)
+            max_distance = box_radius if max_distance is None else min(max_distance, box_radius)
+        # $geoNear streams nearest first; one extra row tells us whether there is another page
+        alerts = await self._near(latitude, longitude, bbox, after, None, max_distance, limit + 1)
+        # Equal distances come back in no particular order; the keyset needs (distance, id)
+        alerts.sort(key=lambda alert: (alert["distance"], alert["id"]))
+        if len(alerts) > limit and alerts[limit - 1]["distance"] == alerts[limit]["distance"]:
+            # A tie straddles the page end and may be cut short: fetch all of it
+            tie = alerts[limit]["distance"]
+            ties = await self._near(latitude, longitude, bbox, after, tie, tie, None)
+            merged = {alert["id"]: alert for alert in alerts + ties}
+            alerts = sorted(merged.values(), key=lambda alert: (alert["distance"], alert["id"]))
+        next_cursor = None
+        if len(alerts) > limit:
+            alerts = alerts[:limit]
+            next_cursor = encode_nearby_cursor(alerts[-1])
+        return alerts, next_cursor
+
+    async def _near(
+        self,
+        latitude: float,
+        longitude: float,
+        bbox: Optional[BBox],
+        after: Optional[Tuple[float, str]],
+        min_distance: Optional[float],
+        max_distance: Optional[float],
+        limit: Optional[int]
+    ) -> List[Dict[str, Any]]:
+        geo_near: Dict[str, Any] = {
+            "near": geo_point(latitude, longitude),
+            "key": "geo",
+            "distanceField": "distance",
+            "spherical": True,
+            # Matches the partial index filter, so only active alerts are read
+            "query": {"status": "active"},
+        }
+        if after is not None:
+            min_distance = after[0] if min_distance is None else max(min_distance, after[0])
+        if min_distance is not None:
+            geo_near["minDistance"] = min_distance
+        if max_distance is not None:
+            geo_near["maxDistance"] = max_distance
+        pipeline: List[Dict[str, Any]] = [{"$geoNear": geo_near}]
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            # A plain lat/lon box; a GeoJSON polygon would bend its edges along great circles
+            pipeline.append({"$match": {
+                "geo.coordinates.0": {"$gte": min_lon, "$lte": max_lon},
+                "geo.coordinates.1": {"$gte": min_lat, "$lte": max_lat},
+            }})
+        if after is not None:
+            distance, alert_id = after
+            pipeline.append({"$match": {"$or": [
+                {"distance": {"$gt": distance}},
+                {"distance": distance, "id": {"$gt": alert_id}},
+            ]}})
+        if limit is not None:
+            pipeline.append({"$limit": limit})
+        pipeline.append({"$project": NEARBY_PROJECTION})
+        return await self.alerts.aggregate(pipeline).to_list(limit)
+
+    def stats(self) -> Dict[str, int]:
+        return {"cached_pages": len(self._pages), "hits": self.hits, "misses": self.misses}
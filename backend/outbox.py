@@ -0,0 +1,296 @@
+"""Durable outbox for SOS notifications.
+
+``trigger_sos`` writes one outbox entry per contact alongside the alert and
+returns immediately. ``OutboxDispatcher`` runs in every worker and drains the
+outbox: it claims a batch of due entries under a time-limited lease, publishes
+them through SNS and either marks them sent (adding the contact to the alert's
+``contacts_notified``) or reschedules them with exponential backoff. An entry
+whose lease runs out, e.g. because its worker died mid-send, becomes claimable
+again. Within an alert, entries go out in priority waves: every priority 1
+contact concurrently, then priority 2, and so on. The lease on an alert's
+remaining entries is renewed before each wave, so a slow alert is never
+reclaimed and sent twice by another worker while it is still being worked.
+
+A publish that times out may still be delivered by its thread, so it is not
+retried like a failure: the entry is marked ``uncertain`` and rescheduled
+after ``uncertain_backoff``, and if the late publish succeeds first the entry
+is marked sent instead.
+
+The dispatcher only needs an object with a boto3-style ``publish`` method, so
+it runs unchanged against a local SNS stub (``SNS_ENDPOINT_URL``).
+"""
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from concurrent.futures import Executor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Set
+
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+
+from background import BackgroundLoop, retry_delay
+from sms import publish_sms
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_COLLECTION = "notification_outbox"
+
+
+def build_outbox_entries(alert_id: str, contacts: List[Dict[str, Any]], message: str) -> List[Dict[str, Any]]:
+    """One pending entry per contact, ordered by contact priority."""
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "alert_id": alert_id,
+            "contact_id": contact["id"],
+            "contact_name": contact["name"],
+            "phone": contact["phone"],
+            "priority": contact.get("priority", 1),
+            "message": message,
+            "status": "pending",  # "pending", "in_flight", "sent", "failed"
+            "attempts": 0,
+            "next_attempt_at": now,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "last_error": None,
+            "uncertain": False,
+            "created_at": now,
+        }
+        for contact in sorted(contacts, key=lambda c: c.get("priority", 1))
+    ]
+
+
+async def insert_alerts_with_outbox(
+    client,
+    db,
+    alerts: List[Dict[str, Any]],
+    entries: List[Dict[str, Any]]
+) -> None:
+    """Insert alerts and their outbox entries in one transaction when possible.
+
+    Standalone servers don't support transactions; there the alerts are written
+    first and the entries right after them.
+    """
+    try:
+        async with await client.start_session() as session:
+            async with session.start_transaction():
+                await db.emergency_alerts.insert_many(alerts, session=session)
+                if entries:
+                    await db[OUTBOX_COLLECTION].insert_many(entries, session=session)
+        return
+    except OperationFailure as e:
+        # 20 = IllegalOperation: transactions need a replica set or mongos
+        if e.code != 20:
+            raise
+
+    await db.emergency_alerts.insert_many(alerts)
+    if entries:
+        await db[OUTBOX_COLLECTION].insert_many(entries)
+
+
+class OutboxDispatcher(BackgroundLoop):
+    """Background drain loop for the notification outbox."""
+
+    def __init__(
+        self,
+        db,
+        sns_client,
+        executor: Executor,
+        batch_size: int = 20,
+        lease_seconds: float = 30.0,
+        max_attempts: int = 6,
+        base_backoff: float = 2.0,
+        max_backoff: float = 300.0,
+        publish_timeout: float = 5.0,
+        uncertain_backoff: float = 120.0,
+        idle_interval: float = 1.0
+    ):
+        self.db = db
+        self.outbox = db[OUTBOX_COLLECTION]
+        self.sns_client = sns_client
+        self.executor = executor
+        self.batch_size = batch_size
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.publish_timeout = publish_timeout
+        self.uncertain_backoff = uncertain_backoff
+        self.idle_interval = idle_interval
+        self.worker_id = uuid.uuid4().hex
+        self._wakeup = asyncio.Event()
+        self._late: Set[asyncio.Task] = set()
+
+    def wake(self) -> None:
+        """Start draining now instead of at the next idle tick."""
+        self._wakeup.set()
+
+    def backoff(self, attempts: int) -> float:
+        return retry_delay(attempts, self.base_backoff, self.max_backoff)
+
+    async def claim_batch(self) -> List[Dict[str, Any]]:
+        claimed = []
+        for _ in range(self.batch_size):
+            now = datetime.now(timezone.utc)
+            entry = await self.outbox.find_one_and_update(
+                {
+                    "$or": [
+                        {"status": "pending", "next_attempt_at": {"$lte": now}},
+                        {"status": "in_flight", "lease_expires_at": {"$lte": now}},
+                    ]
+                },
+                {
+                    "$set": {
+                        "status": "in_flight",
+                        "lease_owner": self.worker_id,
+                        "lease_expires_at": now + self.lease,
+                    },
+                    "$inc": {"attempts": 1},
+                },
+                projection={"_id": 0},
+                sort=[("priority", 1), ("next_attempt_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if entry is None:
+                break
+            claimed.append(entry)
+        return claimed
+
+    async def renew_lease(self, ids: Iterable[str]) -> Set[str]:
+        """Extend the lease on the given entries; returns the ids still held."""
+        held = {"id": {"$in": list(ids)}, "status": "in_flight", "lease_owner": self.worker_id}
+        await self.outbox.update_many(
+            held, {"$set": {"lease_expires_at": datetime.now(timezone.utc) + self.lease}}
+        )
+        return {doc["id"] async for doc in self.outbox.find(held, {"_id": 0, "id": 1})}
+
+    async def deliver(self, entry: Dict[str, Any]) -> bool:
+        result = await publish_sms(
+            self.sns_client, self.executor, entry["phone"], entry["message"], self.publish_timeout
+        )
+        now = datetime.now(timezone.utc)
+        owned = {"id": entry["id"], "lease_owner": self.worker_id}
+
+        if result["status"] == "sent":
+            logger.info(f"SMS sent to {entry['contact_name']}: {result['message_id']}")
+            await self.outbox.update_one(owned, {"$set": {
+                "status": "sent",
+                "sent_at": now,
+                "message_id": result["message_id"],
+                "lease_expires_at": None,
+                "uncertain": False,
+            }})
+            await self.db.emergency_alerts.update_one(
+                {"id": entry["alert_id"]},
+                {"$addToSet": {"contacts_notified": entry["contact_id"]}}
+            )
+            return True
+
+        if result["status"] == "timeout":
+            logger.warning(
+                f"SMS to {entry['contact_name']} timed out and may still be delivered "
+                f"(attempt {entry['attempts']}/{self.max_attempts})"
+            )
+            retry_in = max(self.uncertain_backoff, self.backoff(entry["attempts"]))
+            await self.outbox.update_one(owned, {"$set": {
+                "status": "failed" if entry["attempts"] >= self.max_attempts else "pending",
+                "uncertain": True,
+                "last_error": result["error"],
+                "next_attempt_at": now + timedelta(seconds=retry_in),
+                "lease_expires_at": None,
+            }})
+            task = asyncio.create_task(self._settle_late(entry, result["late"]))
+            self._late.add(task)
+            task.add_done_callback(self._late.discard)
+            return False
+
+        logger.error(
+            f"Failed to send SMS to {entry['contact_name']} "
+            f"(attempt {entry['attempts']}/{self.max_attempts}): {result['error']}"
+        )
+        if entry["attempts"] >= self.max_attempts:
+            update = {"status": "failed", "last_error": result["error"], "lease_expires_at": None}
+        else:
+            update = {
+                "status": "pending",
+                "last_error": result["error"],
+                "next_attempt_at": now + timedelta(seconds=self.backoff(entry["attempts"])),
+                "lease_expires_at": None,
+            }
+        await self.outbox.update_one(owned, {"$set": update})
+        return False
+
+    async def _settle_late(self, entry: Dict[str, Any], late: "asyncio.Future") -> None:
+        """Mark a timed-out entry sent if its publish completes before the retry."""
+        try:
+            response = await asyncio.wait_for(late, timeout=self.uncertain_backoff)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return
+        # Same attempt still waiting for its retry; a retry in progress has
+        # bumped attempts and will record its own outcome
+        result = await self.outbox.update_one(
+            {"id": entry["id"], "uncertain": True, "attempts": entry["attempts"],
+             "status": {"$in": ["pending", "failed"]}},
+            {"$set": {
+                "status": "sent",
+                "sent_at": datetime.now(timezone.utc),
+                "message_id": response.get("MessageId"),
+                "uncertain": False,
+            }}
+        )
+        if result.modified_count:
+            logger.info(f"Late SMS delivery to {entry['contact_name']} confirmed")
+            await self.db.emergency_alerts.update_one(
+                {"id": entry["alert_id"]},
+                {"$addToSet": {"contacts_notified": entry["contact_id"]}}
+            )
+
+    async def deliver_in_waves(self, entries: List[Dict[str, Any]]) -> None:
+        """Deliver one alert's entries a priority at a time, each wave concurrently."""
+        waves: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        for entry in entries:
+            waves[entry["priority"]].append(entry)
+        remaining = [entry["id"] for entry in entries]
+        for priority in sorted(waves):
+            # Earlier waves may have used up most of the claim's lease
+            held = await self.renew_lease(remaining)
+            wave = [entry for entry in waves[priority] if entry["id"] in held]
+            await asyncio.gather(*(self.deliver(entry) for entry in wave))
+            done = {entry["id"] for entry in waves[priority]}
+            remaining = [entry_id for entry_id in remaining if entry_id not in done]
+
+    async def drain_once(self) -> int:
+        """Claim and deliver one batch; returns the number of entries claimed."""
+        batch = await self.claim_batch()
+        by_alert: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for entry in batch:
+            by_alert[entry["alert_id"]].append(entry)
+        # Alerts are independent; within one, priority 1 contacts go out first
+        await asyncio.gather(*(self.deliver_in_waves(entries) for entries in by_alert.values()))
+        return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                claimed = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox dispatch error: {e}")
+                claimed = 0
+            if claimed == 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def stop(self) -> None:
+        for task in list(self._late):
+            task.cancel()
+        await super().stop()
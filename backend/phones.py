@@ -0,0 +1,38 @@
+"""Phone number normalization shared by profile and contact endpoints.
+
+Results are memoized, so importing a phone book where the same numbers recur
+(or re-importing it) parses each distinct number once per worker.
+"""
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import phonenumbers
+from phonenumbers import NumberParseException
+
+
+@lru_cache(maxsize=8192)
+def normalize_phone(raw: str, region: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    """Return ``(e164, None)`` for a valid number or ``(None, error)``.
+
+    ``region`` is an ISO 3166 alpha-2 code used for numbers written without
+    a ``+`` country prefix.
+    """
+    try:
+        parsed = phonenumbers.parse(raw, region)
+    except NumberParseException:
+        return None, "Invalid phone number format"
+    if not phonenumbers.is_valid_number(parsed):
+        return None, "Invalid phone number"
+    return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164), None
+
+
+def region_for_phone(phone: Optional[str]) -> Optional[str]:
+    """Region of an already-normalized number, e.g. the user's own phone."""
+    if not phone:
+        return None
+    try:
+        region = phonenumbers.region_code_for_number(phonenumbers.parse(phone, None))
+    except NumberParseException:
+        return None
+    # "ZZ" is phonenumbers' unknown region
+    return region if region and region != "ZZ" else None
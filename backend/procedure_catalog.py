@@ -0,0 +1,120 @@
+"""Precompiled, immutable medical procedure catalog.
+
+The catalog is compiled once: every response the procedure endpoints can
+return (full list, each category, each procedure) is serialized to JSON,
+compressed with gzip and, when the optional ``brotli`` package is installed,
+brotli, and tagged with a content-hash ETag. Each encoding is a different
+representation and gets its own strong ETag (``"<hash>"``, ``"<hash>-gz"``,
+``"<hash>-br"``), so caches never serve one encoding's bytes for another's
+validator. Serving a request is then a dict lookup plus picking the right
+pre-built body, or a 304 when the client's ``If-None-Match`` still matches.
+"""
+import gzip
+import hashlib
+import json
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, Mapping, Optional
+
+from fastapi import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CACHE_CONTROL = "public, max-age=300"
+
+
+class CompiledBody:
+    """A JSON payload in every encoding we serve, plus its ETags."""
+
+    __slots__ = ("identity", "gzip", "br", "etag")
+
+    def __init__(self, payload: Any):
+        self.identity = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.gzip = gzip.compress(self.identity, compresslevel=9, mtime=0)
+        self.br = brotli.compress(self.identity) if brotli else None
+        # The identity representation's; also the payload's content hash
+        self.etag = '"' + hashlib.sha256(self.identity).hexdigest()[:32] + '"'
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        suffix = {"gzip": "-gz", "br": "-br"}.get(encoding, "")
+        return self.etag[:-1] + suffix + '"'
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if token:
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+class ProcedureCatalog:
+    def __init__(self, procedures: Iterable[Dict[str, Any]]):
+        procedures = list(procedures)
+        self.procedures = tuple(_freeze(p) for p in procedures)
+        self.by_id: Mapping[str, Any] = MappingProxyType({p["id"]: p for p in self.procedures})
+
+        categories: Dict[str, list] = {}
+        for procedure in procedures:
+            categories.setdefault(procedure["category"], []).append(procedure)
+        self.by_category: Mapping[str, tuple] = MappingProxyType({
+            category: tuple(self.by_id[p["id"]] for p in members)
+            for category, members in categories.items()
+        })
+
+        self._list_body = CompiledBody(procedures)
+        self._empty_body = CompiledBody([])
+        self._category_bodies = MappingProxyType({
+            category: CompiledBody(members) for category, members in categories.items()
+        })
+        self._procedure_bodies = MappingProxyType({p["id"]: CompiledBody(p) for p in procedures})
+
+    def list_body(self, category: Optional[str] = None) -> CompiledBody:
+        if category is None:
+            return self._list_body
+        return self._category_bodies.get(category, self._empty_body)
+
+    def procedure_body(self, procedure_id: str) -> Optional[CompiledBody]:
+        return self._procedure_bodies.get(procedure_id)
+
+    @staticmethod
+    def respond(body: CompiledBody, headers: Mapping[str, str]) -> Response:
+        """Build the cheapest response for the request headers."""
+        accepted = _accepted_encodings(headers.get("accept-encoding", ""))
+        encoding, content = None, body.identity
+        if body.br is not None and "br" in accepted:
+            encoding, content = "br", body.br
+        elif "gzip" in accepted:
+            encoding, content = "gzip", body.gzip
+
+        response_headers = {
+            "ETag": body.etag_for(encoding),
+            "Cache-Control": CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, response_headers["ETag"]):
+            return Response(status_code=304, headers=response_headers)
+        if encoding:
+            response_headers["Content-Encoding"] = encoding
+        return Response(content=content, media_type="application/json", headers=response_headers)
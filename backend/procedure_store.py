@@ -0,0 +1,142 @@
+"""Versioned on-disk store for medical procedures.
+
+Each procedure is one JSON file in ``content/procedures``. The store polls
+the directory and rebuilds its ``ProcedureCatalog`` when a file is added,
+removed or modified, so content updates ship without a redeploy.
+
+Sync is driven by content hashes, never by the editor-maintained
+``version`` field: an edit that forgets to bump it, or a new procedure with a
+low version, still changes a hash. The store ``revision`` is a hash of every
+``(id, hash)`` pair, so it changes whenever any procedure does. Offline
+clients sync with two small documents:
+
+* the manifest: revision plus ``{id: {version, hash}}`` per procedure
+* the delta for a list of ids: full bodies and hashes of those procedures
+  (all of them when no ids are given), plus the list of current ids so
+  clients can prune
+
+A client compares the manifest hashes with the ones it stored and asks the
+delta for the ids that are missing or differ.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from background import BackgroundLoop
+from procedure_catalog import CompiledBody, ProcedureCatalog
+
+logger = logging.getLogger(__name__)
+
+
+def revision(hashes: Dict[str, str]) -> str:
+    """Content revision of a set of procedures, from their ids and hashes"""
+    digest = hashlib.sha256()
+    for procedure_id in sorted(hashes):
+        digest.update(f"{procedure_id}\0{hashes[procedure_id]}\n".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+class ProcedureStore(BackgroundLoop):
+    def __init__(
+        self,
+        directory: Path,
+        validate: Optional[Callable[[Dict[str, Any]], Any]] = None,
+        poll_interval: float = 5.0
+    ):
+        self.directory = Path(directory)
+        self.validate = validate
+        self.poll_interval = poll_interval
+        self.revision = revision({})
+        self.catalog = ProcedureCatalog([])
+        self.manifest_body = CompiledBody({"revision": self.revision, "procedures": {}})
+        self._procedures: List[Dict[str, Any]] = []
+        self._hashes: Dict[str, str] = {}
+        self._signature: Tuple = ()
+        self._full_delta: Optional[CompiledBody] = None
+        self.reload()
+
+    def _scan(self) -> Tuple:
+        return tuple(sorted(
+            (path.name, stat.st_mtime_ns, stat.st_size)
+            for path in self.directory.glob("*.json")
+            for stat in (path.stat(),)
+        ))
+
+    def reload(self) -> bool:
+        """Rebuild from disk if anything changed; keeps the old content on error."""
+        signature = self._scan()
+        if signature == self._signature:
+            return False
+
+        try:
+            procedures = []
+            sources: Dict[str, str] = {}
+            for path in sorted(self.directory.glob("*.json")):
+                with open(path, encoding="utf-8") as f:
+                    procedure = json.load(f)
+                if self.validate:
+                    self.validate(procedure)
+                # Two files with one id would silently shadow each other
+                if procedure["id"] in sources:
+                    raise ValueError(
+                        f"duplicate procedure id {procedure['id']!r} in {sources[procedure['id']]} and {path.name}"
+                    )
+                sources[procedure["id"]] = path.name
+                procedures.append(procedure)
+        except Exception as e:
+            logger.error(f"Procedure content reload failed, keeping revision {self.revision}: {e}")
+            return False
+
+        procedures.sort(key=lambda p: (p.get("order", 0), p["id"]))
+        catalog = ProcedureCatalog(procedures)
+        hashes = {p["id"]: catalog.procedure_body(p["id"]).etag.strip('"') for p in procedures}
+        current = revision(hashes)
+        manifest = {
+            "revision": current,
+            "procedures": {
+                p["id"]: {"version": p.get("version"), "hash": hashes[p["id"]]}
+                for p in procedures
+            },
+        }
+
+        # Swap everything at once; readers never see a half-built store
+        self.catalog, self.manifest_body, self._procedures, self._hashes, self.revision, self._full_delta, self._signature = (
+            catalog, CompiledBody(manifest), procedures, hashes, current, None, signature
+        )
+        logger.info(f"Loaded {len(procedures)} procedures at content revision {current}")
+        return True
+
+    def delta_body(self, ids: Optional[Iterable[str]] = None) -> CompiledBody:
+        """Bodies and hashes of ``ids`` (every procedure when None); unknown ids are skipped"""
+        if ids is None:
+            if self._full_delta is None:
+                self._full_delta = self._delta(self._procedures)
+            return self._full_delta
+        wanted = set(ids)
+        return self._delta([p for p in self._procedures if p["id"] in wanted])
+
+    def _delta(self, procedures: List[Dict[str, Any]]) -> CompiledBody:
+        return CompiledBody({
+            "revision": self.revision,
+            "procedures": procedures,
+            "hashes": {p["id"]: self._hashes[p["id"]] for p in procedures},
+            "ids": [p["id"] for p in self._procedures],
+        })
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await asyncio.to_thread(self.reload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Procedure content poll failed: {e}")
+
+    def start(self) -> None:
+        # A poll interval of 0 turns hot reloading off
+        if self.poll_interval > 0:
+            super().start()
@@ -0,0 +1,43 @@
+"""Rate limits shared by every worker process.
+
+An in-process throttle only spaces calls made by one worker; with N workers
+an external service sees N times the intended rate. ``SharedRateLimiter``
+keeps the next free slot for a limit in the ``rate_limits`` collection. Each
+caller reserves a slot with one atomic update (the slot is
+``max(next_at, now)``, and ``next_at`` moves one interval past it) and then
+sleeps until its slot comes up, so callers across all workers are spaced
+``min_interval`` apart and served in arrival order.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+
+RATE_LIMITS_COLLECTION = "rate_limits"
+
+
+class SharedRateLimiter:
+    def __init__(self, db, name: str, min_interval: float):
+        self.collection = db[RATE_LIMITS_COLLECTION]
+        self.name = name
+        self.interval = timedelta(seconds=min_interval)
+
+    async def acquire(self) -> None:
+        """Wait for this caller's turn"""
+        now = datetime.now(timezone.utc)
+        doc = await self.collection.find_one_and_update(
+            {"_id": self.name},
+            [{"$set": {"next_at": {"$add": [
+                {"$max": [{"$ifNull": ["$next_at", now]}, now]},
+                int(self.interval.total_seconds() * 1000)
+            ]}}}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        next_at = doc["next_at"]
+        if next_at.tzinfo is None:
+            # Motor returns naive UTC datetimes unless the client is tz_aware
+            next_at = next_at.replace(tzinfo=timezone.utc)
+        wait = (next_at - self.interval - datetime.now(timezone.utc)).total_seconds()
+        if wait > 0:
+            await asyncio.sleep(wait)
@@ -1,63 +1,371 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Response, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
-from emergentintegrations.llm.openai.image_generation import OpenAIImageGeneration
 import os
 import logging
-import base64
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, EmailStr, ValidationError
+from typing import List, Optional, Dict, Any, Awaitable, Callable, Tuple
 import uuid
+import secrets
 from datetime import datetime, timezone, timedelta
-import boto3
-from botocore.exceptions import ClientError
-import phonenumbers
-from phonenumbers import NumberParseException
-from geopy.geocoders import Nominatim
+from concurrent.futures import ThreadPoolExecutor
 import json
 import aiohttp
 import asyncio
-from jose import jwt
-from passlib.context import CryptContext
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from types import SimpleNamespace
+from cachetools import TTLCache
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from session_cache import SessionCache, SessionInvalidationFeed
+from sessions import SESSION_PROJECTION, SessionStore, token_hash
+from indexes import ensure_indexes, verify_query_plans
+from outbox import OutboxDispatcher, build_outbox_entries, insert_alerts_with_outbox
+from geocode_cache import ReverseGeocodeCache
+from procedure_store import ProcedureStore
+from image_store import ImageStore, image_key, is_image_key, sniff_media_type
+from image_jobs import ImageJobQueue, QuotaExceeded
+from phones import normalize_phone, region_for_phone
+from fast_json import FastJSONResponse, dumps, fast_response
+import metrics
+from lazy import LazyResource
+from rate_limits import SharedRateLimiter
+from live_location import LiveLocationHub
+from alert_trails import TrailWriter, downsample, trail_point
+from country_index import CountryIndex
+from emergency_numbers import emergency_number
+from nearby_alerts import NearbyAlerts, alert_geo, decode_nearby_cursor, parse_bbox
+from cursors import decode_cursor, encode_cursor
+from idempotency import IdempotencyInProgress, IdempotencyKeyReused, IdempotencyStore, request_hash
+from app_state import BindResources, ResourceProxy, bind
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Every client and cache is created by init_resources() from the app's
+# lifespan, never at import, and kept on app.state.resources. Under a
+# multi-worker server each process builds its own after the fork. These names
+# forward to the resources of the app being served (see app_state.py).
+client = ResourceProxy("client")
+db = ResourceProxy("db")
+http_session = ResourceProxy("http_session")
+session_data_cache = ResourceProxy("session_data_cache")
+session_cache = ResourceProxy("session_cache")
+session_invalidations = ResourceProxy("session_invalidations")
+sessions = ResourceProxy("sessions")
+geolocator = ResourceProxy("geolocator")
+geocode_cache = ResourceProxy("geocode_cache")
+sns = ResourceProxy("sns")
+sns_executor = ResourceProxy("sns_executor")
+outbox_dispatcher = ResourceProxy("outbox_dispatcher")
+image_generator = ResourceProxy("image_generator")
+image_store = ResourceProxy("image_store")
+image_jobs = ResourceProxy("image_jobs")
+procedure_store = ResourceProxy("procedure_store")
+event_loop_lag = ResourceProxy("event_loop_lag")
+idempotency = ResourceProxy("idempotency")
+live_hub = ResourceProxy("live_hub")
+trail_writer = ResourceProxy("trail_writer")
+nearby_alerts = ResourceProxy("nearby_alerts")
+country_index = ResourceProxy("country_index")
 
-# Initialize services
 security = HTTPBearer(auto_error=False)
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-geolocator = Nominatim(user_agent="aidly_emergency_app")
+
+# boto3, geopy and emergentintegrations are slow to import; each client is
+# built on first use or warmed in the background by the lifespan
+def create_geolocator():
+    from geopy.geocoders import Nominatim
+    return Nominatim(
+        user_agent="aidly_emergency_app",
+        domain=os.environ.get('NOMINATIM_DOMAIN', 'nominatim.openstreetmap.org'),
+        scheme=os.environ.get('NOMINATIM_SCHEME', 'https')
+    )
+
+def nominatim_reverse(query: str):
+    """Blocking; the geocode cache runs it in a thread"""
+    reverse = geolocator.get().reverse
+    with metrics.track_external("nominatim"):
+        return reverse(query)
+
+# Country boundaries for offline emergency numbers, built by country_index.py
+COUNTRY_INDEX_PATH = os.environ.get('COUNTRY_INDEX_PATH', str(ROOT_DIR / 'content' / 'countries.idx'))
+
+def open_country_index(path: str) -> Optional[CountryIndex]:
+    try:
+        return CountryIndex(path)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Country index not available, emergency numbers won't follow location: {e}")
+        return None
+
+# Emergent Auth
+AUTH_SESSION_DATA_URL = os.environ.get(
+    'AUTH_SESSION_DATA_URL',
+    "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data"
+)
+
+# Expose per-request user read counts in an X-User-Reads response header
+USER_READ_AUDIT = os.environ.get('USER_READ_AUDIT', '').lower() in ('1', 'true', 'yes')
+
+# Tokens issued before the sessions collection are still accepted (and moved
+# there on first use) from users.session_token
+LEGACY_SESSIONS = os.environ.get('LEGACY_SESSIONS', 'true').lower() in ('1', 'true', 'yes')
+
+# Public page that renders /api/live/{share_token}; when set, SOS texts link to it
+LIVE_SHARE_BASE_URL = os.environ.get('LIVE_SHARE_BASE_URL')
+# Seconds a live publisher has to send its auth message
+LIVE_AUTH_TIMEOUT = float(os.environ.get('LIVE_AUTH_TIMEOUT', '10'))
+
+# Space Nominatim calls across all workers through Mongo instead of per process
+SHARED_RATE_LIMITS = os.environ.get('SHARED_RATE_LIMITS', '').lower() in ('1', 'true', 'yes')
 
 # AWS SNS setup
-try:
-    sns_client = boto3.client(
+SNS_PUBLISH_TIMEOUT = float(os.environ.get('SNS_PUBLISH_TIMEOUT', '5'))
+
+def create_sns_client():
+    import boto3
+    from botocore.config import Config as BotoConfig
+    return boto3.client(
         'sns',
         aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
         aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
-        region_name=os.environ.get('AWS_REGION', 'us-east-1')
+        region_name=os.environ.get('AWS_REGION', 'us-east-1'),
+        # Point at a local SNS stub for development and tests
+        endpoint_url=os.environ.get('SNS_ENDPOINT_URL') or None,
+        config=BotoConfig(
+            connect_timeout=SNS_PUBLISH_TIMEOUT,
+            read_timeout=SNS_PUBLISH_TIMEOUT,
+            retries={"max_attempts": 2},
+            max_pool_connections=int(os.environ.get('SNS_MAX_WORKERS', '16'))
+        )
     )
-except Exception:
-    sns_client = None
-    logging.warning("AWS SNS client not configured")
 
 # Image generation setup
-image_gen = None
-try:
+def create_image_generator():
     api_key = os.environ.get('EMERGENT_LLM_KEY')
-    if api_key:
-        image_gen = OpenAIImageGeneration(api_key=api_key)
-except Exception as e:
-    logging.warning(f"Image generation not configured: {e}")
+    if not api_key:
+        return None
+    from emergentintegrations.llm.openai.image_generation import OpenAIImageGeneration
+    return OpenAIImageGeneration(api_key=api_key)
+
+# Generated images, keyed by prompt + model hash
+IMAGE_MODEL = "gpt-image-1"
+IMAGE_JOB_WAIT_TIMEOUT = float(os.environ.get('IMAGE_JOB_WAIT_TIMEOUT', '120'))
+
+async def generate_image_bytes(prompt: str) -> bytes:
+    image_gen = await image_generator.aget()
+    with metrics.track_external("image_generation"):
+        images = await image_gen.generate_images(
+            prompt=prompt,
+            model=IMAGE_MODEL,
+            number_of_images=1
+        )
+    if not images:
+        raise RuntimeError("No image was generated")
+    return images[0]
+
+def create_http_session() -> aiohttp.ClientSession:
+    """Shared keep-alive client for outbound HTTP calls"""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=int(os.environ.get('HTTP_POOL_SIZE', '100')),
+            ttl_dns_cache=300,
+            keepalive_timeout=60
+        ),
+        timeout=aiohttp.ClientTimeout(
+            total=float(os.environ.get('HTTP_TIMEOUT', '10')),
+            connect=float(os.environ.get('HTTP_CONNECT_TIMEOUT', '3'))
+        )
+    )
+
+def init_resources() -> SimpleNamespace:
+    """Create every client, cache and background worker for one app"""
+    # MongoDB connection; every driver command is timed per collection for /api/metrics
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], event_listeners=[metrics.MongoCommandMetrics()])
+    db = client[os.environ['DB_NAME']]
+    
+    # Emergent Auth over a pooled client; session_id -> SessionResponse, so
+    # retried logins don't hit the auth service
+    http_session = create_http_session()
+    session_data_cache = TTLCache(
+        maxsize=10000,
+        ttl=float(os.environ.get('SESSION_DATA_CACHE_TTL', '60'))
+    )
+    
+    # Session token -> user cache in front of get_current_user, kept coherent
+    # across workers by the invalidation feed
+    session_cache = SessionCache(
+        max_size=int(os.environ.get('SESSION_CACHE_SIZE', '10000')),
+        ttl_seconds=float(os.environ.get('SESSION_CACHE_TTL', '60'))
+    )
+    session_invalidations = SessionInvalidationFeed(
+        db,
+        session_cache,
+        poll_interval=float(os.environ.get('SESSION_INVALIDATION_POLL', '2'))
+    )
+    # One document per device, keyed by the token's hash and expired by a TTL index
+    sessions = SessionStore(
+        db,
+        ttl=timedelta(days=float(os.environ.get('SESSION_TTL_DAYS', '7'))),
+        snapshot_max_age=float(os.environ.get('SESSION_SNAPSHOT_MAX_AGE', '3600'))
+    )
+    
+    geolocator = LazyResource("Nominatim geocoder", create_geolocator)
+    nominatim_min_interval = float(os.environ.get('NOMINATIM_MIN_INTERVAL', '1'))
+    geocode_cache = ReverseGeocodeCache(
+        db,
+        nominatim_reverse,
+        precision=int(os.environ.get('GEOCODE_CACHE_PRECISION', '3')),
+        max_size=int(os.environ.get('GEOCODE_CACHE_SIZE', '10000')),
+        min_interval=nominatim_min_interval,
+        limiter=SharedRateLimiter(db, "nominatim", nominatim_min_interval) if SHARED_RATE_LIMITS else None
+    )
+    
+    # boto3 is blocking; SNS publishes run on this pool, never on the event loop
+    sns = LazyResource("AWS SNS client", create_sns_client)
+    sns_executor = ThreadPoolExecutor(
+        max_workers=int(os.environ.get('SNS_MAX_WORKERS', '16')),
+        thread_name_prefix="sns"
+    )
+    # Drains the SOS notification outbox in the background; it gets the SNS
+    # client once the lifespan has built it
+    outbox_dispatcher = OutboxDispatcher(
+        db,
+        None,
+        sns_executor,
+        batch_size=int(os.environ.get('OUTBOX_BATCH_SIZE', '20')),
+        lease_seconds=float(os.environ.get('OUTBOX_LEASE_SECONDS', '30')),
+        max_attempts=int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '6')),
+        publish_timeout=SNS_PUBLISH_TIMEOUT
+    )
+    
+    # Bounded image generation; jobs are persisted so any worker can serve them
+    image_generator = LazyResource("Image generation", create_image_generator)
+    image_store = ImageStore(
+        Path(os.environ.get('IMAGE_STORE_DIR', ROOT_DIR / 'image_store')),
+        max_bytes=int(os.environ.get('IMAGE_STORE_MAX_MB', '512')) * 1024 * 1024
+    )
+    image_jobs = ImageJobQueue(
+        db,
+        image_store,
+        generate_image_bytes,
+        concurrency=int(os.environ.get('IMAGE_JOB_CONCURRENCY', '2')),
+        per_user_limit=int(os.environ.get('IMAGE_JOB_USER_LIMIT', '3'))
+    )
+    
+    procedure_store = create_procedure_store()
+    # Replayed offline writes (Idempotency-Key) return the first response
+    idempotency = IdempotencyStore(
+        db,
+        wait_timeout=float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', '10'))
+    )
+    # Live positions of active alerts, fanned out to share-link watchers
+    live_hub = LiveLocationHub(
+        min_interval=float(os.environ.get('LIVE_LOCATION_MIN_INTERVAL', '1')),
+        heartbeat=float(os.environ.get('LIVE_LOCATION_HEARTBEAT', '15'))
+    )
+    # Live positions are buffered and written to alert_trails in batches
+    trail_writer = TrailWriter(
+        db,
+        bucket_size=int(os.environ.get('TRAIL_BUCKET_SIZE', '200')),
+        flush_interval=float(os.environ.get('TRAIL_FLUSH_INTERVAL', '2'))
+    )
+    # Memory-mapped, so every worker shares the same pages
+    country_index = open_country_index(COUNTRY_INDEX_PATH)
+    # Dispatch searches, cached per area until an alert there changes
+    nearby_alerts = NearbyAlerts(
+        db,
+        cell_degrees=float(os.environ.get('NEARBY_CELL_DEGREES', '0.5')),
+        max_cells=int(os.environ.get('NEARBY_MAX_CELLS', '16')),
+        ttl=float(os.environ.get('NEARBY_CACHE_TTL', '30'))
+    )
+    event_loop_lag = metrics.EventLoopLagMonitor(
+        interval=float(os.environ.get('EVENT_LOOP_LAG_INTERVAL', '0.5'))
+    )
+    return SimpleNamespace(
+        client=client,
+        db=db,
+        http_session=http_session,
+        session_data_cache=session_data_cache,
+        session_cache=session_cache,
+        session_invalidations=session_invalidations,
+        sessions=sessions,
+        geolocator=geolocator,
+        geocode_cache=geocode_cache,
+        sns=sns,
+        sns_executor=sns_executor,
+        outbox_dispatcher=outbox_dispatcher,
+        image_generator=image_generator,
+        image_store=image_store,
+        image_jobs=image_jobs,
+        procedure_store=procedure_store,
+        event_loop_lag=event_loop_lag,
+        idempotency=idempotency,
+        live_hub=live_hub,
+        trail_writer=trail_writer,
+        nearby_alerts=nearby_alerts,
+        country_index=country_index,
+    )
+
+async def start_sms_delivery():
+    sns_client = await sns.warm()
+    if sns_client:
+        outbox_dispatcher.sns_client = sns_client
+        outbox_dispatcher.start()
+
+async def start_image_jobs():
+    if await image_generator.warm():
+        image_jobs.start()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.resources = init_resources()
+    # The lifespan and the background tasks it starts use this app's resources
+    bind(app.state.resources)
+    await ensure_indexes(db)
+    if os.environ.get('VERIFY_QUERY_PLANS', '').lower() in ('1', 'true', 'yes'):
+        # Refuse to start if any handler query would do a COLLSCAN
+        await verify_query_plans(db)
+    event_loop_lag.start()
+    session_invalidations.start()
+    procedure_store.start()
+    idempotency.start()
+    trail_writer.start()
+    # Heavy clients load in the background while requests are already served
+    warmups = [
+        asyncio.create_task(start_sms_delivery()),
+        asyncio.create_task(start_image_jobs()),
+        geolocator.warm(),
+        asyncio.create_task(nearby_alerts.backfill())
+    ]
+    yield
+    for task in warmups:
+        task.cancel()
+    live_hub.close_all()
+    await trail_writer.stop()
+    await outbox_dispatcher.stop()
+    await image_jobs.stop()
+    await procedure_store.stop()
+    await idempotency.stop()
+    await http_session.close()
+    await session_invalidations.stop()
+    await event_loop_lag.stop()
+    sns_executor.shutdown(wait=False)
+    if country_index:
+        country_index.close()
+    client.close()
+    metrics.mark_process_dead()
+
+# Opt-in fast JSON path: hot handlers serialize trusted dicts directly with
+# orjson; FAST_RESPONSES_VALIDATE still checks them against the declared models
+FAST_RESPONSES = os.environ.get('FAST_RESPONSES', '').lower() in ('1', 'true', 'yes')
+FAST_RESPONSES_VALIDATE = os.environ.get('FAST_RESPONSES_VALIDATE', '').lower() in ('1', 'true', 'yes')
 
-app = FastAPI(title="Aidly - Medical Emergency Assistant")
 api_router = APIRouter(prefix="/api")
 
 # Models
@@ -68,12 +376,14 @@ class User(BaseModel):
     phone: Optional[str] = None
     profile_picture: Optional[str] = None
     google_id: Optional[str] = None
-    session_token: Optional[str] = None
-    session_expires: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     emergency_contacts: List[Dict[str, Any]] = Field(default_factory=list)
     location_enabled: bool = False
-    emergency_number: str = "911"  # Default to US, will be updated based on location
+    emergency_number: str = "911"  # Default to US, updated from location or phone region
+    country: Optional[str] = None  # ISO 3166 alpha-2, where emergency_number came from
+    emergency_number_source: str = "default"  # "default", "user", "location" or "phone"
+    last_location: Optional[Dict[str, Any]] = None  # LocationData + updated_at
+    role: str = "user"  # "user" or "coordinator"
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -94,6 +404,11 @@ class EmergencyContactCreate(BaseModel):
     relationship: str
     priority: int = 1
 
+class EmergencyContactImport(BaseModel):
+    # Rows are validated one by one so a bad row is reported, not fatal
+    contacts: List[Dict[str, Any]] = Field(..., max_length=1000)
+    default_region: Optional[str] = None  # ISO 3166 alpha-2, e.g. "MX"
+
 class LocationData(BaseModel):
     latitude: float
     longitude: float
@@ -105,18 +420,29 @@ class EmergencyAlert(BaseModel):
     user_id: str
     emergency_type: str  # "medical", "fire", "police", "general"
     location: Optional[LocationData] = None
+    geo: Optional[Dict[str, Any]] = None  # GeoJSON point of location, for dispatch searches
     message: str
     contacts_notified: List[str] = Field(default_factory=list)
     emergency_services_called: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     resolved_at: Optional[datetime] = None
     status: str = "active"  # "active", "resolved", "cancelled"
+    # Lets contacts watch the live location without an account
+    share_token: str = Field(default_factory=lambda: secrets.token_urlsafe(16))
 
 class SOSRequest(BaseModel):
     emergency_type: str = "medical"
     location: Optional[LocationData] = None
     custom_message: Optional[str] = None
 
+class SyncAction(BaseModel):
+    type: str  # "sos", "add_contact", "delete_contact", "update_profile", "location_update"
+    data: Dict[str, Any] = Field(default_factory=dict)
+    idempotency_key: Optional[str] = Field(None, max_length=255)
+
+class SyncBatch(BaseModel):
+    actions: List[SyncAction] = Field(..., max_length=100)
+
 class MedicalProcedure(BaseModel):
     id: str
     name: str
@@ -127,6 +453,8 @@ class MedicalProcedure(BaseModel):
     duration_minutes: int
     images: List[str] = Field(default_factory=list)
     voice_instructions: bool = True
+    version: int = 1  # editorial; sync compares content hashes
+    order: int = 0
 
 class AuthSession(BaseModel):
     session_id: str
@@ -138,96 +466,192 @@ class SessionResponse(BaseModel):
     picture: Optional[str]
     session_token: str
 
+# Procedures are loaded from versioned JSON content and hot-reloaded; every
+# response is served from pre-built bytes
+def create_procedure_store() -> ProcedureStore:
+    return ProcedureStore(
+        Path(os.environ.get('PROCEDURES_DIR', ROOT_DIR / 'content' / 'procedures')),
+        validate=lambda procedure: MedicalProcedure(**procedure),
+        poll_interval=float(os.environ.get('PROCEDURES_RELOAD_INTERVAL', '5'))
+    )
+
+# User document reads are counted per request; each endpoint should need at
+# most one (authentication reads sessions, not users)
+MAX_USER_READS = 1
+user_reads: ContextVar[Optional[List[int]]] = ContextVar("user_reads", default=None)
+
+USER_PROJECTION = {"_id": 0, **{field: 1 for field in User.model_fields}}
+
+def count_user_read():
+    reads = user_reads.get()
+    if reads is not None:
+        reads[0] += 1
+
+async def find_user(query: Dict[str, Any], projection: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Every users find_one goes through here so reads can be audited"""
+    count_user_read()
+    return await db.users.find_one(query, projection)
+
 # Authentication helper functions
 async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> Optional[User]:
     """Get current user from session token"""
     if not credentials:
         return None
+    return await user_for_token(credentials.credentials)
+
+async def user_for_token(token: str) -> Optional[User]:
+    # Sessions are cached and invalidated by token hash, never the token itself
+    key = token_hash(token)
+    cached_user = session_cache.get(key)
+    if cached_user:
+        return cached_user
     
     try:
-        # Find user by session token
-        user_data = await db.users.find_one({
-            "session_token": credentials.credentials,
-            "session_expires": {"$gt": datetime.now(timezone.utc)}
-        })
+        session = await sessions.find(key)
+        if session is None and LEGACY_SESSIONS:
+            session = await migrate_legacy_session(token)
+        if session is None:
+            return None
         
-        if user_data:
-            return User(**user_data)
+        if sessions.is_stale(session):
+            user_data = await find_user({"id": session["user_id"]}, USER_PROJECTION)
+            if user_data is None:
+                return None
+            session["user"] = await sessions.resync(key, user_data)
+        
+        user = User(**session["user"])
+        session_cache.put(key, user, session["expires_at"])
+        return user
     except Exception as e:
         logging.error(f"Auth error: {e}")
     
     return None
 
+async def migrate_legacy_session(token: str) -> Optional[Dict[str, Any]]:
+    """Move a token still stored on its user into the sessions collection"""
+    user_data = await find_user({
+        "session_token": token,
+        "session_expires": {"$gt": datetime.now(timezone.utc)}
+    }, {**USER_PROJECTION, "session_expires": 1})
+    if not user_data:
+        return None
+    
+    expires_at = user_data.pop("session_expires")
+    session = await sessions.create(token, user_data, {"name": "Migrated session"}, expires_at=expires_at)
+    await db.users.update_one(
+        {"id": user_data["id"], "session_token": token},
+        {"$unset": {"session_token": "", "session_expires": ""}}
+    )
+    return session
+
+def session_device(user_agent: Optional[str], device_name: Optional[str]) -> Dict[str, Any]:
+    return {"name": (device_name or "")[:100] or None, "user_agent": (user_agent or "")[:300] or None}
+
 async def require_auth(user: Optional[User] = Depends(get_current_user)) -> User:
     """Require authenticated user"""
     if not user:
         raise HTTPException(status_code=401, detail="Authentication required")
     return user
 
+async def require_coordinator(user: User = Depends(require_auth)) -> User:
+    """Require a regional coordinator"""
+    if user.role != "coordinator":
+        raise HTTPException(status_code=403, detail="Coordinator role required")
+    return user
+
 # Authentication endpoints
 @api_router.post("/auth/session-data", response_model=SessionResponse)
-async def process_session(auth_session: AuthSession, x_session_id: Optional[str] = Header(None)):
-    """Process Emergent Auth session ID and create user session"""
+async def process_session(
+    auth_session: AuthSession,
+    x_session_id: Optional[str] = Header(None),
+    x_device_name: Optional[str] = Header(None),
+    user_agent: Optional[str] = Header(None)
+):
+    """Process Emergent Auth session ID and create a session for this device"""
     session_id = x_session_id or auth_session.session_id
     
     if not session_id:
         raise HTTPException(status_code=400, detail="Session ID required")
     
+    # A retried login with the same session ID gets the same answer, as long
+    # as that session hasn't been logged out or revoked since (on any worker)
+    cached_response = session_data_cache.get(session_id)
+    if cached_response and await sessions.find(token_hash(cached_response["session_token"])) is None:
+        session_data_cache.pop(session_id, None)
+        cached_response = None
+    if cached_response:
+        if FAST_RESPONSES:
+            return fast_response(cached_response, SessionResponse, validate=FAST_RESPONSES_VALIDATE)
+        return cached_response
+    
     try:
-        # Call Emergent Auth API to get user data
-        async with aiohttp.ClientSession() as session:
-            headers = {"X-Session-ID": session_id}
-            async with session.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers=headers
+        # Call Emergent Auth API to get user data over the shared pooled client
+        with metrics.track_external("auth"):
+            async with http_session.get(
+                AUTH_SESSION_DATA_URL,
+                headers={"X-Session-ID": session_id}
             ) as response:
-                if response.status != 200:
-                    raise HTTPException(status_code=400, detail="Invalid session ID")
-                
-                user_data = await response.json()
+                status_code = response.status
+                user_data = await response.json() if status_code == 200 else None
+        if status_code != 200:
+            raise HTTPException(status_code=400, detail="Invalid session ID")
         
-        # Create or update user
-        existing_user = await db.users.find_one({"email": user_data["email"]})
-        
-        # Generate session token
-        session_token = str(uuid.uuid4())
-        session_expires = datetime.now(timezone.utc) + timedelta(days=7)
-        
-        if existing_user:
-            # Update existing user
-            await db.users.update_one(
+        # Create or update the user in one atomic upsert
+        new_user = User(
+            email=user_data["email"],
+            name=user_data["name"],
+            profile_picture=user_data.get("picture"),
+            google_id=user_data["id"]
+        )
+        login_fields = {
+            "name": user_data["name"],
+            "profile_picture": user_data.get("picture")
+        }
+        upsert = {
+            "$set": login_fields,
+            "$setOnInsert": {k: v for k, v in new_user.dict().items() if k not in login_fields}
+        }
+        count_user_read()
+        try:
+            user_doc = await db.users.find_one_and_update(
                 {"email": user_data["email"]},
-                {
-                    "$set": {
-                        "session_token": session_token,
-                        "session_expires": session_expires,
-                        "name": user_data["name"],
-                        "profile_picture": user_data.get("picture")
-                    }
-                }
+                upsert,
+                projection=USER_PROJECTION,
+                upsert=True,
+                return_document=ReturnDocument.AFTER
             )
-            user_id = existing_user["id"]
-        else:
-            # Create new user
-            new_user = User(
-                email=user_data["email"],
-                name=user_data["name"],
-                profile_picture=user_data.get("picture"),
-                google_id=user_data["id"],
-                session_token=session_token,
-                session_expires=session_expires
+        except DuplicateKeyError:
+            # Lost an insert race on the unique email index; now it's an update
+            user_doc = await db.users.find_one_and_update(
+                {"email": user_data["email"]},
+                upsert,
+                projection=USER_PROJECTION,
+                return_document=ReturnDocument.AFTER
             )
-            await db.users.insert_one(new_user.dict())
-            user_id = new_user.id
         
-        return SessionResponse(
-            id=user_id,
-            email=user_data["email"],
-            name=user_data["name"],
-            picture=user_data.get("picture"),
-            session_token=session_token
-        )
+        # A new session for this device; the user's other devices stay signed in
+        session_token = secrets.token_urlsafe(32)
+        await sessions.create(session_token, user_doc, session_device(user_agent, x_device_name))
+        # Other devices' snapshots pick up a changed name
+        if await sessions.mirror(user_doc["id"], [{"$set": {"name": user_data["name"]}}]):
+            await session_invalidations.publish(user_id=user_doc["id"])
+        
+        session_response = {
+            "id": user_doc["id"],
+            "email": user_data["email"],
+            "name": user_data["name"],
+            "picture": user_data.get("picture"),
+            "session_token": session_token
+        }
+        session_data_cache[session_id] = session_response
+        if FAST_RESPONSES:
+            return fast_response(session_response, SessionResponse, validate=FAST_RESPONSES_VALIDATE)
+        return session_response
     
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Auth service timed out")
     except aiohttp.ClientError:
         raise HTTPException(status_code=400, detail="Failed to validate session")
     except Exception as e:
@@ -235,287 +659,932 @@ async def process_session(auth_session: AuthSession, x_session_id: Optional[str]
         raise HTTPException(status_code=500, detail="Session processing failed")
 
 @api_router.post("/auth/logout")
-async def logout(user: User = Depends(require_auth)):
-    """Logout user and invalidate session"""
-    await db.users.update_one(
-        {"id": user.id},
-        {"$unset": {"session_token": "", "session_expires": ""}}
-    )
+async def logout(
+    user: User = Depends(require_auth),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Logout this device; the user's other sessions stay valid"""
+    key = token_hash(credentials.credentials)
+    await sessions.revoke_key(key)
+    await session_invalidations.publish(token=key)
     return {"message": "Logged out successfully"}
 
+@api_router.get("/auth/sessions")
+async def get_sessions(
+    user: User = Depends(require_auth),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """The user's signed-in devices, oldest first"""
+    current = token_hash(credentials.credentials)
+    return [
+        {**{field: session.get(field) for field in SESSION_PROJECTION if field != "_id"}, "current": session["_id"] == current}
+        for session in await sessions.of_user(user.id)
+    ]
+
+@api_router.delete("/auth/sessions/{session_id}")
+async def revoke_session(session_id: str, user: User = Depends(require_auth)):
+    """Sign out one device"""
+    key = await sessions.revoke(user.id, session_id)
+    if key is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    # Its cached entries go on every worker
+    await session_invalidations.publish(token=key)
+    return {"message": "Session revoked"}
+
 # User profile endpoints
 @api_router.get("/profile", response_model=User)
 async def get_profile(user: User = Depends(require_auth)):
     """Get current user profile"""
-    return user
+    # Sessions only carry what handlers need; the profile is the full document
+    user_data = await find_user({"id": user.id}, USER_PROJECTION)
+    if user_data is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    if FAST_RESPONSES:
+        # Read straight from Mongo; dump it without a model pass
+        return fast_response(user_data, User, validate=FAST_RESPONSES_VALIDATE)
+    return user_data
 
-@api_router.put("/profile")
-async def update_profile(profile_data: dict, user: User = Depends(require_auth)):
-    """Update user profile"""
-    allowed_fields = ["name", "phone", "location_enabled", "emergency_number"]
-    update_data = {k: v for k, v in profile_data.items() if k in allowed_fields}
+PROFILE_FIELDS = ["name", "phone", "location_enabled", "emergency_number"]
+
+def local_emergency_fields(latitude: float, longitude: float) -> Dict[str, str]:
+    """country and emergency_number at the coordinates, resolved offline;
+    empty when the index or the number table doesn't know them"""
+    country = country_index.lookup(latitude, longitude) if country_index else None
+    number = emergency_number(country)
+    if not number:
+        return {}
+    return {"country": country, "emergency_number": number, "emergency_number_source": "location"}
+
+def located_emergency_fields(location: Optional[Dict[str, Any]], phone: Optional[str]) -> Dict[str, str]:
+    """local_emergency_fields at the last known location, else for the phone's region"""
+    if location:
+        fields = local_emergency_fields(location["latitude"], location["longitude"])
+        if fields:
+            return fields
+    region = region_for_phone(phone)
+    number = emergency_number(region)
+    if not number:
+        return {}
+    return {"country": region, "emergency_number": number, "emergency_number_source": "phone"}
+
+def location_update_fields(
+    location: Dict[str, Any],
+    source: Optional[str],
+    country: Optional[str],
+    now: datetime
+) -> Dict[str, Any]:
+    """last_location and the emergency_number fields a reported position
+    implies. An explicit number only gives way once the user is in another
+    country."""
+    local = local_emergency_fields(location["latitude"], location["longitude"])
+    if source == "user" and local.get("country") == country:
+        local = {}
+    return {"last_location": {**location, "updated_at": now}, **local}
+
+def profile_emergency_fields(
+    update_data: Dict[str, Any],
+    source: str,
+    phone: Optional[str],
+    last_location: Optional[Dict[str, Any]]
+) -> Dict[str, str]:
+    """emergency_number fields implied by a profile update. A number the user
+    set explicitly is kept until they change their phone."""
+    if "emergency_number" in update_data:
+        return {"emergency_number_source": "user"}
+    phone_changed = "phone" in update_data and update_data["phone"] != phone
+    if source == "user" and not phone_changed:
+        return {}
+    return located_emergency_fields(last_location, update_data.get("phone", phone))
+
+def profile_update_fields(profile_data: Dict[str, Any]) -> Dict[str, Any]:
+    """The allowed profile fields of an update, with the phone normalized"""
+    update_data = {k: v for k, v in profile_data.items() if k in PROFILE_FIELDS}
     
     if "phone" in update_data:
         # Validate phone number
-        try:
-            parsed_phone = phonenumbers.parse(update_data["phone"], None)
-            if not phonenumbers.is_valid_number(parsed_phone):
-                raise HTTPException(status_code=400, detail="Invalid phone number")
-            update_data["phone"] = phonenumbers.format_number(parsed_phone, phonenumbers.PhoneNumberFormat.E164)
-        except NumberParseException:
-            raise HTTPException(status_code=400, detail="Invalid phone number format")
-    
+        formatted_phone, error = normalize_phone(update_data["phone"])
+        if error:
+            raise HTTPException(status_code=400, detail=error)
+        update_data["phone"] = formatted_phone
+    return update_data
+
+@api_router.put("/profile")
+async def update_profile(profile_data: dict, user: User = Depends(require_auth)):
+    """Update user profile"""
+    update_data = profile_update_fields(profile_data)
+    update_data.update(profile_emergency_fields(
+        update_data, user.emergency_number_source, user.phone, user.last_location
+    ))
     await db.users.update_one({"id": user.id}, {"$set": update_data})
-    return {"message": "Profile updated"}
+    await sessions.mirror(user.id, [{"$set": update_data}])
+    # Refresh this worker's entries in place, drop them everywhere else
+    session_cache.refresh_user(user.id, **update_data)
+    await session_invalidations.publish(user_id=user.id, invalidate_local=False)
+    return {
+        "message": "Profile updated",
+        "emergency_number": update_data.get("emergency_number", user.emergency_number),
+        "country": update_data.get("country", user.country)
+    }
 
 # Emergency contacts endpoints  
 @api_router.get("/emergency-contacts")
 async def get_emergency_contacts(user: User = Depends(require_auth)):
     """Get user's emergency contacts"""
-    user_data = await db.users.find_one({"id": user.id})
-    return user_data.get("emergency_contacts", [])
+    # Already loaded with the user by the auth dependency
+    return user.emergency_contacts
+
+async def idempotent(
+    user: User,
+    route: str,
+    key: Optional[str],
+    request: BaseModel,
+    handler: Callable[[], Awaitable[Dict[str, Any]]]
+):
+    """Run a write once per Idempotency-Key; replays get the stored response"""
+    if not key:
+        return await handler()
+    if len(key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+    
+    try:
+        response, replayed = await idempotency.run(user.id, route, key, request.dict(), handler)
+    except IdempotencyKeyReused:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    except IdempotencyInProgress:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    
+    if replayed:
+        return JSONResponse(response, headers={"Idempotent-Replayed": "true"})
+    return response
 
 @api_router.post("/emergency-contacts")
-async def add_emergency_contact(contact: EmergencyContactCreate, user: User = Depends(require_auth)):
+async def add_emergency_contact(
+    contact: EmergencyContactCreate,
+    user: User = Depends(require_auth),
+    idempotency_key: Optional[str] = Header(None)
+):
     """Add emergency contact"""
+    return await idempotent(
+        user, "add_contact", idempotency_key, contact,
+        lambda: create_emergency_contact(contact, user)
+    )
+
+def build_emergency_contact(contact: EmergencyContactCreate) -> EmergencyContact:
     # Validate phone number
-    try:
-        parsed_phone = phonenumbers.parse(contact.phone, None)
-        if not phonenumbers.is_valid_number(parsed_phone):
-            raise HTTPException(status_code=400, detail="Invalid phone number")
-        formatted_phone = phonenumbers.format_number(parsed_phone, phonenumbers.PhoneNumberFormat.E164)
-    except NumberParseException:
-        raise HTTPException(status_code=400, detail="Invalid phone number format")
-    
-    new_contact = EmergencyContact(
+    formatted_phone, error = normalize_phone(contact.phone)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    
+    return EmergencyContact(
         name=contact.name,
         phone=formatted_phone,
         relationship=contact.relationship,
         priority=contact.priority
     )
-    
-    await db.users.update_one(
-        {"id": user.id},
-        {"$push": {"emergency_contacts": new_contact.dict()}}
-    )
+
+async def create_emergency_contact(contact: EmergencyContactCreate, user: User) -> Dict[str, Any]:
+    new_contact = build_emergency_contact(contact)
+    update = {"$push": {"emergency_contacts": new_contact.dict()}}
+    await db.users.update_one({"id": user.id}, update)
+    await sessions.mirror(user.id, [update])
+    await session_invalidations.publish(user_id=user.id)
     
     return {"message": "Emergency contact added", "contact_id": new_contact.id}
 
+@api_router.post("/emergency-contacts/import")
+async def import_emergency_contacts(contact_import: EmergencyContactImport, user: User = Depends(require_auth)):
+    """Import many emergency contacts in one request"""
+    # Numbers without a country prefix are read in the user's own region
+    region = (contact_import.default_region or "").upper() or region_for_phone(user.phone)
+    
+    seen_phones = {c.get("phone") for c in user.emergency_contacts}
+    
+    new_contacts = []
+    errors = []
+    duplicates = 0
+    for row, raw_contact in enumerate(contact_import.contacts):
+        try:
+            contact = EmergencyContactCreate(**raw_contact)
+        except ValidationError as e:
+            errors.append({"row": row, "error": e.errors(include_url=False)[0]["msg"]})
+            continue
+        
+        formatted_phone, error = normalize_phone(contact.phone, region)
+        if error:
+            errors.append({"row": row, "phone": contact.phone, "error": error})
+            continue
+        if formatted_phone in seen_phones:
+            duplicates += 1
+            continue
+        seen_phones.add(formatted_phone)
+        
+        new_contacts.append(EmergencyContact(
+            name=contact.name,
+            phone=formatted_phone,
+            relationship=contact.relationship,
+            priority=contact.priority
+        ).dict())
+    
+    if new_contacts:
+        update = {"$push": {"emergency_contacts": {"$each": new_contacts}}}
+        await db.users.update_one({"id": user.id}, update)
+        await sessions.mirror(user.id, [update])
+        await session_invalidations.publish(user_id=user.id)
+    
+    return {
+        "message": f"{len(new_contacts)} emergency contacts imported",
+        "imported": len(new_contacts),
+        "contact_ids": [c["id"] for c in new_contacts],
+        "duplicates": duplicates,
+        "errors": errors
+    }
+
 @api_router.delete("/emergency-contacts/{contact_id}")
 async def delete_emergency_contact(contact_id: str, user: User = Depends(require_auth)):
     """Delete emergency contact"""
-    await db.users.update_one(
-        {"id": user.id},
-        {"$pull": {"emergency_contacts": {"id": contact_id}}}
-    )
+    update = {"$pull": {"emergency_contacts": {"id": contact_id}}}
+    await db.users.update_one({"id": user.id}, update)
+    await sessions.mirror(user.id, [update])
+    await session_invalidations.publish(user_id=user.id)
     return {"message": "Emergency contact deleted"}
 
 # Medical procedures endpoints
 @api_router.get("/medical-procedures")
-async def get_medical_procedures(category: Optional[str] = None):
+async def get_medical_procedures(request: Request, category: Optional[str] = None):
     """Get medical procedures, optionally filtered by category"""
-    # Return hardcoded procedures - in production this would be from database
-    procedures = [
-        {
-            "id": "cpr-adult",
-            "name": "RCP para Adultos",
-            "description": "Reanimación cardiopulmonar para adultos que han perdido el conocimiento",
-            "category": "cpr",
-            "difficulty": "intermedio",
-            "duration_minutes": 5,
-            "images": [
-                "https://images.unsplash.com/photo-1622115297822-a3798fdbe1f6?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDQ2NDF8MHwxfHNlYXJjaHwxfHxDUFJ8ZW58MHx8fHwxNzU5MDMwNjQ3fDA&ixlib=rb-4.1.0&q=85",
-                "https://images.unsplash.com/photo-1630964046403-8b745c1e3c69?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDQ2NDF8MHwxfHNlYXJjaHwyfHxDUFJ8ZW58MHx8fHwxNzU5MDMwNjQ3fDA&ixlib=rb-4.1.0&q=85"
-            ],
-            "steps": [
-                {"step": 1, "title": "Verificar consciencia", "description": "Toca suavemente los hombros de la persona. Pregunta en voz alta si está bien. Observa si responde o se mueve", "duration": 10},
-                {"step": 2, "title": "Pedir ayuda médica", "description": "Llama inmediatamente al servicio de emergencias. Si hay alguien cerca, pídele que llame mientras tú continúas", "duration": 30},
-                {"step": 3, "title": "Posicionar las manos", "description": "Coloca el talón de una mano en el centro del pecho, entre los pezones. Pon la otra mano encima, entrelazando los dedos", "duration": 15},
-                {"step": 4, "title": "Comprensiones torácicas", "description": "Presiona fuerte y rápido, hundiendo el pecho al menos 5 centímetros. Mantén un ritmo de 100 a 120 compresiones por minuto", "duration": 120},
-                {"step": 5, "title": "Respiración de rescate", "description": "Inclina la cabeza hacia atrás, levanta la barbilla. Sella su boca con la tuya y da dos respiraciones lentas", "duration": 10},
-                {"step": 6, "title": "Continuar ciclos", "description": "Alterna 30 compresiones con 2 respiraciones. No te detengas hasta que llegue ayuda médica profesional", "duration": 0}
-            ]
-        },
-        {
-            "id": "choking-adult",
-            "name": "Atragantamiento en Adultos",
-            "description": "Maniobra de Heimlich para adultos conscientes que se están atragantando",
-            "category": "choking",
-            "difficulty": "básico",
-            "duration_minutes": 2,
-            "images": [
-                "https://images.unsplash.com/photo-1580115465903-0e4a824a4e9a?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDQ2NDN8MHwxfHNlYXJjaHwxfHxmaXJzdCUyMGFpZHxlbnwwfHx8fDE3NTkwMzA2NTN8MA&ixlib=rb-4.1.0&q=85"
-            ],
-            "steps": [
-                {"step": 1, "title": "Reconocer el atragantamiento", "description": "Pregunta si se está atragantando. Busca señales como no poder hablar, toser débilmente o dificultad para respirar", "duration": 5},
-                {"step": 2, "title": "Colocarse detrás", "description": "Párate detrás de la persona. Rodea su cintura con tus brazos manteniendo la calma", "duration": 5},
-                {"step": 3, "title": "Formar el puño", "description": "Haz un puño con una mano. Coloca el lado del pulgar contra el abdomen, justo arriba del ombligo", "duration": 5},
-                {"step": 4, "title": "Empujes abdominales", "description": "Agarra el puño con la otra mano. Realiza empujes rápidos y firmes hacia arriba y hacia adentro", "duration": 30},
-                {"step": 5, "title": "Continuar hasta desalojar", "description": "Repite los empujes hasta que el objeto salga o la persona pierda el conocimiento. Mantén la calma", "duration": 0}
-            ]
-        },
-        {
-            "id": "burns-minor",
-            "name": "Quemaduras Menores",
-            "description": "Tratamiento para quemaduras leves y escaldaduras que no son graves",
-            "category": "burns",
-            "difficulty": "básico",
-            "duration_minutes": 10,
-            "images": [
-                "https://images.unsplash.com/photo-1624638760852-8ede1666ab07?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDQ2NDN8MHwxfHNlYXJjaHwzfHxmaXJzdCUyMGFpZHxlbnwwfHx8fDE3NTkwMzA2NTN8MA&ixlib=rb-4.1.0&q=85"
-            ],
-            "steps": [
-                {"step": 1, "title": "Alejar del calor", "description": "Retira inmediatamente a la persona de la fuente de calor. Asegúrate de que esté en un lugar seguro", "duration": 5},
-                {"step": 2, "title": "Enfriar la quemadura", "description": "Aplica agua fresca, no fría, sobre la quemadura durante 10 a 20 minutos. Esto aliviará el dolor", "duration": 600},
-                {"step": 3, "title": "Retirar objetos", "description": "Quita cuidadosamente joyas y ropa suelta del área quemada antes de que se inflame", "duration": 30},
-                {"step": 4, "title": "Proteger la herida", "description": "Cubre con una gasa estéril limpia. Nunca uses hielo, mantequilla o remedios caseros", "duration": 60},
-                {"step": 5, "title": "Aliviar el dolor", "description": "Si es necesario, puedes dar medicamentos para el dolor que se vendan sin receta médica", "duration": 5}
-            ]
-        },
-        {
-            "id": "wounds-bleeding",
-            "name": "Hemorragia Severa",
-            "description": "Control de sangrado abundante en heridas que no se detienen",
-            "category": "wounds",
-            "difficulty": "intermedio",
-            "duration_minutes": 5,
-            "images": [
-                "https://images.pexels.com/photos/3760275/pexels-photo-3760275.jpeg"
-            ],
-            "steps": [
-                {"step": 1, "title": "Protégete", "description": "Usa guantes si tienes, o coloca una barrera limpia entre tus manos y la sangre para evitar infecciones", "duration": 10},
-                {"step": 2, "title": "Presión directa", "description": "Aplica presión firme y constante sobre la herida con un paño limpio o gasa. No retires el paño", "duration": 30},
-                {"step": 3, "title": "Elevar si es posible", "description": "Si es seguro hacerlo, eleva la parte herida por encima del nivel del corazón para reducir el sangrado", "duration": 5},
-                {"step": 4, "title": "Mantener presión", "description": "Continúa aplicando presión constante. Si la sangre empapa el vendaje, añade más encima sin quitar el anterior", "duration": 180},
-                {"step": 5, "title": "Buscar ayuda médica", "description": "Llama inmediatamente a los servicios de emergencia. El sangrado severo requiere atención profesional urgente", "duration": 30}
-            ]
-        }
-    ]
-    
-    if category:
-        procedures = [p for p in procedures if p["category"] == category]
-    
-    return procedures
+    catalog = procedure_store.catalog
+    return catalog.respond(catalog.list_body(category), request.headers)
+
+@api_router.get("/medical-procedures/manifest")
+async def get_medical_procedures_manifest(request: Request):
+    """Content version and per-procedure hashes for offline sync"""
+    return procedure_store.catalog.respond(procedure_store.manifest_body, request.headers)
+
+@api_router.get("/medical-procedures/delta")
+async def get_medical_procedures_delta(request: Request, ids: Optional[str] = None):
+    """Bodies of the comma-separated procedure ids (all when omitted), plus the current id list"""
+    wanted = [procedure_id for procedure_id in ids.split(",") if procedure_id] if ids is not None else None
+    return procedure_store.catalog.respond(procedure_store.delta_body(wanted), request.headers)
 
 @api_router.get("/medical-procedures/{procedure_id}")
-async def get_medical_procedure(procedure_id: str):
+async def get_medical_procedure(procedure_id: str, request: Request):
     """Get specific medical procedure details"""
-    procedures = await get_medical_procedures()
-    procedure = next((p for p in procedures if p["id"] == procedure_id), None)
+    catalog = procedure_store.catalog
+    body = catalog.procedure_body(procedure_id)
     
-    if not procedure:
+    if not body:
         raise HTTPException(status_code=404, detail="Procedure not found")
     
-    return procedure
+    return catalog.respond(body, request.headers)
 
 # Emergency/SOS endpoints
 @api_router.post("/emergency/sos")
-async def trigger_sos(sos_request: SOSRequest, user: User = Depends(require_auth)):
+async def trigger_sos(
+    sos_request: SOSRequest,
+    user: User = Depends(require_auth),
+    idempotency_key: Optional[str] = Header(None)
+):
     """Trigger SOS emergency alert"""
-    try:
-        # Create emergency alert record
-        emergency_alert = EmergencyAlert(
-            user_id=user.id,
-            emergency_type=sos_request.emergency_type,
-            location=sos_request.location,
-            message=sos_request.custom_message or f"Emergency alert from {user.name}"
+    # Offline-queued SOS requests are replayed on reconnect; with a key the
+    # alert is created and its SMS queued only once
+    return await idempotent(
+        user, "sos", idempotency_key, sos_request,
+        lambda: create_sos_alert(sos_request, user)
+    )
+
+async def build_sos_alert(
+    sos_request: SOSRequest,
+    user: User,
+    emergency_contacts: List[Dict[str, Any]],
+    user_changes: Optional[Dict[str, Any]] = None
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any], Dict[str, Any]]:
+    """Alert document, its outbox entries, the SOS response and the user
+    fields to $set (the SOS location and its emergency number); writes nothing.
+    ``user_changes`` are user fields changed but not yet visible on ``user``."""
+    # Create emergency alert record
+    emergency_alert = EmergencyAlert(
+        user_id=user.id,
+        emergency_type=sos_request.emergency_type,
+        location=sos_request.location,
+        geo=alert_geo(sos_request.location.latitude, sos_request.location.longitude) if sos_request.location else None,
+        message=sos_request.custom_message or f"Emergency alert from {user.name}"
+    )
+    
+    # Format location for SMS
+    location_text = ""
+    if sos_request.location:
+        location_text = f"\nLocation: {sos_request.location.latitude}, {sos_request.location.longitude}"
+        # Fall back to an already-cached address; never geocode on the SOS path
+        address = sos_request.location.address or geocode_cache.peek(
+            sos_request.location.latitude, sos_request.location.longitude
         )
-        
-        # Save to database
-        await db.emergency_alerts.insert_one(emergency_alert.dict())
-        
-        # Get user's emergency contacts
-        user_data = await db.users.find_one({"id": user.id})
-        emergency_contacts = user_data.get("emergency_contacts", [])
-        
-        # Format location for SMS
-        location_text = ""
-        if sos_request.location:
-            location_text = f"\nLocation: {sos_request.location.latitude}, {sos_request.location.longitude}"
-            if sos_request.location.address:
-                location_text += f" ({sos_request.location.address})"
-            # Add Google Maps link
-            maps_link = f"https://maps.google.com/maps?q={sos_request.location.latitude},{sos_request.location.longitude}"
-            location_text += f"\nView on map: {maps_link}"
-        
-        # Send SMS to emergency contacts
-        contacts_notified = []
-        if sns_client and emergency_contacts:
-            sms_message = (
-                f"🚨 EMERGENCY ALERT 🚨\n"
-                f"From: {user.name}\n"
-                f"Type: {sos_request.emergency_type.upper()}\n"
-                f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                f"Message: {emergency_alert.message}"
-                f"{location_text}\n\n"
-                f"This is an automated emergency alert from Aidly."
-            )
-            
-            # Sort contacts by priority and send SMS
-            sorted_contacts = sorted(emergency_contacts, key=lambda x: x.get("priority", 1))
-            
-            for contact in sorted_contacts:
-                try:
-                    response = sns_client.publish(
-                        PhoneNumber=contact["phone"],
-                        Message=sms_message
-                    )
-                    contacts_notified.append(contact["id"])
-                    logging.info(f"SMS sent to {contact['name']}: {response['MessageId']}")
-                except Exception as e:
-                    logging.error(f"Failed to send SMS to {contact['name']}: {e}")
-        
-        # Update alert with notified contacts
-        await db.emergency_alerts.update_one(
-            {"id": emergency_alert.id},
-            {"$set": {"contacts_notified": contacts_notified}}
+        if address:
+            location_text += f" ({address})"
+        # Add Google Maps link
+        maps_link = f"https://maps.google.com/maps?q={sos_request.location.latitude},{sos_request.location.longitude}"
+        location_text += f"\nView on map: {maps_link}"
+    # The number where the SOS is happening, not where the profile was saved
+    profile = {
+        "emergency_number_source": user.emergency_number_source,
+        "emergency_number": user.emergency_number,
+        "country": user.country,
+        **(user_changes or {})
+    }
+    user_fields = {}
+    if sos_request.location:
+        user_fields = location_update_fields(
+            sos_request.location.dict(), profile["emergency_number_source"], profile["country"],
+            datetime.now(timezone.utc)
+        )
+        profile.update(user_fields)
+    if LIVE_SHARE_BASE_URL:
+        location_text += f"\nLive location: {LIVE_SHARE_BASE_URL.rstrip('/')}/{emergency_alert.share_token}"
+    
+    # Queue one SMS per contact; the outbox dispatcher delivers them and
+    # records each delivery in contacts_notified
+    outbox_entries = []
+    if emergency_contacts and await sns.aget():
+        sms_message = (
+            f"🚨 EMERGENCY ALERT 🚨\n"
+            f"From: {user.name}\n"
+            f"Type: {sos_request.emergency_type.upper()}\n"
+            f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"Message: {emergency_alert.message}"
+            f"{location_text}\n\n"
+            f"This is an automated emergency alert from Aidly."
         )
+        outbox_entries = build_outbox_entries(emergency_alert.id, emergency_contacts, sms_message)
+    
+    response = {
+        "message": "SOS alert triggered",
+        "alert_id": emergency_alert.id,
+        "contacts_queued": len(outbox_entries),
+        "notifications": [
+            {"contact_id": entry["contact_id"], "priority": entry["priority"], "status": "queued"}
+            for entry in outbox_entries
+        ],
+        "emergency_number": profile["emergency_number"] or "911",
+        "country": profile["country"],
+        "share_token": emergency_alert.share_token,
+        "live_url": f"/api/live/{emergency_alert.share_token}"
+    }
+    return emergency_alert.dict(), outbox_entries, response, user_fields
+
+async def current_emergency_contacts(user: User) -> List[Dict[str, Any]]:
+    """The contacts as stored right now, for the SOS.
+    
+    The authenticated user comes from a session snapshot or a per-worker cache
+    and can lag a contact change made on another device or worker. This one
+    projected read is the SOS path's only users read.
+    """
+    try:
+        doc = await find_user({"id": user.id}, {"_id": 0, "emergency_contacts": 1})
+    except Exception as e:
+        logging.error(f"Contacts read failed, using the session's copy: {e}")
+        doc = None
+    return doc.get("emergency_contacts", []) if doc else list(user.emergency_contacts)
+
+async def create_sos_alert(sos_request: SOSRequest, user: User) -> Dict[str, Any]:
+    try:
+        contacts = await current_emergency_contacts(user)
+        alert, outbox_entries, response, user_fields = await build_sos_alert(sos_request, user, contacts)
         
-        return {
-            "message": "SOS alert triggered",
-            "alert_id": emergency_alert.id,
-            "contacts_notified": len(contacts_notified),
-            "emergency_number": user.emergency_number or "911"
-        }
+        # Save alert and outbox together
+        await insert_alerts_with_outbox(client, db, [alert], outbox_entries)
+        outbox_dispatcher.wake()
+        await nearby_alerts.touch([alert["geo"]])
     
     except Exception as e:
         logging.error(f"SOS error: {e}")
         raise HTTPException(status_code=500, detail="Failed to trigger SOS alert")
+    
+    if user_fields:
+        # The alert is out; remembering where it happened must not fail it
+        try:
+            await db.users.update_one({"id": user.id}, {"$set": user_fields})
+            await sessions.mirror(user.id, [{"$set": user_fields}])
+            session_cache.refresh_user(user.id, **user_fields)
+            await session_invalidations.publish(user_id=user.id, invalidate_local=False)
+        except Exception as e:
+            logging.error(f"SOS location save error: {e}")
+    return response
+
+def encode_alert_cursor(alert: Dict[str, Any]) -> str:
+    """Opaque continuation token for the (created_at, id) keyset"""
+    return encode_cursor({"c": alert["created_at"].isoformat(), "i": alert["id"]})
+
+def decode_alert_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        raw = decode_cursor(cursor)
+        created_at = datetime.fromisoformat(raw["c"])
+        alert_id = str(raw["i"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Everything strictly after the cursor in (created_at desc, id desc) order
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": alert_id}}
+    ]}
 
 @api_router.get("/emergency/alerts")
-async def get_emergency_alerts(user: User = Depends(require_auth)):
-    """Get user's emergency alerts history"""
-    alerts = await db.emergency_alerts.find(
-        {"user_id": user.id}
-    ).sort("created_at", -1).to_list(50)
+async def get_emergency_alerts(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    alert_status: Optional[str] = Query(None, alias="status"),
+    emergency_type: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    include_trail: bool = False,
+    trail_points: int = Query(50, ge=2, le=500),
+    user: User = Depends(require_auth)
+):
+    """Get user's emergency alerts history, newest first.
     
-    return [EmergencyAlert(**alert) for alert in alerts]
+    JSON pages default to 50 alerts; when more exist the X-Next-Cursor header
+    carries the token for the next page. format=ndjson streams every matching
+    alert (or up to ``limit``) one per line as the cursor produces them.
+    include_trail adds each alert's track to JSON pages, evenly reduced to at
+    most ``trail_points`` points.
+    """
+    query: Dict[str, Any] = {"user_id": user.id}
+    if alert_status:
+        query["status"] = alert_status
+    if emergency_type:
+        query["emergency_type"] = emergency_type
+    if cursor:
+        query.update(decode_alert_cursor(cursor))
+    
+    alerts_cursor = db.emergency_alerts.find(query, {"_id": 0}).sort(
+        [("created_at", -1), ("id", -1)]
+    )
+    
+    if format == "ndjson":
+        if limit:
+            alerts_cursor = alerts_cursor.limit(limit)
+        
+        async def stream():
+            async for alert in alerts_cursor.batch_size(200):
+                yield dumps(alert) + b"\n"
+        
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+    
+    limit = limit or 50
+    # One extra row tells us whether there is another page
+    alerts = await alerts_cursor.limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(alerts) > limit:
+        alerts = alerts[:limit]
+        headers["X-Next-Cursor"] = encode_alert_cursor(alerts[-1])
+    
+    if include_trail and alerts:
+        # One query for the whole page's trails
+        trails = await trail_writer.read_many([alert["id"] for alert in alerts])
+        for alert in alerts:
+            alert["trail"] = downsample(trails[alert["id"]], max_points=trail_points)
+    
+    if FAST_RESPONSES:
+        return fast_response(alerts, List[EmergencyAlert], validate=FAST_RESPONSES_VALIDATE, headers=headers)
+    response.headers.update(headers)
+    return alerts
 
 @api_router.post("/emergency/alerts/{alert_id}/resolve")
 async def resolve_emergency_alert(alert_id: str, user: User = Depends(require_auth)):
     """Mark emergency alert as resolved"""
-    result = await db.emergency_alerts.update_one(
+    alert = await db.emergency_alerts.find_one_and_update(
         {"id": alert_id, "user_id": user.id},
         {
             "$set": {
                 "status": "resolved",
                 "resolved_at": datetime.now(timezone.utc)
             }
-        }
+        },
+        projection={"_id": 0, "geo": 1}
     )
     
-    if result.matched_count == 0:
+    if alert is None:
         raise HTTPException(status_code=404, detail="Alert not found")
     
+    # Drops the alert from cached dispatch searches of its area
+    await nearby_alerts.touch([alert.get("geo")])
+    # Ends the victim's and every watcher's live location stream
+    live_hub.close(alert_id)
+    await trail_writer.flush([alert_id])
     return {"message": "Alert resolved"}
 
+@api_router.get("/dispatch/alerts/nearby")
+async def get_nearby_alerts(
+    response: Response,
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+    radius_m: Optional[float] = Query(None, gt=0, le=1_000_000),
+    bbox: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    user: User = Depends(require_coordinator)
+):
+    """Active alerts within ``radius_m`` of lat/lon and/or inside
+    ``bbox=min_lon,min_lat,max_lon,max_lat``, nearest first.
+    
+    Without lat/lon, distances are from the centre of the bbox. When more
+    alerts match, the X-Next-Cursor header carries the token for the next page.
+    """
+    box = None
+    if bbox:
+        try:
+            box = parse_bbox(bbox)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid bbox")
+    if box is None and radius_m is None:
+        raise HTTPException(status_code=400, detail="radius_m or bbox required")
+    if lat is None or lon is None:
+        if box is None:
+            raise HTTPException(status_code=400, detail="lat and lon required with radius_m")
+        lat, lon = (box[1] + box[3]) / 2, (box[0] + box[2]) / 2
+    after = None
+    if cursor:
+        try:
+            after = decode_nearby_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    alerts, next_cursor = await nearby_alerts.search(lat, lon, radius_m, box, limit, after)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return alerts
+
+TRAIL_MODE_PATTERN = "^(time|distance)$"
+
+async def alert_trail(alert_id: str, mode: str, resolution: float, max_points: int) -> Dict[str, Any]:
+    points = await trail_writer.read(alert_id)
+    track = downsample(points, mode, resolution, max_points)
+    return {"alert_id": alert_id, "total_points": len(points), "points": track}
+
+@api_router.get("/emergency/alerts/{alert_id}/trail")
+async def get_alert_trail(
+    alert_id: str,
+    mode: str = Query("time", pattern=TRAIL_MODE_PATTERN),
+    resolution: float = Query(0, ge=0),
+    max_points: int = Query(500, ge=2, le=5000),
+    user: User = Depends(require_auth)
+):
+    """Location track of an alert, reduced to one point per ``resolution``
+    seconds (mode=time) or metres (mode=distance), at most ``max_points``"""
+    if not await db.emergency_alerts.count_documents({"id": alert_id, "user_id": user.id}, limit=1):
+        raise HTTPException(status_code=404, detail="Alert not found")
+    return await alert_trail(alert_id, mode, resolution, max_points)
+
+# Live location
+LIVE_ALERT_PROJECTION = {"_id": 0, "id": 1, "user_id": 1, "status": 1, "location": 1}
+
+async def alert_is_active(alert_id: str) -> bool:
+    return await db.emergency_alerts.count_documents({"id": alert_id, "status": "active"}, limit=1) > 0
+
+def live_position(location: LocationData) -> Dict[str, Any]:
+    return {**location.dict(), "timestamp": datetime.now(timezone.utc).isoformat()}
+
+async def live_publisher_token(websocket: WebSocket) -> Optional[str]:
+    """Bearer token from the Authorization header, else from the first message.
+    
+    The socket is accepted before reading a message. Tokens are never taken
+    from the URL, where proxies and access logs would keep them.
+    """
+    await websocket.accept()
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:]
+    try:
+        message = await asyncio.wait_for(websocket.receive_json(), timeout=LIVE_AUTH_TIMEOUT)
+    except (asyncio.TimeoutError, KeyError, TypeError, ValueError):
+        return None
+    token = message.get("token") if isinstance(message, dict) and message.get("type") == "auth" else None
+    return token if isinstance(token, str) else None
+
+@api_router.websocket("/emergency/alerts/{alert_id}/live")
+async def publish_live_location(websocket: WebSocket, alert_id: str):
+    """The victim's device streams its position for an active alert.
+    
+    Browsers can't set headers on a WebSocket, so without an Authorization
+    header the first message must be {"type": "auth", "token": ...}. Each
+    following message is a LocationData JSON object; once the alert is
+    resolved the next message closes the socket.
+    """
+    try:
+        token = await live_publisher_token(websocket)
+    except WebSocketDisconnect:
+        return
+    user = await user_for_token(token) if token else None
+    if not user:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Authentication required")
+        return
+    alert = await db.emergency_alerts.find_one(
+        {"id": alert_id, "user_id": user.id, "status": "active"}, LIVE_ALERT_PROJECTION
+    )
+    if not alert:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="No active alert")
+        return
+    
+    channel = live_hub.attach_publisher(alert_id)
+    try:
+        while not channel.closed:
+            try:
+                location = LocationData(**await websocket.receive_json())
+            except (ValidationError, TypeError, ValueError):
+                await websocket.send_json({"error": "Invalid location"})
+                continue
+            if channel.closed:
+                break
+            channel.publish(live_position(location))
+            trail_writer.add(alert_id, user.id, trail_point(location.latitude, location.longitude, location.accuracy))
+        await websocket.close(code=status.WS_1000_NORMAL_CLOSURE, reason="Alert resolved")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        live_hub.detach_publisher(alert_id, channel)
+
+async def live_alert_for_share(share_token: str) -> Optional[Dict[str, Any]]:
+    return await db.emergency_alerts.find_one(
+        {"share_token": share_token, "status": "active"}, LIVE_ALERT_PROJECTION
+    )
+
+def live_updates(alert: Dict[str, Any]):
+    """Coalesced, throttled positions of an alert; None is a heartbeat"""
+    alert_id = alert["id"]
+    initial = live_hub.latest(alert_id) or alert.get("location")
+    return live_hub.watch(alert_id, lambda: alert_is_active(alert_id), initial=initial)
+
+@api_router.get("/live/{share_token}")
+async def watch_live_location(share_token: str):
+    """Server-sent events with the live position of an active alert"""
+    alert = await live_alert_for_share(share_token)
+    if not alert:
+        raise HTTPException(status_code=404, detail="No active alert for this link")
+    
+    async def events():
+        async for position in live_updates(alert):
+            if position is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: location\ndata: {json.dumps(position, default=str)}\n\n"
+        yield "event: resolved\ndata: {}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@api_router.get("/live/{share_token}/trail")
+async def get_live_trail(
+    share_token: str,
+    mode: str = Query("time", pattern=TRAIL_MODE_PATTERN),
+    resolution: float = Query(0, ge=0),
+    max_points: int = Query(500, ge=2, le=5000)
+):
+    """The track so far, for a watcher joining an active alert late"""
+    alert = await live_alert_for_share(share_token)
+    if not alert:
+        raise HTTPException(status_code=404, detail="No active alert for this link")
+    return await alert_trail(alert["id"], mode, resolution, max_points)
+
+@api_router.websocket("/live/{share_token}/ws")
+async def watch_live_location_ws(websocket: WebSocket, share_token: str):
+    """WebSocket variant of the share link stream"""
+    alert = await live_alert_for_share(share_token)
+    if not alert:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="No active alert for this link")
+        return
+    
+    await websocket.accept()
+    try:
+        async for position in live_updates(alert):
+            if position is None:
+                # Keeps proxies from closing an idle socket, and lets the
+                # watcher notice a dead connection
+                await websocket.send_json({"type": "keepalive"})
+            else:
+                await websocket.send_text(json.dumps({"type": "location", "position": position}, default=str))
+        await websocket.send_json({"type": "resolved"})
+        await websocket.close(code=status.WS_1000_NORMAL_CLOSURE)
+    except WebSocketDisconnect:
+        pass
+
+# Offline sync
+def parse_sync_action(action: SyncAction) -> Any:
+    """The action's request model, validated like the matching single endpoint"""
+    if action.type == "sos":
+        return SOSRequest(**action.data)
+    if action.type == "add_contact":
+        return EmergencyContactCreate(**action.data)
+    if action.type == "delete_contact":
+        contact_id = action.data.get("contact_id")
+        if not isinstance(contact_id, str):
+            raise HTTPException(status_code=400, detail="contact_id required")
+        return contact_id
+    if action.type == "update_profile":
+        return profile_update_fields(action.data)
+    if action.type == "location_update":
+        return LocationData(**action.data)
+    raise HTTPException(status_code=400, detail=f"Unknown action type: {action.type}")
+
+def sync_error(exc: Exception) -> Dict[str, Any]:
+    if isinstance(exc, IdempotencyKeyReused):
+        detail = "Idempotency key was already used for a different request"
+        return {"status": "error", "status_code": 422, "detail": detail}
+    if isinstance(exc, IdempotencyInProgress):
+        detail = "A request with this idempotency key is still in progress"
+        return {"status": "error", "status_code": 409, "detail": detail}
+    if isinstance(exc, HTTPException):
+        return {"status": "error", "status_code": exc.status_code, "detail": exc.detail}
+    if isinstance(exc, ValidationError):
+        return {"status": "error", "status_code": 422, "detail": exc.errors(include_url=False)}
+    return {"status": "error", "status_code": 500, "detail": "Failed to apply action"}
+
+@api_router.post("/sync/batch")
+async def sync_batch(batch: SyncBatch, user: User = Depends(require_auth)):
+    """Apply a device's queued offline actions in order, in one request.
+    
+    Every users write goes out in one ordered bulk_write and every SOS alert
+    with its outbox entries in one insert. Actions carrying an
+    idempotency_key share the key space of the single endpoints, so an
+    action already applied by an earlier replay returns its stored response.
+    """
+    now = datetime.now(timezone.utc)
+    results: List[Dict[str, Any]] = [
+        {"index": i, "type": action.type, "status": "pending"} for i, action in enumerate(batch.actions)
+    ]
+    
+    parsed: Dict[int, Any] = {}
+    for i, action in enumerate(batch.actions):
+        try:
+            parsed[i] = parse_sync_action(action)
+        except (HTTPException, ValidationError) as e:
+            results[i].update(sync_error(e))
+    
+    # Claim every idempotency key in one round trip; the same key twice in a
+    # batch is applied once
+    key_ids: Dict[int, str] = {}
+    claims: Dict[str, str] = {}
+    for i in parsed:
+        action = batch.actions[i]
+        if action.idempotency_key:
+            key_id = idempotency.key_id(user.id, action.type, action.idempotency_key)
+            key_ids[i] = key_id
+            # Hashed like the single endpoints hash their request models
+            request = parsed[i]
+            claims.setdefault(key_id, request_hash(request.dict() if isinstance(request, BaseModel) else request))
+    claimed = await idempotency.claim_many(claims) if claims else {}
+    
+    # Keys this request owns; released if anything below raises, so a retry
+    # executes them instead of waiting out the lease
+    owned = [key_id for key_id, claim in claimed.items() if claim is None]
+    try:
+        owners: Dict[str, int] = {}
+        user_ops: List[UpdateOne] = []
+        user_updates: List[Dict[str, Any]] = []
+        user_op_actions: List[int] = []
+        alerts: List[Dict[str, Any]] = []
+        outbox_entries: List[Dict[str, Any]] = []
+        alert_actions: List[int] = []
+        # Later actions see the contacts as changed by earlier ones; an SOS
+        # needs them as stored, not as the session remembers them
+        if any(batch.actions[i].type == "sos" for i in parsed):
+            contacts = await current_emergency_contacts(user)
+        else:
+            contacts = list(user.emergency_contacts)
+        user_changes: Dict[str, Any] = {}
+        
+        for i, request in parsed.items():
+            key_id = key_ids.get(i)
+            if key_id is not None:
+                claim = claimed.get(key_id)
+                if isinstance(claim, Exception):
+                    results[i].update(sync_error(claim))
+                    continue
+                if claim is not None:
+                    results[i].update(status="replayed", response=claim)
+                    continue
+                if key_id in owners:
+                    results[i].update(status="duplicate", duplicate_of=owners[key_id])
+                    continue
+                owners[key_id] = i
+            
+            action_type = batch.actions[i].type
+            try:
+                update = None
+                if action_type == "sos":
+                    alert, entries, response, fields = await build_sos_alert(request, user, contacts, user_changes)
+                    alerts.append(alert)
+                    outbox_entries.extend(entries)
+                    alert_actions.append(i)
+                    if fields:
+                        user_changes.update(fields)
+                        update = {"$set": fields}
+                else:
+                    if action_type == "add_contact":
+                        new_contact = build_emergency_contact(request).dict()
+                        contacts.append(new_contact)
+                        user_changes["emergency_contacts"] = contacts
+                        update = {"$push": {"emergency_contacts": new_contact}}
+                        response = {"message": "Emergency contact added", "contact_id": new_contact["id"]}
+                    elif action_type == "delete_contact":
+                        contacts = [c for c in contacts if c.get("id") != request]
+                        user_changes["emergency_contacts"] = contacts
+                        update = {"$pull": {"emergency_contacts": {"id": request}}}
+                        response = {"message": "Emergency contact deleted"}
+                    elif action_type == "update_profile":
+                        # A profile update with no allowed fields writes nothing
+                        if request:
+                            fields = dict(request)
+                            fields.update(profile_emergency_fields(
+                                fields,
+                                user_changes.get("emergency_number_source", user.emergency_number_source),
+                                user_changes.get("phone", user.phone),
+                                user_changes.get("last_location", user.last_location)
+                            ))
+                            user_changes.update(fields)
+                            update = {"$set": fields}
+                        response = {
+                            "message": "Profile updated",
+                            "emergency_number": user_changes.get("emergency_number", user.emergency_number),
+                            "country": user_changes.get("country", user.country)
+                        }
+                    else:
+                        fields = location_update_fields(
+                            request.dict(),
+                            user_changes.get("emergency_number_source", user.emergency_number_source),
+                            user_changes.get("country", user.country),
+                            now
+                        )
+                        user_changes.update(fields)
+                        update = {"$set": fields}
+                        response = {"message": "Location updated"}
+                if update:
+                    user_ops.append(UpdateOne({"id": user.id}, update))
+                    user_updates.append(update)
+                    user_op_actions.append(i)
+                results[i].update(status="ok", response=response)
+            except HTTPException as e:
+                results[i].update(sync_error(e))
+        
+        # One ordered bulk_write for the users collection; on an error the
+        # failing op and everything after it are not applied
+        if user_ops:
+            try:
+                await db.users.bulk_write(user_ops, ordered=True)
+                await sessions.mirror(user.id, user_updates)
+                # Refresh this worker's cached user in place, drop it everywhere else
+                session_cache.refresh_user(user.id, **user_changes)
+                await session_invalidations.publish(user_id=user.id, invalidate_local=False)
+            except Exception as e:
+                logging.error(f"Sync users write error: {e}")
+                failed_at = e.details["writeErrors"][0]["index"] if isinstance(e, BulkWriteError) else 0
+                # Ops before the failure were applied
+                await sessions.mirror(user.id, user_updates[:failed_at])
+                for op_index, i in enumerate(user_op_actions[failed_at:]):
+                    if batch.actions[i].type == "sos":
+                        # The alert still goes out without its location saved
+                        continue
+                    results[i].update(sync_error(e) if op_index == 0 else {
+                        "status": "error", "status_code": 409, "detail": "Not applied after an earlier failure"
+                    })
+                    results[i].pop("response", None)
+                await session_invalidations.publish(user_id=user.id)
+        
+        if alerts:
+            try:
+                await insert_alerts_with_outbox(client, db, alerts, outbox_entries)
+                outbox_dispatcher.wake()
+                await nearby_alerts.touch(alert["geo"] for alert in alerts)
+            except Exception as e:
+                logging.error(f"Sync SOS error: {e}")
+                for i in alert_actions:
+                    results[i].update(sync_error(e))
+                    results[i].pop("response", None)
+        
+        # Store responses of applied keyed actions, release the keys of failures
+        done = {key_id: results[i]["response"] for key_id, i in owners.items() if results[i]["status"] == "ok"}
+        await idempotency.complete(done)
+        await idempotency.release([key_id for key_id in owners if key_id not in done])
+    except BaseException:
+        await idempotency.release(owned)
+        raise
+    
+    for result in results:
+        if result["status"] == "duplicate":
+            original = results[result["duplicate_of"]]
+            result.update({k: v for k, v in original.items() if k not in ("index", "type", "status")})
+            result["status"] = "replayed" if original["status"] == "ok" else original["status"]
+    
+    return {
+        "results": results,
+        "applied": sum(1 for r in results if r["status"] == "ok"),
+        "replayed": sum(1 for r in results if r["status"] == "replayed"),
+        "failed": sum(1 for r in results if r["status"] == "error")
+    }
+
 # Location services
 @api_router.post("/location/reverse-geocode")
 async def reverse_geocode(location: LocationData, user: User = Depends(require_auth)):
     """Convert coordinates to address"""
     try:
-        location_info = geolocator.reverse(f"{location.latitude}, {location.longitude}")
-        address = location_info.address if location_info else "Address not found"
+        address = await geocode_cache.lookup(location.latitude, location.longitude)
+        address = address or "Address not found"
         
         return {
             "address": address,
@@ -530,63 +1599,197 @@ async def reverse_geocode(location: LocationData, user: User = Depends(require_a
             "longitude": location.longitude
         }
 
-# Image generation endpoint
+# Image generation endpoints
+def medical_image_prompt(prompt: str) -> str:
+    """Wrap a user prompt with medical illustration context"""
+    return f"Medical emergency procedure illustration: {prompt}. Clean, educational, medical diagram style."
+
+def image_job_response(job: Dict[str, Any]) -> Dict[str, Any]:
+    job = {**job, "status_url": f"/api/generate-image/jobs/{job['id']}"}
+    if job["status"] == "done":
+        job["image_url"] = f"/api/images/{job['image_id']}"
+    return job
+
+async def submit_image_job(prompt: str, user: User) -> Dict[str, Any]:
+    medical_prompt = medical_image_prompt(prompt)
+    key = image_key(medical_prompt, IMAGE_MODEL)
+    
+    # Identical prompts are served from the store, even without a generator
+    if not await image_generator.aget() and await image_store.get(key) is None:
+        raise HTTPException(status_code=503, detail="Image generation service not available")
+    
+    try:
+        return await image_jobs.submit(user.id, key, medical_prompt)
+    except QuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+@api_router.post("/generate-image/jobs", status_code=202)
+async def create_image_job(prompt: str, user: User = Depends(require_auth)):
+    """Queue a medical image generation job and return immediately"""
+    job = await submit_image_job(prompt, user)
+    return image_job_response(job)
+
+@api_router.get("/generate-image/jobs/{job_id}")
+async def get_image_job(job_id: str, user: User = Depends(require_auth)):
+    """Poll an image generation job"""
+    job = await image_jobs.get(job_id, user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return image_job_response(job)
+
+@api_router.get("/generate-image/jobs/{job_id}/events")
+async def stream_image_job(job_id: str, user: User = Depends(require_auth)):
+    """Server-sent events with every status change of an image generation job"""
+    if not await image_jobs.get(job_id, user.id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def events():
+        async for job in image_jobs.watch(job_id, user.id):
+            payload = json.dumps(image_job_response(job), default=str)
+            yield f"event: status\ndata: {payload}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @api_router.post("/generate-image")
 async def generate_medical_image(prompt: str, user: User = Depends(require_auth)):
     """Generate medical procedure image"""
-    if not image_gen:
-        raise HTTPException(status_code=503, detail="Image generation service not available")
+    # Runs through the job scheduler so generations stay bounded; the request
+    # just waits for the job instead of calling the model directly
+    job = await submit_image_job(prompt, user)
+    job = await image_jobs.wait(job["id"], user.id, timeout=IMAGE_JOB_WAIT_TIMEOUT) or job
     
-    try:
-        # Generate image with medical context
-        medical_prompt = f"Medical emergency procedure illustration: {prompt}. Clean, educational, medical diagram style."
-        
-        images = await image_gen.generate_images(
-            prompt=medical_prompt,
-            model="gpt-image-1",
-            number_of_images=1
-        )
-        
-        if images and len(images) > 0:
-            image_base64 = base64.b64encode(images[0]).decode('utf-8')
-            return {"image_base64": image_base64}
-        else:
-            raise HTTPException(status_code=500, detail="No image was generated")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Image generation failed: {job.get('error')}")
+    if job["status"] != "done":
+        raise HTTPException(status_code=504, detail="Image generation is still running")
     
-    except Exception as e:
-        logging.error(f"Image generation error: {e}")
-        raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
+    return {"image_id": job["image_id"], "image_url": f"/api/images/{job['image_id']}"}
+
+@api_router.get("/images/{image_id}")
+async def get_generated_image(image_id: str, if_none_match: Optional[str] = Header(None)):
+    """Serve a generated image as raw bytes; content-addressed, so cacheable forever"""
+    if not is_image_key(image_id):
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    headers = {
+        "ETag": f'"{image_id}"',
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+    if if_none_match and image_id in if_none_match:
+        return Response(status_code=304, headers=headers)
+    
+    data = await image_store.get(image_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    return Response(content=data, media_type=sniff_media_type(data), headers=headers)
 
 # Health check endpoint
+HEALTH_DB_TIMEOUT = float(os.environ.get('HEALTH_DB_TIMEOUT', '2'))
+
 @api_router.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {
-        "status": "healthy",
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout=HEALTH_DB_TIMEOUT)
+        database = "connected"
+    except Exception as e:
+        logging.error(f"Health check database ping failed: {e}")
+        database = "disconnected"
+    
+    health = {
+        "status": "healthy" if database == "connected" else "unhealthy",
         "timestamp": datetime.now(timezone.utc).isoformat(),
         "services": {
-            "database": "connected",
-            "sms": "available" if sns_client else "unavailable",
-            "image_generation": "available" if image_gen else "unavailable"
-        }
+            "database": database,
+            "sms": "available" if await sns.aget() else "unavailable",
+            "image_generation": "available" if await image_generator.aget() else "unavailable"
+        },
+        "caches": {
+            "sessions": session_cache.stats(),
+            "reverse_geocode": geocode_cache.stats()
+        },
+        "live_location": live_hub.stats(),
+        "nearby_alerts": nearby_alerts.stats()
     }
+    return JSONResponse(health, status_code=200 if database == "connected" else 503)
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of request, MongoDB and external call metrics"""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
 @api_router.get("/")
 async def root():
     return {"message": "Aidly Medical Emergency Assistant API"}
 
-# Include router
-app.include_router(api_router)
-
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
-    expose_headers=["*"],
-)
+async def record_request_metrics(request: Request, call_next):
+    """Per-route latency histogram and status counts"""
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # The matched route's template, so path parameters don't explode labels
+        route = request.scope.get("route")
+        metrics.observe_request(
+            request.method,
+            getattr(route, "path", "unmatched"),
+            status_code,
+            time.perf_counter() - start
+        )
+
+async def audit_user_reads(request: Request, call_next):
+    """Count users-collection reads per request and flag endpoints over budget"""
+    # A mutable holder, so reads made in the endpoint's task are visible here
+    reads = [0]
+    token = user_reads.set(reads)
+    try:
+        response = await call_next(request)
+    finally:
+        user_reads.reset(token)
+    
+    if reads[0] > MAX_USER_READS:
+        logging.warning(f"{request.method} {request.url.path} made {reads[0]} user reads (max {MAX_USER_READS})")
+    if USER_READ_AUDIT:
+        response.headers["X-User-Reads"] = str(reads[0])
+    return response
+
+def create_app() -> FastAPI:
+    """Build the API app. Clients and caches are created by its lifespan, so
+    this is safe to call before a multi-worker server forks:
+
+        uvicorn server:create_app --factory --workers 4
+    """
+    app = FastAPI(
+        title="Aidly - Medical Emergency Assistant",
+        lifespan=lifespan,
+        default_response_class=FastJSONResponse if FAST_RESPONSES else JSONResponse
+    )
+    app.middleware("http")(record_request_metrics)
+    app.middleware("http")(audit_user_reads)
+    
+    # Include router
+    app.include_router(api_router)
+    
+    # Add CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        allow_headers=["*"],
+        expose_headers=["*"],
+    )
+    # Outermost, so every middleware and handler sees this app's resources
+    app.add_middleware(BindResources)
+    return app
+
+# Kept for `uvicorn server:app`; building the app opens no connections
+app = create_app()
 
 # Configure logging
 logging.basicConfig(
@@ -595,6 +1798,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+if __name__ == "__main__":
+    import uvicorn
+    # One worker per core; each builds its own clients in the lifespan
+    uvicorn.run(
+        "server:create_app",
+        factory=True,
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', '8001')),
+        workers=int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+    )
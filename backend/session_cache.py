@@ -0,0 +1,177 @@
+"""In-process cache of session token -> authenticated user.
+
+Sits in front of the ``users`` lookup done by ``get_current_user``. Entries are
+bounded (LRU), expire after a short TTL and never outlive the session itself.
+Invalidations are published to a small Mongo collection so that every worker
+drops stale entries within ``poll_interval`` seconds.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Set
+
+from background import BackgroundLoop
+
+logger = logging.getLogger(__name__)
+
+INVALIDATIONS_COLLECTION = "session_invalidations"
+
+
+class SessionCache:
+    """Bounded TTL/LRU map of session token -> user object."""
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 60.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        # token -> (user, monotonic deadline)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._tokens_by_user: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Any]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, deadline = entry
+        if time.monotonic() >= deadline:
+            self._remove(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, user: Any, session_expires: Optional[datetime]) -> None:
+        ttl = self.ttl_seconds
+        if session_expires is not None:
+            if session_expires.tzinfo is None:
+                session_expires = session_expires.replace(tzinfo=timezone.utc)
+            remaining = (session_expires - datetime.now(timezone.utc)).total_seconds()
+            ttl = min(ttl, remaining)
+        if ttl <= 0:
+            return
+
+        self._remove(token)
+        self._entries[token] = (user, time.monotonic() + ttl)
+        self._tokens_by_user.setdefault(user.id, set()).add(token)
+        while len(self._entries) > self.max_size:
+            oldest, (evicted, _) = self._entries.popitem(last=False)
+            self._unlink(oldest, evicted.id)
+
+    def refresh_user(self, user_id: str, **changes: Any) -> None:
+        """Apply field changes to every cached entry of a user, keeping deadlines."""
+        for token in list(self._tokens_by_user.get(user_id, ())):
+            user, deadline = self._entries[token]
+            self._entries[token] = (user.model_copy(update=changes), deadline)
+
+    def invalidate_token(self, token: str) -> None:
+        self._remove(token)
+
+    def invalidate_user(self, user_id: str) -> None:
+        for token in list(self._tokens_by_user.get(user_id, ())):
+            self._remove(token)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._tokens_by_user.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def _remove(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            self._unlink(token, entry[0].id)
+
+    def _unlink(self, token: str, user_id: str) -> None:
+        tokens = self._tokens_by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user_id]
+
+
+class SessionInvalidationFeed(BackgroundLoop):
+    """Cross-worker invalidation channel backed by a Mongo collection.
+
+    Every invalidation is written as a small document; each worker polls for
+    documents newer than the last one it has seen and applies them to its local
+    cache. Each poll looks back ``clock_skew`` seconds past the newest event it
+    has applied, since workers stamp events with their own clocks; re-applying
+    an invalidation is harmless. Events published by this worker are skipped on
+    poll since they were already applied locally.
+    """
+
+    def __init__(self, db, cache: SessionCache, poll_interval: float = 2.0, clock_skew: float = 5.0):
+        self.collection = db[INVALIDATIONS_COLLECTION]
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self.clock_skew = timedelta(seconds=clock_skew)
+        self.origin = uuid.uuid4().hex
+        self._last_seen = datetime.now(timezone.utc)
+
+    async def publish(
+        self,
+        user_id: Optional[str] = None,
+        token: Optional[str] = None,
+        invalidate_local: bool = True
+    ) -> None:
+        if invalidate_local:
+            if user_id:
+                self.cache.invalidate_user(user_id)
+            if token:
+                self.cache.invalidate_token(token)
+        try:
+            await self.collection.insert_one({
+                "origin": self.origin,
+                "user_id": user_id,
+                "token": token,
+                "created_at": datetime.now(timezone.utc),
+            })
+        except Exception as e:
+            # Peers still converge once their cache TTL runs out
+            logger.error(f"Failed to publish session invalidation: {e}")
+
+    async def poll_once(self) -> int:
+        cursor = self.collection.find(
+            {
+                "created_at": {"$gt": self._last_seen - self.clock_skew},
+                "origin": {"$ne": self.origin}
+            },
+            {"_id": 0, "user_id": 1, "token": 1, "created_at": 1},
+        ).sort("created_at", 1)
+        applied = 0
+        async for event in cursor:
+            if event.get("user_id"):
+                self.cache.invalidate_user(event["user_id"])
+            if event.get("token"):
+                self.cache.invalidate_token(event["token"])
+            created_at = event["created_at"]
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            self._last_seen = max(self._last_seen, created_at)
+            applied += 1
+        return applied
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Session invalidation poll failed: {e}")
+                # Can't tell what was missed, so drop everything
+                self.cache.clear()
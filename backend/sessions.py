@@ -0,0 +1,137 @@
+"""Login sessions, one document per device.
+
+A session lives in the ``sessions`` collection under ``_id`` =
+sha256(token), so the database never holds a usable token. MongoDB drops
+it at ``expires_at`` through a TTL index (see ``indexes.py``). Each document
+also carries ``user``, a snapshot of the ``SESSION_USER_FIELDS`` that
+handlers read. Authenticating is then a single ``_id`` lookup of one small
+document, and ``users`` is not touched.
+
+Writes to ``users`` are replayed onto the snapshots of that user's sessions
+(``mirror``). A snapshot older than ``snapshot_max_age`` is rebuilt from
+``users`` on its next cache miss, which bounds the damage of a lost mirror
+write. Each session also has a public ``id`` so that a user can list and
+revoke their devices without ever seeing other devices' tokens.
+"""
+import hashlib
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateMany
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_COLLECTION = "sessions"
+
+# What authenticated handlers read from the user; everything else (e.g.
+# created_at for GET /profile) is read from users when needed
+SESSION_USER_FIELDS = (
+    "id", "email", "name", "phone", "role", "emergency_contacts",
+    "location_enabled", "emergency_number", "country", "emergency_number_source",
+    "last_location",
+)
+
+SESSION_PROJECTION = {"_id": 0, "id": 1, "device": 1, "created_at": 1, "expires_at": 1}
+
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def user_snapshot(user: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: user[field] for field in SESSION_USER_FIELDS if field in user}
+
+
+def snapshot_update(update: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a ``users`` update that touches snapshot fields, re-rooted under ``user.``"""
+    mirrored = {}
+    for operator, fields in update.items():
+        picked = {
+            f"user.{path}": value for path, value in fields.items()
+            if path.split(".")[0] in SESSION_USER_FIELDS
+        }
+        if picked:
+            mirrored[operator] = picked
+    return mirrored
+
+
+def _aware(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+class SessionStore:
+    def __init__(self, db, ttl: timedelta = timedelta(days=7), snapshot_max_age: float = 3600.0):
+        self.collection = db[SESSIONS_COLLECTION]
+        self.ttl = ttl
+        self.snapshot_max_age = timedelta(seconds=snapshot_max_age)
+
+    async def create(
+        self,
+        token: str,
+        user: Dict[str, Any],
+        device: Dict[str, Any],
+        expires_at: Optional[datetime] = None
+    ) -> Dict[str, Any]:
+        now = datetime.now(timezone.utc)
+        session = {
+            "_id": token_hash(token),
+            "id": str(uuid.uuid4()),
+            "user_id": user["id"],
+            "device": device,
+            "created_at": now,
+            "expires_at": expires_at or now + self.ttl,
+            "synced_at": now,
+            "user": user_snapshot(user),
+        }
+        # An upsert, so two requests migrating the same legacy token both succeed
+        await self.collection.update_one({"_id": session["_id"]}, {"$setOnInsert": session}, upsert=True)
+        return session
+
+    async def find(self, key: str) -> Optional[Dict[str, Any]]:
+        """The live session for a token hash"""
+        return await self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+
+    def is_stale(self, session: Dict[str, Any]) -> bool:
+        return datetime.now(timezone.utc) - _aware(session["synced_at"]) > self.snapshot_max_age
+
+    async def resync(self, key: str, user: Dict[str, Any]) -> Dict[str, Any]:
+        snapshot = user_snapshot(user)
+        await self.collection.update_one(
+            {"_id": key},
+            {"$set": {"user": snapshot, "synced_at": datetime.now(timezone.utc)}}
+        )
+        return snapshot
+
+    async def mirror(self, user_id: str, updates: List[Dict[str, Any]]) -> int:
+        """Apply ``users`` updates to the user's snapshots; returns the sessions changed.
+
+        Never raises: a failure leaves snapshots stale until ``snapshot_max_age``.
+        """
+        operations = [UpdateMany({"user_id": user_id}, mirrored) for mirrored in map(snapshot_update, updates) if mirrored]
+        if not operations:
+            return 0
+        try:
+            result = await self.collection.bulk_write(operations, ordered=True)
+            return result.modified_count
+        except Exception as e:
+            logger.error(f"Failed to update session snapshots of user {user_id}: {e}")
+            return 0
+
+    async def of_user(self, user_id: str) -> List[Dict[str, Any]]:
+        cursor = self.collection.find(
+            {"user_id": user_id, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+            {**SESSION_PROJECTION, "_id": 1}
+        ).sort("created_at", 1)
+        return await cursor.to_list(None)
+
+    async def revoke(self, user_id: str, session_id: str) -> Optional[str]:
+        """Delete one of the user's sessions by public id; returns its token hash"""
+        session = await self.collection.find_one_and_delete(
+            {"user_id": user_id, "id": session_id}, projection={"_id": 1}
+        )
+        return session["_id"] if session else None
+
+    async def revoke_key(self, key: str) -> None:
+        await self.collection.delete_one({"_id": key})
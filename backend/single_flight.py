@@ -0,0 +1,28 @@
+"""Collapse concurrent calls for the same key into one.
+
+The geocode cache, the image store and nearby search all put an expensive
+call behind a cache; on a miss, every concurrent caller for that key awaits
+the same task instead of repeating the call.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        """``call()``'s result, shared with every concurrent ``run`` of ``key``"""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(call())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # One caller giving up doesn't cancel the call for the others
+        return await asyncio.shield(future)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
@@ -0,0 +1,41 @@
+"""SOS SMS delivery over AWS SNS.
+
+boto3 is synchronous, so every ``publish`` runs on a bounded thread pool and
+is awaited with its own deadline. A thread can't be interrupted, so a publish
+that misses the deadline may still go out; its future is handed back so the
+caller can record what happened. Used by the notification outbox dispatcher.
+"""
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import Any, Dict
+
+from metrics import observe_external
+
+
+async def publish_sms(
+    sns_client,
+    executor: Executor,
+    phone: str,
+    message: str,
+    timeout: float
+) -> Dict[str, Any]:
+    """Publish one SMS off the event loop. Never raises.
+
+    On a timeout the result carries the still-running publish as ``late``.
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    future = loop.run_in_executor(
+        executor,
+        lambda: sns_client.publish(PhoneNumber=phone, Message=message)
+    )
+    try:
+        response = await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        result = {"status": "sent", "message_id": response.get("MessageId")}
+    except asyncio.TimeoutError:
+        result = {"status": "timeout", "error": f"No response from SNS within {timeout}s", "late": future}
+    except Exception as e:
+        result = {"status": "failed", "error": str(e)}
+    observe_external("sns", result["status"], time.perf_counter() - start)
+    return result
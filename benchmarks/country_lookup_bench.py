@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Point-in-country lookup benchmark.
+
+Times CountryIndex.lookup (lookups per second, µs per lookup) over random
+points. It uses a built index (--index), builds one from boundaries
+(--geojson), or builds a synthetic world of irregular polygons when given
+neither. No server or database is needed.
+
+--check compares every lookup with a brute-force even-odd test against the
+simplified source rings and fails on disagreements away from borders.
+
+    python benchmarks/country_lookup_bench.py [--index backend/content/countries.idx]
+    python benchmarks/country_lookup_bench.py --geojson countries.geojson --check
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from country_index import CountryIndex, Ring, build, features_from_geojson, simplify  # noqa: E402
+
+
+def synthetic_world(step: float = 10.0, vertices: int = 400, seed: int = 7) -> List[Tuple[str, List[Ring]]]:
+    """One wobbly polygon per ``step`` degree square, border-heavy like real coastlines"""
+    rng = random.Random(seed)
+    features = []
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    n = 0
+    for lat in range(-80, 80, int(step)):
+        for lon in range(-180, 180, int(step)):
+            cx, cy = lon + step / 2, lat + step / 2
+            phases = [rng.uniform(0, 2 * math.pi) for _ in range(3)]
+            ring = []
+            for i in range(vertices):
+                a = 2 * math.pi * i / vertices
+                r = step * (0.35 + 0.05 * sum(math.sin((k + 3) * a + p) for k, p in enumerate(phases)))
+                ring.append((cx + r * math.cos(a), cy + r * math.sin(a)))
+            features.append((letters[n // 26 % 26] + letters[n % 26], [ring]))
+            n += 1
+    return features
+
+
+def brute_force(features: Sequence[Tuple[str, List[Ring]]], lat: float, lon: float) -> Optional[str]:
+    for iso, rings in features:
+        inside = False
+        for ring in rings:
+            j = len(ring) - 1
+            for i in range(len(ring)):
+                (xi, yi), (xj, yj) = ring[i], ring[j]
+                if (yi > lat) != (yj > lat) and lon < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+                    inside = not inside
+                j = i
+        if inside:
+            return iso
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="a built index file")
+    parser.add_argument("--geojson", help="boundaries to build an index from")
+    parser.add_argument("--cell-degrees", type=float, default=1.0)
+    parser.add_argument("--tolerance", type=float, default=0.01)
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--check", action="store_true", help="verify against a brute-force test")
+    parser.add_argument("--check-points", type=int, default=2000)
+    args = parser.parse_args()
+
+    features = None
+    path = args.index
+    if not path:
+        if args.geojson:
+            with open(args.geojson, encoding="utf-8") as f:
+                features = list(features_from_geojson(json.load(f)))
+        else:
+            features = synthetic_world()
+        started = time.perf_counter()
+        data = build(features, args.cell_degrees, args.tolerance)
+        print(f"built {len(data) / 1e6:.1f} MB index in {time.perf_counter() - started:.1f} s")
+        fd, path = tempfile.mkstemp(suffix=".idx")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+    started = time.perf_counter()
+    index = CountryIndex(path)
+    print(f"opened {len(index.countries)} countries, {index.pieces} pieces in {(time.perf_counter() - started) * 1e3:.2f} ms")
+
+    rng = random.Random(1)
+    points = [(rng.uniform(-60, 70), rng.uniform(-180, 180)) for _ in range(args.lookups)]
+    started = time.perf_counter()
+    found = sum(1 for lat, lon in points if index.lookup(lat, lon))
+    elapsed = time.perf_counter() - started
+    print(f"{args.lookups} lookups ({found} on land): {args.lookups / elapsed:,.0f}/s, {elapsed / args.lookups * 1e6:.2f} µs each")
+
+    if args.check:
+        if features is None:
+            sys.exit("--check needs --geojson or the synthetic world, not a prebuilt --index")
+        simplified = [(iso, [simplify(ring, args.tolerance) for ring in rings]) for iso, rings in features]
+        mismatches = []
+        for lat, lon in points[:args.check_points]:
+            expected = brute_force(simplified, lat, lon)
+            got = index.lookup(lat, lon)
+            # Float32 storage can flip points right on a border
+            if got != expected and all(
+                brute_force(simplified, lat + dlat, lon + dlon) == expected
+                for dlat, dlon in ((1e-4, 0), (-1e-4, 0), (0, 1e-4), (0, -1e-4))
+            ):
+                mismatches.append((lat, lon, expected, got))
+        if mismatches:
+            for lat, lon, expected, got in mismatches[:10]:
+                print(f"FAIL: ({lat:.5f}, {lon:.5f}) expected {expected}, got {got}")
+            sys.exit(1)
+        print(f"OK: {args.check_points} lookups match the brute-force test")
+
+    index.close()
+    if not args.index:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
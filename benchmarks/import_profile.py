@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Start-up import profile for backend/server.py.
+
+Imports the server in a fresh interpreter under ``python -X importtime`` and
+reports the slowest top-level packages by cumulative import time.
+
+    python benchmarks/import_profile.py [--top 20]
+
+With --check it also enforces the start-up budget and exits non-zero when
+the import of server takes longer than --budget-ms (best of --runs), or when
+any of the lazily loaded dependencies was imported eagerly:
+
+    python benchmarks/import_profile.py --check --budget-ms 1500
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+# Loaded on first use or warmed by the lifespan, never at import
+LAZY_MODULES = ("boto3", "botocore", "geopy", "emergentintegrations", "passlib", "jose")
+
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def profile_import() -> List[Tuple[str, int, int, int]]:
+    """(module, self µs, cumulative µs, depth) for every module server imports"""
+    env = {
+        **os.environ,
+        "MONGO_URL": os.environ.get("MONGO_URL", "mongodb://localhost:27017"),
+        "DB_NAME": os.environ.get("DB_NAME", "aidly_import_profile"),
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Importing server failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+def by_package(rows: List[Tuple[str, int, int, int]]) -> Dict[str, int]:
+    """Cumulative µs per top-level package, counted where it is first pulled in"""
+    totals: Dict[str, int] = defaultdict(int)
+    # importtime prints children before their parent; reversed, it is a
+    # parent-first walk and the stack holds the packages of the ancestors
+    stack: List[str] = []
+    for module, _, cumulative_us, depth in reversed(rows):
+        del stack[depth:]
+        package = module.split(".")[0]
+        if package not in stack:
+            totals[package] += cumulative_us
+        stack.append(package)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--check", action="store_true", help="enforce the budget and lazy imports")
+    parser.add_argument("--budget-ms", type=float, default=1500)
+    parser.add_argument("--runs", type=int, default=3, help="runs for --check; the fastest counts")
+    args = parser.parse_args()
+
+    rows = profile_import()
+    server_us = next(cumulative for module, _, cumulative, _ in rows if module == "server")
+
+    print(f"{'package':<32}{'cumulative ms':>15}")
+    packages = sorted(by_package(rows).items(), key=lambda item: item[1], reverse=True)
+    for package, cumulative_us in packages[:args.top]:
+        print(f"{package:<32}{cumulative_us / 1000:>15.1f}")
+    print(f"\nimport server: {server_us / 1000:.1f} ms")
+
+    if not args.check:
+        return
+
+    failures = []
+    eager = sorted({module.split(".")[0] for module, *_ in rows} & set(LAZY_MODULES))
+    if eager:
+        failures.append(f"imported at start-up but should be lazy: {', '.join(eager)}")
+
+    best_us = min([server_us] + [
+        next(c for m, _, c, _ in profile_import() if m == "server") for _ in range(args.runs - 1)
+    ])
+    if best_us / 1000 > args.budget_ms:
+        failures.append(f"import server took {best_us / 1000:.1f} ms, budget is {args.budget_ms:.0f} ms")
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print(f"OK: {best_us / 1000:.1f} ms within {args.budget_ms:.0f} ms budget, no eager heavy imports")
+
+
+if __name__ == "__main__":
+    main()
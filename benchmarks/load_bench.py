@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Aidly Backend Load & Latency Benchmark
+Runs backend/server.py fully offline and drives a concurrent request mix
+against it, reporting throughput and p50/p95/p99 latency per route.
+
+Requires a real MongoDB: a mongod binary on PATH (the bench starts a
+throwaway instance) or --mongo-url pointing at a running server. MongoDB is
+not stubbed, so without either the bench exits before sending any load.
+
+Every other external service is stubbed locally:
+  * SNS, Nominatim, Emergent Auth - HTTP stubs from stubs.py
+  * image generation - StubImageGenerator, injected by stub_server.py
+Each stub's latency is configurable, so slow dependencies can be simulated.
+
+    python benchmarks/load_bench.py --mix default --concurrency 50 --duration 30
+    python benchmarks/load_bench.py --mix sos-storm --compare benchmarks/results/<previous>.json
+
+Results are written to benchmarks/results/<timestamp>-<commit>-<mix>.json.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parent
+RESULTS_DIR = BENCH_DIR / "results"
+sys.path.insert(0, str(BENCH_DIR))
+
+from stubs import StubServices, free_port  # noqa: E402
+
+# Relative weights of each operation per mix
+MIXES: Dict[str, Dict[str, int]] = {
+    "default": {
+        "login": 5, "profile": 15, "procedures": 20, "procedures_304": 10, "procedure": 10,
+        "sos": 5, "alerts": 15, "contacts": 10, "reverse_geocode": 10,
+    },
+    "sos-storm": {"sos": 70, "alerts": 15, "contacts": 15},
+    "procedure-polling": {"procedures": 40, "procedures_304": 50, "procedure": 10},
+    "login": {"login": 80, "profile": 20},
+    "alert-history": {"alerts": 80, "sos": 20},
+}
+
+# A handful of neighbourhoods, so reverse geocoding sees realistic bucket reuse
+HOTSPOTS = [(19.4326, -99.1332), (4.7110, -74.0721), (-34.6037, -58.3816), (-12.0464, -77.0428)]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+
+    def record(self, route: str, seconds: float, status: int):
+        self.latencies[route].append(seconds * 1000)
+        self.statuses[route][status] += 1
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+class AidlyLoadDriver:
+    def __init__(self, base_url: str, session: aiohttp.ClientSession, recorder: Recorder):
+        self.api_url = f"{base_url}/api"
+        self.session = session
+        self.recorder = recorder
+        self.tokens: List[str] = []
+        self.procedures_etag: Optional[str] = None
+
+    async def call(self, route: str, method: str, path: str, token: Optional[str] = None, **kwargs) -> Any:
+        headers = kwargs.pop("headers", {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        start = time.perf_counter()
+        status = 0
+        body = None
+        try:
+            async with self.session.request(method, f"{self.api_url}{path}", headers=headers, **kwargs) as response:
+                status = response.status
+                raw = await response.read()
+                if status == 200 and raw and response.content_type == "application/json":
+                    body = json.loads(raw)
+                if route == "procedures" and status == 200:
+                    self.procedures_etag = response.headers.get("ETag")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            status = 0
+        self.recorder.record(route, time.perf_counter() - start, status)
+        return body
+
+    async def login(self, user_key: str, route: str = "login") -> Optional[str]:
+        body = await self.call(
+            route, "POST", "/auth/session-data",
+            json={"session_id": f"{user_key}:{uuid.uuid4().hex}"}
+        )
+        return body["session_token"] if body else None
+
+    async def seed(self, users: int, contacts_per_user: int):
+        """Create the user pool the authenticated operations run as"""
+        for i in range(users):
+            token = await self.login(f"user{i}", route="seed")
+            if not token:
+                raise RuntimeError("Seeding failed: could not log in")
+            self.tokens.append(token)
+            for c in range(contacts_per_user):
+                await self.call("seed", "POST", "/emergency-contacts", token, json={
+                    "name": f"Contact {c}",
+                    "phone": f"+5255{10000000 + i * 10 + c}",
+                    "relationship": "family",
+                    "priority": c + 1,
+                })
+
+    async def run_op(self, op: str):
+        token = random.choice(self.tokens)
+        if op == "login":
+            await self.login(f"login{random.randrange(1000)}")
+        elif op == "profile":
+            await self.call(op, "GET", "/profile", token)
+        elif op == "procedures":
+            await self.call(op, "GET", "/medical-procedures", headers={"Accept-Encoding": "gzip"})
+        elif op == "procedures_304":
+            headers = {"Accept-Encoding": "gzip"}
+            if self.procedures_etag:
+                headers["If-None-Match"] = self.procedures_etag
+            await self.call(op, "GET", "/medical-procedures", headers=headers)
+        elif op == "procedure":
+            await self.call(op, "GET", "/medical-procedures/cpr-adult")
+        elif op == "sos":
+            lat, lon = random.choice(HOTSPOTS)
+            await self.call(op, "POST", "/emergency/sos", token, json={
+                "emergency_type": "medical",
+                "location": {"latitude": lat + random.uniform(-0.01, 0.01), "longitude": lon, "accuracy": 10},
+                "custom_message": "Benchmark SOS",
+            })
+        elif op == "alerts":
+            await self.call(op, "GET", "/emergency/alerts", token, params={"limit": "20"})
+        elif op == "contacts":
+            await self.call(op, "GET", "/emergency-contacts", token)
+        elif op == "reverse_geocode":
+            lat, lon = random.choice(HOTSPOTS)
+            await self.call(op, "POST", "/location/reverse-geocode", token, json={
+                "latitude": lat + random.uniform(-0.002, 0.002),
+                "longitude": lon + random.uniform(-0.002, 0.002),
+            })
+        else:
+            raise ValueError(f"Unknown operation {op}")
+
+    async def run_mix(self, mix: Dict[str, int], concurrency: int, duration: float) -> float:
+        ops, weights = zip(*mix.items())
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                await self.run_op(random.choices(ops, weights)[0])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+
+def start_mongod(data_dir: str) -> Tuple[subprocess.Popen, str]:
+    mongod = shutil.which("mongod")
+    if not mongod:
+        raise SystemExit("mongod not found on PATH; install MongoDB or pass --mongo-url")
+    port = free_port()
+    process = subprocess.Popen(
+        [mongod, "--dbpath", data_dir, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    wait_for_port(port, timeout=30)
+    return process, f"mongodb://127.0.0.1:{port}"
+
+
+def wait_for_port(port: int, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"Nothing listening on port {port} after {timeout}s")
+
+
+async def wait_for_health(session: aiohttp.ClientSession, base_url: str, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            async with session.get(f"{base_url}/api/health") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.5)
+    raise SystemExit("Server did not become healthy")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize(recorder: Recorder, elapsed: float) -> Dict[str, Any]:
+    routes = {}
+    total = 0
+    for route, values in sorted(recorder.latencies.items()):
+        if route == "seed":
+            continue
+        values = sorted(values)
+        statuses = recorder.statuses[route]
+        ok = sum(n for status, n in statuses.items() if 200 <= status < 400)
+        total += len(values)
+        routes[route] = {
+            "requests": len(values),
+            "throughput_rps": round(len(values) / elapsed, 2),
+            "errors": len(values) - ok,
+            "statuses": {str(k): v for k, v in statuses.items()},
+            "mean_ms": round(sum(values) / len(values), 2),
+            "p50_ms": round(percentile(values, 50), 2),
+            "p95_ms": round(percentile(values, 95), 2),
+            "p99_ms": round(percentile(values, 99), 2),
+            "max_ms": round(values[-1], 2),
+        }
+    return {"routes": routes, "total_requests": total, "throughput_rps": round(total / elapsed, 2)}
+
+
+def print_report(summary: Dict[str, Any], previous: Optional[Dict[str, Any]] = None):
+    print(f"\n{'route':<18}{'reqs':>8}{'rps':>9}{'err':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}", end="")
+    print(f"{'Δp50':>9}{'Δp99':>9}" if previous else "")
+    for route, stats in summary["routes"].items():
+        print(
+            f"{route:<18}{stats['requests']:>8}{stats['throughput_rps']:>9.1f}{stats['errors']:>6}"
+            f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}",
+            end=""
+        )
+        before = (previous or {}).get("routes", {}).get(route)
+        if before:
+            for key in ("p50_ms", "p99_ms"):
+                change = (stats[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+                print(f"{change:>+8.0f}%", end="")
+        print()
+    print(f"\nTotal: {summary['total_requests']} requests, {summary['throughput_rps']} req/s")
+
+
+async def run(args) -> Dict[str, Any]:
+    stubs = StubServices(
+        sns_latency=args.sns_latency,
+        nominatim_latency=args.nominatim_latency,
+        auth_latency=args.auth_latency
+    )
+    await stubs.start()
+
+    mongo_process = None
+    data_dir = None
+    mongo_url = args.mongo_url
+    if not mongo_url:
+        data_dir = tempfile.mkdtemp(prefix="aidly-bench-mongo-")
+        mongo_process, mongo_url = start_mongod(data_dir)
+
+    port = free_port()
+    db_name = f"aidly_bench_{int(time.time())}"
+    image_dir = tempfile.mkdtemp(prefix="aidly-bench-images-")
+    env = {
+        **os.environ,
+        "MONGO_URL": mongo_url,
+        "DB_NAME": db_name,
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_REGION": "us-east-1",
+        "SNS_ENDPOINT_URL": f"{stubs.base_url}/sns/",
+        "AUTH_SESSION_DATA_URL": f"{stubs.base_url}/auth/session-data",
+        "NOMINATIM_DOMAIN": f"127.0.0.1:{stubs.port}/nominatim",
+        "NOMINATIM_SCHEME": "http",
+        "NOMINATIM_MIN_INTERVAL": str(args.nominatim_min_interval),
+        "IMAGE_STORE_DIR": image_dir,
+    }
+    server = subprocess.Popen(
+        [sys.executable, str(BENCH_DIR / "stub_server.py"), "--port", str(port),
+         "--image-latency", str(args.image_latency)],
+        env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        connector = aiohttp.TCPConnector(limit=args.concurrency * 2)
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await wait_for_health(session, base_url)
+            recorder = Recorder()
+            driver = AidlyLoadDriver(base_url, session, recorder)
+            await driver.seed(args.users, args.contacts)
+            print(f"Seeded {args.users} users; running '{args.mix}' mix for {args.duration}s "
+                  f"at concurrency {args.concurrency}")
+            elapsed = await driver.run_mix(MIXES[args.mix], args.concurrency, args.duration)
+            summary = summarize(recorder, elapsed)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        await stubs.stop()
+        if mongo_process:
+            mongo_process.terminate()
+            mongo_process.wait(timeout=30)
+            shutil.rmtree(data_dir, ignore_errors=True)
+        elif not args.keep_db:
+            from pymongo import MongoClient
+            MongoClient(mongo_url).drop_database(db_name)
+        shutil.rmtree(image_dir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "mix": args.mix,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "users": args.users,
+            "stub_latency_s": {
+                "sns": args.sns_latency,
+                "nominatim": args.nominatim_latency,
+                "auth": args.auth_latency,
+                "image": args.image_latency,
+            },
+        },
+        **summary,
+        "external_calls": dict(stubs.calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mix", choices=sorted(MIXES), default="default")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--contacts", type=int, default=3, help="emergency contacts per seeded user")
+    parser.add_argument("--mongo-url", help="use this MongoDB instead of starting a throwaway mongod")
+    parser.add_argument("--keep-db", action="store_true", help="don't drop the bench database on --mongo-url")
+    parser.add_argument("--sns-latency", type=float, default=0.05)
+    parser.add_argument("--nominatim-latency", type=float, default=0.2)
+    parser.add_argument("--nominatim-min-interval", type=float, default=0.0)
+    parser.add_argument("--auth-latency", type=float, default=0.1)
+    parser.add_argument("--image-latency", type=float, default=2.0)
+    parser.add_argument("--compare", type=Path, help="previous results JSON to diff against")
+    parser.add_argument("--output", type=Path, help="results file (default: benchmarks/results/...)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    previous = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(results, previous)
+
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = RESULTS_DIR / f"{stamp}-{results['meta']['commit']}-{args.mix}.json"
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
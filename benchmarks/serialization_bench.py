@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Serialization microbenchmark for the hot API responses.
+
+Compares, per response, the CPU spent by FastAPI's default path (model
+validation + jsonable_encoder + json.dumps) against the fast path used when
+FAST_RESPONSES is enabled. No server or database is needed.
+
+    python benchmarks/serialization_bench.py [--iterations 5000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "aidly_bench")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+import server  # noqa: E402
+from fast_json import fast_response  # noqa: E402
+
+
+def sample_user() -> server.User:
+    return server.User(
+        email="bench@example.com",
+        name="Bench User",
+        phone="+525512345678",
+        emergency_contacts=[
+            server.EmergencyContact(name=f"Contact {i}", phone=f"+52551234567{i}", relationship="family").dict()
+            for i in range(5)
+        ]
+    )
+
+
+def sample_alerts(count: int = 50) -> List[Dict]:
+    return [
+        server.EmergencyAlert(
+            user_id="bench-user",
+            emergency_type="medical",
+            location=server.LocationData(latitude=19.43 + i / 1000, longitude=-99.13, accuracy=10.0),
+            message="Emergencia médica - necesito ayuda inmediata",
+            contacts_notified=[str(uuid.uuid4()) for _ in range(3)]
+        ).dict()
+        for i in range(count)
+    ]
+
+
+def bench(fn: Callable[[], object], iterations: int) -> float:
+    """Microseconds per call"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    user = sample_user()
+    alerts = sample_alerts()
+    catalog = server.create_procedure_store().catalog
+    procedures = [dict(p) for p in json.loads(catalog.list_body().identity)]
+    user_adapter = TypeAdapter(server.User)
+
+    cases = {
+        "profile": (
+            # response_model=User: validate, dump in JSON mode, json.dumps
+            lambda: JSONResponse(user_adapter.dump_python(user_adapter.validate_python(user), mode="json")),
+            lambda: fast_response(user.model_dump()),
+        ),
+        "alerts": (
+            # previous handler: EmergencyAlert(**alert) per row, then jsonable_encoder
+            lambda: JSONResponse(jsonable_encoder([server.EmergencyAlert(**a) for a in alerts])),
+            lambda: fast_response(alerts),
+        ),
+        "procedures": (
+            # previous handler: the list rebuilt and encoded on every request
+            lambda: JSONResponse(jsonable_encoder([dict(p) for p in procedures])),
+            lambda: catalog.respond(catalog.list_body(), {"accept-encoding": "gzip"}),
+        ),
+    }
+
+    print(f"{'route':<12}{'default µs':>12}{'fast µs':>12}{'saved µs':>12}{'speedup':>10}")
+    for name, (default_path, fast_path) in cases.items():
+        default_us = bench(default_path, args.iterations)
+        fast_us = bench(fast_path, args.iterations)
+        print(
+            f"{name:<12}{default_us:>12.1f}{fast_us:>12.1f}"
+            f"{default_us - fast_us:>12.1f}{default_us / fast_us:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
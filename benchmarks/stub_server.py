@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Runs backend/server.py under uvicorn with the image generator replaced by
+StubImageGenerator. Every other external service is redirected through
+environment variables (SNS_ENDPOINT_URL, NOMINATIM_DOMAIN, AUTH_SESSION_DATA_URL)
+set by load_bench.py.
+
+    python benchmarks/stub_server.py --port 8001 --image-latency 2.0
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent / "backend"))
+sys.path.insert(0, str(BENCH_DIR))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--image-latency", type=float, default=2.0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    import server
+    from stubs import StubImageGenerator
+
+    # The lifespan builds its image generator from this factory
+    server.create_image_generator = lambda: StubImageGenerator(latency=args.image_latency)
+    uvicorn.run(server.create_app, factory=True, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Local stand-ins for the external services the backend calls, each with a
+configurable response latency:
+
+* SNS       - answers Publish in both the query (XML) and JSON protocols
+* Nominatim - answers /reverse like nominatim.openstreetmap.org
+* Auth      - answers the Emergent Auth session-data call
+* Images    - an in-process replacement for OpenAIImageGeneration
+"""
+
+import asyncio
+import hashlib
+import socket
+import uuid
+from typing import Dict, List
+
+from aiohttp import web
+
+# PNG signature; enough for the image store to sniff the media type
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StubServices:
+    """Runs the HTTP stubs on one aiohttp app, each under its own prefix."""
+
+    def __init__(self, sns_latency: float = 0.05, nominatim_latency: float = 0.2, auth_latency: float = 0.1):
+        self.sns_latency = sns_latency
+        self.nominatim_latency = nominatim_latency
+        self.auth_latency = auth_latency
+        self.calls: Dict[str, int] = {"sns": 0, "nominatim": 0, "auth": 0}
+        self._runner = None
+        self.port = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def sns_publish(self, request: web.Request) -> web.Response:
+        self.calls["sns"] += 1
+        await asyncio.sleep(self.sns_latency)
+        message_id = str(uuid.uuid4())
+        if "json" in request.headers.get("Content-Type", ""):
+            return web.json_response({"MessageId": message_id}, content_type="application/x-amz-json-1.0")
+        body = (
+            '<PublishResponse xmlns="http://sns.amazonaws.com/doc/2010-03-31/">'
+            f"<PublishResult><MessageId>{message_id}</MessageId></PublishResult>"
+            f"<ResponseMetadata><RequestId>{uuid.uuid4()}</RequestId></ResponseMetadata>"
+            "</PublishResponse>"
+        )
+        return web.Response(text=body, content_type="text/xml")
+
+    async def nominatim_reverse(self, request: web.Request) -> web.Response:
+        self.calls["nominatim"] += 1
+        await asyncio.sleep(self.nominatim_latency)
+        lat, lon = request.query.get("lat", "0"), request.query.get("lon", "0")
+        return web.json_response({
+            "place_id": 1,
+            "lat": lat,
+            "lon": lon,
+            "display_name": f"Calle Simulada {lat}, {lon}, Ciudad de México, México",
+        })
+
+    async def auth_session_data(self, request: web.Request) -> web.Response:
+        self.calls["auth"] += 1
+        await asyncio.sleep(self.auth_latency)
+        session_id = request.headers.get("X-Session-ID", "")
+        if not session_id:
+            return web.json_response({"detail": "missing session"}, status=401)
+        # Session IDs look like "<user>:<nonce>" so one bench user can log in repeatedly
+        user_key = session_id.split(":", 1)[0]
+        return web.json_response({
+            "id": f"google-{user_key}",
+            "email": f"{user_key}@bench.aidly.local",
+            "name": f"Bench {user_key}",
+            "picture": None,
+        })
+
+    async def start(self, port: int = 0) -> None:
+        self.port = port or free_port()
+        app = web.Application()
+        app.router.add_post("/sns/", self.sns_publish)
+        app.router.add_get("/nominatim/reverse", self.nominatim_reverse)
+        app.router.add_get("/auth/session-data", self.auth_session_data)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+
+class StubImageGenerator:
+    """Drop-in for OpenAIImageGeneration.generate_images"""
+
+    def __init__(self, latency: float = 2.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def generate_images(self, prompt: str, model: str, number_of_images: int = 1) -> List[bytes]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        # Unique per prompt so the store sees distinct blobs
+        tag = hashlib.sha256(prompt.encode()).digest()
+        return [PNG_SIGNATURE + tag for _ in range(number_of_images)]
@@ -26,73 +26,10 @@ const API_CACHE_PATTERNS = [
   /\/api\/health/
 ];
 
-// Medical emergency data - critical offline content
-const EMERGENCY_PROCEDURES = {
-  'cpr-adult': {
-    id: 'cpr-adult',
-    name: 'RCP para Adultos',
-    description: 'Reanimación cardiopulmonar para adultos que han perdido el conocimiento',
-    category: 'cpr',
-    difficulty: 'intermedio',
-    duration_minutes: 5,
-    images: [
-      'https://images.unsplash.com/photo-1622115297822-a3798fdbe1f6?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDQ2NDF8MHwxfHNlYXJjaHwxfHxDUFJ8ZW58MHx8fHwxNzU5MDMwNjQ3fDA&ixlib=rb-4.1.0&q=85'
-    ],
-    steps: [
-      { step: 1, title: 'Verificar consciencia', description: 'Toca suavemente los hombros de la persona. Pregunta en voz alta si está bien. Observa si responde o se mueve', duration: 10 },
-      { step: 2, title: 'Pedir ayuda médica', description: 'Llama inmediatamente al servicio de emergencias. Si hay alguien cerca, pídele que llame mientras tú continúas', duration: 30 },
-      { step: 3, title: 'Posicionar las manos', description: 'Coloca el talón de una mano en el centro del pecho, entre los pezones. Pon la otra mano encima, entrelazando los dedos', duration: 15 },
-      { step: 4, title: 'Comprensiones torácicas', description: 'Presiona fuerte y rápido, hundiendo el pecho al menos 5 centímetros. Mantén un ritmo de 100 a 120 compresiones por minuto', duration: 120 },
-      { step: 5, title: 'Respiración de rescate', description: 'Inclina la cabeza hacia atrás, levanta la barbilla. Sella su boca con la tuya y da dos respiraciones lentas', duration: 10 },
-      { step: 6, title: 'Continuar ciclos', description: 'Alterna 30 compresiones con 2 respiraciones. No te detengas hasta que llegue ayuda médica profesional', duration: 0 }
-    ]
-  },
-  'choking-adult': {
-    id: 'choking-adult',
-    name: 'Atragantamiento en Adultos',
-    description: 'Maniobra de Heimlich para adultos conscientes que se están atragantando',
-    category: 'choking',
-    difficulty: 'básico',
-    duration_minutes: 2,
-    steps: [
-      { step: 1, title: 'Reconocer el atragantamiento', description: 'Pregunta si se está atragantando. Busca señales como no poder hablar, toser débilmente o dificultad para respirar', duration: 5 },
-      { step: 2, title: 'Colocarse detrás', description: 'Párate detrás de la persona. Rodea su cintura con tus brazos manteniendo la calma', duration: 5 },
-      { step: 3, title: 'Formar el puño', description: 'Haz un puño con una mano. Coloca el lado del pulgar contra el abdomen, justo arriba del ombligo', duration: 5 },
-      { step: 4, title: 'Empujes abdominales', description: 'Agarra el puño con la otra mano. Realiza empujes rápidos y firmes hacia arriba y hacia adentro', duration: 30 },
-      { step: 5, title: 'Continuar hasta desalojar', description: 'Repite los empujes hasta que el objeto salga o la persona pierda el conocimiento. Mantén la calma', duration: 0 }
-    ]
-  },
-  'burns-minor': {
-    id: 'burns-minor',
-    name: 'Quemaduras Menores',
-    description: 'Tratamiento para quemaduras leves y escaldaduras que no son graves',
-    category: 'burns',
-    difficulty: 'básico',
-    duration_minutes: 10,
-    steps: [
-      { step: 1, title: 'Alejar del calor', description: 'Retira inmediatamente a la persona de la fuente de calor. Asegúrate de que esté en un lugar seguro', duration: 5 },
-      { step: 2, title: 'Enfriar la quemadura', description: 'Aplica agua fresca, no fría, sobre la quemadura durante 10 a 20 minutos. Esto aliviará el dolor', duration: 600 },
-      { step: 3, title: 'Retirar objetos', description: 'Quita cuidadosamente joyas y ropa suelta del área quemada antes de que se inflame', duration: 30 },
-      { step: 4, title: 'Proteger la herida', description: 'Cubre con una gasa estéril limpia. Nunca uses hielo, mantequilla o remedios caseros', duration: 60 },
-      { step: 5, title: 'Aliviar el dolor', description: 'Si es necesario, puedes dar medicamentos para el dolor que se vendan sin receta médica', duration: 5 }
-    ]
-  },
-  'wounds-bleeding': {
-    id: 'wounds-bleeding',
-    name: 'Hemorragia Severa',
-    description: 'Control de sangrado abundante en heridas que no se detienen',
-    category: 'wounds',
-    difficulty: 'intermedio',
-    duration_minutes: 5,
-    steps: [
-      { step: 1, title: 'Protégete', description: 'Usa guantes si tienes, o coloca una barrera limpia entre tus manos y la sangre para evitar infecciones', duration: 10 },
-      { step: 2, title: 'Presión directa', description: 'Aplica presión firme y constante sobre la herida con un paño limpio o gasa. No retires el paño', duration: 30 },
-      { step: 3, title: 'Elevar si es posible', description: 'Si es seguro hacerlo, eleva la parte herida por encima del nivel del corazón para reducir el sangrado', duration: 5 },
-      { step: 4, title: 'Mantener presión', description: 'Continúa aplicando presión constante. Si la sangre empapa el vendaje, añade más encima sin quitar el anterior', duration: 180 },
-      { step: 5, title: 'Buscar ayuda médica', description: 'Llama inmediatamente a los servicios de emergencia. El sangrado severo requiere atención profesional urgente', duration: 30 }
-    ]
-  }
-};
+// Procedures are synced from the backend content store into this cache.
+// Only procedures whose content hash changed are downloaded.
+const PROCEDURES_CACHE = 'aidly-procedures';
+const PROCEDURES_STORE_KEY = '/procedures-store';
 
 // Emergency contact numbers for Latin America
 const EMERGENCY_NUMBERS = {
@@ -130,8 +67,11 @@ self.addEventListener('install', event => {
       })
       .then(() => {
         console.log('[SW] Core resources cached successfully');
-        return self.skipWaiting();
+        return syncProcedures(self.location.origin).catch(error => {
+          console.error('[SW] Initial procedure sync failed:', error);
+        });
       })
+      .then(() => self.skipWaiting())
       .catch(error => {
         console.error('[SW] Failed to cache core resources:', error);
       })
@@ -148,7 +88,7 @@ self.addEventListener('activate', event => {
         return Promise.all(
           cacheNames
             .filter(cacheName => {
-              return cacheName.startsWith('aidly-') && cacheName !== CACHE_NAME && cacheName !== RUNTIME_CACHE;
+              return cacheName.startsWith('aidly-') && cacheName !== CACHE_NAME && cacheName !== RUNTIME_CACHE && cacheName !== PROCEDURES_CACHE;
             })
             .map(cacheName => {
               console.log('[SW] Deleting old cache:', cacheName);
@@ -188,22 +128,20 @@ self.addEventListener('fetch', event => {
 async function handleApiRequest(request) {
   const url = new URL(request.url);
   
-  // Special handling for medical procedures - provide offline fallback
+  // Medical procedures are served from the synced local store
   if (url.pathname === '/api/medical-procedures') {
+    let store;
     try {
-      const networkResponse = await fetch(request);
-      if (networkResponse.ok) {
-        // Cache the fresh response
-        const cache = await caches.open(RUNTIME_CACHE);
-        cache.put(request, networkResponse.clone());
-        return networkResponse;
-      }
+      store = await syncProcedures(url.origin);
     } catch (error) {
-      console.log('[SW] Network failed for medical procedures, serving offline data');
+      console.log('[SW] Procedure sync failed, serving offline data');
+      store = await loadProcedureStore();
     }
     
-    // Return offline procedures if network fails
-    const procedures = Object.values(EMERGENCY_PROCEDURES);
+    const category = url.searchParams.get('category');
+    const procedures = Object.values(store.procedures)
+      .filter(procedure => !category || procedure.category === category)
+      .sort((a, b) => (a.order || 0) - (b.order || 0));
     return new Response(JSON.stringify(procedures), {
       status: 200,
       headers: { 'Content-Type': 'application/json' }
@@ -236,6 +174,61 @@ async function handleApiRequest(request) {
   }
 }
 
+// Read the local procedure store
+async function loadProcedureStore() {
+  const cache = await caches.open(PROCEDURES_CACHE);
+  const response = await cache.match(PROCEDURES_STORE_KEY);
+  const store = response ? await response.json() : {};
+  return { revision: store.revision || null, hashes: store.hashes || {}, procedures: store.procedures || {} };
+}
+
+// Bring the local procedure store up to date: compare the manifest's content
+// hashes with ours and download only the procedures that are missing or differ
+async function syncProcedures(origin) {
+  const store = await loadProcedureStore();
+  const manifest = await fetchProcedureJson(`${origin}/api/medical-procedures/manifest`);
+  if (manifest.revision === store.revision) {
+    return store;
+  }
+  
+  const changed = Object.keys(manifest.procedures)
+    .filter(id => !store.procedures[id] || store.hashes[id] !== manifest.procedures[id].hash);
+  const delta = changed.length
+    ? await fetchProcedureJson(`${origin}/api/medical-procedures/delta?ids=${changed.map(encodeURIComponent).join(',')}`)
+    : { revision: manifest.revision, procedures: [], hashes: {}, ids: Object.keys(manifest.procedures) };
+  
+  const procedures = {};
+  const hashes = {};
+  delta.ids.forEach(id => {
+    if (store.procedures[id]) {
+      procedures[id] = store.procedures[id];
+      hashes[id] = store.hashes[id];
+    }
+  });
+  delta.procedures.forEach(procedure => {
+    procedures[procedure.id] = procedure;
+    hashes[procedure.id] = delta.hashes[procedure.id];
+  });
+  
+  // Content changed between the two requests: leave the revision unset so
+  // the next sync diffs every hash again
+  const revision = delta.revision === manifest.revision ? manifest.revision : null;
+  const updated = { revision, hashes, procedures };
+  const cache = await caches.open(PROCEDURES_CACHE);
+  await cache.put(PROCEDURES_STORE_KEY, new Response(JSON.stringify(updated), {
+    headers: { 'Content-Type': 'application/json' }
+  }));
+  return updated;
+}
+
+async function fetchProcedureJson(url) {
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error(`Procedure sync failed: ${response.status}`);
+  }
+  return response.json();
+}
+
 // Handle navigation requests (page loads)
 async function handleNavigationRequest(request) {
   try {
@@ -447,28 +440,50 @@ self.addEventListener('sync', event => {
   }
 });
 
-// Sync emergency data when connection is restored
+// Sync emergency data when connection is restored; each account's queue is
+// replayed in one batch request, keyed so replays apply once
 async function syncEmergencyData() {
   try {
     // Get pending emergency alerts from IndexedDB or localStorage
     const pendingAlerts = await getPendingEmergencyAlerts();
-    
+    const alertsByToken = new Map();
     for (const alert of pendingAlerts) {
+      if (!alertsByToken.has(alert.token)) {
+        alertsByToken.set(alert.token, []);
+      }
+      alertsByToken.get(alert.token).push(alert);
+    }
+    
+    for (const [token, alerts] of alertsByToken) {
       try {
-        await fetch('/api/emergency/sos', {
+        const response = await fetch('/api/sync/batch', {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
-            'Authorization': `Bearer ${alert.token}`
+            'Authorization': `Bearer ${token}`
           },
-          body: JSON.stringify(alert.data)
+          body: JSON.stringify({
+            actions: alerts.map(alert => ({
+              type: 'sos',
+              data: alert.data,
+              idempotency_key: alert.id
+            }))
+          })
         });
+        if (!response.ok) {
+          throw new Error(`Batch sync failed: ${response.status}`);
+        }
         
         // Remove from pending list after successful sync
-        await removePendingAlert(alert.id);
-        console.log('[SW] Emergency alert synced successfully');
+        const { results } = await response.json();
+        for (const result of results) {
+          if (result.status === 'ok' || result.status === 'replayed') {
+            await removePendingAlert(alerts[result.index].id);
+          }
+        }
+        console.log('[SW] Emergency alerts synced successfully');
       } catch (error) {
-        console.error('[SW] Failed to sync emergency alert:', error);
+        console.error('[SW] Failed to sync emergency alerts:', error);
       }
     }
   } catch (error) {
@@ -593,9 +608,10 @@ async function generateOfflineAudioCache() {
   console.log('[SW] Generating offline audio cache for emergency procedures');
   
   const audioTexts = [];
+  const store = await loadProcedureStore();
   
   // Generate audio texts for all procedures
-  Object.values(EMERGENCY_PROCEDURES).forEach(procedure => {
+  Object.values(store.procedures).forEach(procedure => {
     procedure.steps.forEach((step, index) => {
       const stepNumber = index + 1;
       const totalSteps = procedure.steps.length;
@@ -1033,6 +1033,8 @@ const Dashboard = ({ user, onLogout }) => {
 
   const handleSOS = async () => {
     setIsLoadingSOS(true);
+    // One key per SOS press; a retried request won't alert contacts twice
+    const sosHeaders = { 'Idempotency-Key': crypto.randomUUID() };
     try {
       // Get fresh location
       if ('geolocation' in navigator) {
@@ -1047,9 +1049,9 @@ const Dashboard = ({ user, onLogout }) => {
             emergency_type: 'medical',
             location: currentLocation,
             custom_message: 'Emergencia médica - necesito ayuda inmediata'
-          });
+          }, { headers: sosHeaders });
 
-          toast.success(`SOS enviado. ${response.data.contacts_notified} contactos notificados.`);
+          toast.success(`SOS enviado. Notificando a ${response.data.contacts_queued} contactos.`);
           
           // Try to call emergency services
           if (response.data.emergency_number) {
@@ -1066,8 +1068,8 @@ const Dashboard = ({ user, onLogout }) => {
         const response = await axios.post(`${API}/emergency/sos`, {
           emergency_type: 'medical',
           custom_message: 'Emergencia médica - necesito ayuda inmediata'
-        });
-        toast.success(`SOS enviado. ${response.data.contacts_notified} contactos notificados.`);
+        }, { headers: sosHeaders });
+        toast.success(`SOS enviado. Notificando a ${response.data.contacts_queued} contactos.`);
       }
     } catch (error) {
       console.error('SOS error:', error);
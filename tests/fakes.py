@@ -0,0 +1,395 @@
+"""In-memory stand-ins for Motor collections, for the backend's stateful code.
+
+Only the operators the backend uses are implemented, with MongoDB's
+semantics where the tests depend on them: unique ``_id`` (plus any
+``unique`` fields), atomic find-and-modify, ordered/unordered bulk writes
+that report ``writeErrors`` by operation index, and upserts seeded from the
+filter's equality fields. ``fail(method, error)`` makes the next call of a
+method raise, to exercise storage failures.
+"""
+import copy
+import itertools
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get(doc: Dict[str, Any], path: str) -> Any:
+    value: Any = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+
+def _set(doc: Dict[str, Any], path: str, value: Any) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def _unset(doc: Dict[str, Any], path: str) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part, {})
+    doc.pop(last, None)
+
+
+def _is_operator_doc(condition: Any) -> bool:
+    return isinstance(condition, dict) and bool(condition) and all(k.startswith("$") for k in condition)
+
+
+def _compare(value: Any, operator: str, operand: Any) -> bool:
+    if value is _MISSING or value is None or operand is None:
+        return False
+    try:
+        return {
+            "$lt": value < operand, "$lte": value <= operand,
+            "$gt": value > operand, "$gte": value >= operand,
+        }[operator]
+    except TypeError:
+        return False
+
+
+def _equals(value: Any, operand: Any) -> bool:
+    if operand is None:
+        return value is _MISSING or value is None
+    if isinstance(value, list) and not isinstance(operand, list):
+        return operand in value
+    return value == operand
+
+
+def _condition(value: Any, condition: Any) -> bool:
+    if not _is_operator_doc(condition):
+        return _equals(value, condition)
+    for operator, operand in condition.items():
+        if operator in ("$lt", "$lte", "$gt", "$gte"):
+            candidates = value if isinstance(value, list) else [value]
+            if not any(_compare(v, operator, operand) for v in candidates):
+                return False
+        elif operator == "$in":
+            if not any(_equals(value, option) for option in operand):
+                return False
+        elif operator == "$nin":
+            if any(_equals(value, option) for option in operand):
+                return False
+        elif operator == "$ne":
+            if _equals(value, operand):
+                return False
+        elif operator == "$exists":
+            if (value is not _MISSING) != bool(operand):
+                return False
+        elif operator == "$not":
+            if _condition(value, operand):
+                return False
+        else:
+            raise NotImplementedError(f"query operator {operator}")
+    return True
+
+
+def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, branch) for branch in condition):
+                return False
+        elif not _condition(_get(doc, key), condition):
+            return False
+    return True
+
+
+def _apply_update(doc: Dict[str, Any], update: Dict[str, Any], inserting: bool) -> None:
+    for operator, fields in update.items():
+        for path, operand in fields.items():
+            current = _get(doc, path)
+            if operator == "$set":
+                _set(doc, path, copy.deepcopy(operand))
+            elif operator == "$setOnInsert":
+                if inserting:
+                    _set(doc, path, copy.deepcopy(operand))
+            elif operator == "$unset":
+                _unset(doc, path)
+            elif operator == "$inc":
+                _set(doc, path, (0 if current is _MISSING else current) + operand)
+            elif operator == "$min":
+                if current is _MISSING or operand < current:
+                    _set(doc, path, operand)
+            elif operator == "$max":
+                if current is _MISSING or operand > current:
+                    _set(doc, path, operand)
+            elif operator in ("$push", "$addToSet"):
+                items = operand["$each"] if isinstance(operand, dict) and "$each" in operand else [operand]
+                target = [] if current is _MISSING else current
+                for item in items:
+                    if operator == "$push" or item not in target:
+                        target.append(copy.deepcopy(item))
+                _set(doc, path, target)
+            elif operator == "$pull":
+                if current is not _MISSING:
+                    _set(doc, path, [
+                        item for item in current
+                        if not (matches(item, operand) if isinstance(operand, dict) else item == operand)
+                    ])
+            else:
+                raise NotImplementedError(f"update operator {operator}")
+
+
+def _project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    included = {k for k, v in projection.items() if v and k != "_id"}
+    if included:
+        projected = {k: doc[k] for k in included if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            projected["_id"] = doc["_id"]
+        return projected
+    for key, keep in projection.items():
+        if not keep:
+            doc.pop(key, None)
+    return doc
+
+
+def _sort_key(sort: List[Tuple[str, int]]):
+    def key(doc):
+        parts = []
+        for field, direction in sort:
+            value = _get(doc, field)
+            missing = value is _MISSING or value is None
+            parts.append(_Ordered((missing, None if missing else value), direction))
+        return parts
+    return key
+
+
+class _Ordered:
+    __slots__ = ("value", "direction")
+
+    def __init__(self, value, direction):
+        self.value, self.direction = value, direction
+
+    def __lt__(self, other):
+        return self.value < other.value if self.direction > 0 else other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class FakeCursor:
+    def __init__(self, docs: List[Dict[str, Any]], projection: Optional[Dict[str, Any]]):
+        self._docs = docs
+        self._projection = projection
+        self._limit = 0
+
+    def sort(self, key, direction=None):
+        spec = [(key, direction or 1)] if isinstance(key, str) else list(key)
+        self._docs.sort(key=_sort_key(spec))
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def _results(self) -> List[Dict[str, Any]]:
+        docs = self._docs[:self._limit] if self._limit else self._docs
+        return [_project(doc, self._projection) for doc in docs]
+
+    async def to_list(self, length=None):
+        results = self._results()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        self._iter = iter(self._results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self, name: str = "fake", unique: Iterable[str] = ()):
+        self.name = name
+        self.docs: List[Dict[str, Any]] = []
+        self.unique = ("_id",) + tuple(unique)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._failures: Dict[str, List[BaseException]] = defaultdict(list)
+        self._ids = itertools.count(1)
+
+    def fail(self, method: str, error: BaseException, times: int = 1) -> None:
+        """Make the next ``times`` calls of ``method`` raise ``error``"""
+        self._failures[method].extend([error] * times)
+
+    def _enter(self, method: str) -> None:
+        self.calls[method] += 1
+        if self._failures[method]:
+            raise self._failures[method].pop(0)
+
+    def _check_unique(self, doc: Dict[str, Any], ignore: Optional[Dict[str, Any]] = None) -> None:
+        for field in self.unique:
+            value = _get(doc, field)
+            if value is _MISSING:
+                continue
+            for other in self.docs:
+                if other is not ignore and _get(other, field) == value:
+                    raise DuplicateKeyError(f"E11000 duplicate key {field}: {value!r}", 11000)
+
+    def _insert(self, doc: Dict[str, Any]) -> None:
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", next(self._ids))
+        self._check_unique(doc)
+        self.docs.append(doc)
+
+    def _first(self, query: Dict[str, Any], sort=None) -> Optional[Dict[str, Any]]:
+        found = [doc for doc in self.docs if matches(doc, query)]
+        if sort:
+            found.sort(key=_sort_key(list(sort)))
+        return found[0] if found else None
+
+    def _update(self, query, update, upsert: bool, many: bool) -> SimpleNamespace:
+        targets = [doc for doc in self.docs if matches(doc, query)]
+        if not many:
+            targets = targets[:1]
+        if not targets:
+            if not upsert:
+                return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+            doc = {k: copy.deepcopy(v) for k, v in query.items() if not k.startswith("$") and not _is_operator_doc(v)}
+            _apply_update(doc, update, inserting=True)
+            self._insert(doc)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=self.docs[-1]["_id"])
+        modified = 0
+        for doc in targets:
+            before = copy.deepcopy(doc)
+            _apply_update(doc, update, inserting=False)
+            try:
+                self._check_unique(doc, ignore=doc)
+            except DuplicateKeyError:
+                doc.clear()
+                doc.update(before)
+                raise
+            modified += doc != before
+        return SimpleNamespace(matched_count=len(targets), modified_count=modified, upserted_id=None)
+
+    async def insert_one(self, doc):
+        self._enter("insert_one")
+        self._insert(doc)
+        return SimpleNamespace(inserted_id=self.docs[-1]["_id"])
+
+    async def insert_many(self, docs, ordered=True, **kwargs):
+        self._enter("insert_many")
+        errors = []
+        for index, doc in enumerate(docs):
+            try:
+                self._insert(doc)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(docs) - len(errors)})
+        return SimpleNamespace(inserted_ids=[doc.get("_id") for doc in docs])
+
+    async def find_one(self, query=None, projection=None, **kwargs):
+        self._enter("find_one")
+        doc = self._first(query or {}, kwargs.get("sort"))
+        return _project(doc, projection) if doc else None
+
+    def find(self, query=None, projection=None, **kwargs):
+        self.calls["find"] += 1
+        return FakeCursor([doc for doc in self.docs if matches(doc, query or {})], projection)
+
+    async def count_documents(self, query, limit=0, **kwargs):
+        self._enter("count_documents")
+        count = sum(1 for doc in self.docs if matches(doc, query))
+        return min(count, limit) if limit else count
+
+    async def find_one_and_update(self, query, update, projection=None, sort=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, **kwargs):
+        self._enter("find_one_and_update")
+        doc = self._first(query, sort)
+        if doc is None:
+            if not upsert:
+                return None
+            self._update(query, update, upsert=True, many=False)
+            return _project(self.docs[-1], projection) if return_document == ReturnDocument.AFTER else None
+        before = _project(doc, projection)
+        self._update({"_id": doc["_id"]}, update, upsert=False, many=False)
+        return _project(doc, projection) if return_document == ReturnDocument.AFTER else before
+
+    async def find_one_and_delete(self, query, projection=None, **kwargs):
+        self._enter("find_one_and_delete")
+        doc = self._first(query, kwargs.get("sort"))
+        if doc is None:
+            return None
+        self.docs.remove(doc)
+        return _project(doc, projection)
+
+    async def update_one(self, query, update, upsert=False, **kwargs):
+        self._enter("update_one")
+        return self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query, update, upsert=False, **kwargs):
+        self._enter("update_many")
+        return self._update(query, update, upsert, many=True)
+
+    async def delete_one(self, query, **kwargs):
+        self._enter("delete_one")
+        doc = self._first(query)
+        if doc is not None:
+            self.docs.remove(doc)
+        return SimpleNamespace(deleted_count=int(doc is not None))
+
+    async def delete_many(self, query, **kwargs):
+        self._enter("delete_many")
+        doomed = [doc for doc in self.docs if matches(doc, query)]
+        for doc in doomed:
+            self.docs.remove(doc)
+        return SimpleNamespace(deleted_count=len(doomed))
+
+    async def bulk_write(self, operations, ordered=True, **kwargs):
+        self._enter("bulk_write")
+        errors = []
+        modified = upserted = 0
+        for index, operation in enumerate(operations):
+            many = type(operation).__name__ == "UpdateMany"
+            try:
+                result = self._update(operation._filter, operation._doc, bool(operation._upsert), many)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+                continue
+            modified += result.modified_count
+            upserted += result.upserted_id is not None
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nModified": modified, "nUpserted": upserted})
+        return SimpleNamespace(modified_count=modified, upserted_count=upserted)
+
+
+class FakeDatabase:
+    """``db.name`` and ``db["name"]`` return the same collection"""
+
+    def __init__(self, unique: Optional[Dict[str, Iterable[str]]] = None):
+        self._unique = unique or {}
+        self._collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name, self._unique.get(name, ()))
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
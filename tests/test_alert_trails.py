@@ -0,0 +1,83 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from pymongo.errors import BulkWriteError
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from alert_trails import TRAILS_COLLECTION, TrailWriter, trail_point  # noqa: E402
+
+from tests.fakes import FakeDatabase  # noqa: E402
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def points(start, count):
+    return [trail_point(19.0 + i * 1e-4, -99.0, timestamp=T0 + timedelta(seconds=i)) for i in range(start, start + count)]
+
+
+def add_all(writer, alert_id, new_points):
+    for point in new_points:
+        writer.add(alert_id, "u1", point)
+
+
+def test_buckets_never_outgrow_bucket_size():
+    async def scenario():
+        db = FakeDatabase()
+        writer = TrailWriter(db, bucket_size=3)
+        add_all(writer, "a1", points(0, 2))
+        await writer.flush()
+        add_all(writer, "a1", points(2, 5))
+        add_all(writer, "a2", points(0, 1))
+        await writer.flush()
+
+        buckets = db[TRAILS_COLLECTION].docs
+        assert all(bucket["count"] == len(bucket["points"]) <= 3 for bucket in buckets)
+        assert sum(bucket["count"] for bucket in buckets if bucket["alert_id"] == "a1") == 7
+        assert {bucket["user_id"] for bucket in buckets} == {"u1"}
+        trail = await writer.read("a1")
+        assert [point["t"] for point in trail] == [point["t"] for point in points(0, 7)]
+
+    asyncio.run(scenario())
+
+
+def test_partial_flush_failure_rebuffers_only_unwritten_chunks():
+    async def scenario():
+        db = FakeDatabase()
+        writer = TrailWriter(db, bucket_size=2)
+        add_all(writer, "a1", points(0, 5))
+        bulk_write = writer.collection.bulk_write
+
+        async def first_op_only(operations, ordered=True):
+            await bulk_write(operations[:1], ordered=ordered)
+            raise BulkWriteError({"writeErrors": [{"index": 1, "code": 2, "errmsg": "boom"}]})
+
+        writer.collection.bulk_write = first_op_only
+        await writer.flush()
+        assert [point["t"] for point in writer.pending("a1")] == [point["t"] for point in points(2, 3)]
+
+        writer.collection.bulk_write = bulk_write
+        await writer.flush()
+        assert writer.pending("a1") == []
+        trail = await writer.read("a1")
+        assert [point["t"] for point in trail] == [point["t"] for point in points(0, 5)]
+
+    asyncio.run(scenario())
+
+
+def test_reads_include_buffered_points():
+    async def scenario():
+        writer = TrailWriter(FakeDatabase(), bucket_size=10)
+        add_all(writer, "a1", points(0, 2))
+        await writer.flush()
+        add_all(writer, "a1", points(2, 1))
+        add_all(writer, "a2", points(0, 1))
+
+        trails = await writer.read_many(["a1", "a2", "a3"])
+        assert [len(trails[alert_id]) for alert_id in ("a1", "a2", "a3")] == [3, 1, 0]
+        assert trails["a1"] == await writer.read("a1")
+
+    asyncio.run(scenario())
@@ -0,0 +1,46 @@
+import asyncio
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from background import BackgroundLoop, retry_delay  # noqa: E402
+
+
+class Ticker(BackgroundLoop):
+    def __init__(self):
+        self.ticks = 0
+        self.runs = 0
+
+    async def _run(self):
+        self.runs += 1
+        while True:
+            self.ticks += 1
+            await asyncio.sleep(0.01)
+
+
+def test_start_runs_one_loop_and_stop_cancels_it():
+    async def scenario():
+        ticker = Ticker()
+        ticker.start()
+        ticker.start()
+        await asyncio.sleep(0.05)
+        await ticker.stop()
+        ticks = ticker.ticks
+        await asyncio.sleep(0.03)
+        assert ticker.runs == 1 and ticker.ticks == ticks > 0
+        # Stopping twice is harmless, and the loop can be started again
+        await ticker.stop()
+        ticker.start()
+        await asyncio.sleep(0)
+        await ticker.stop()
+        assert ticker.runs == 2
+
+    asyncio.run(scenario())
+
+
+def test_retry_delay_doubles_with_jitter_up_to_the_cap():
+    for attempts, full in ((1, 2.0), (2, 4.0), (4, 16.0), (20, 60.0)):
+        for _ in range(20):
+            assert full / 2 <= retry_delay(attempts, 2.0, 60.0) <= full
@@ -0,0 +1,67 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from country_index import CountryIndex, build, features_from_geojson  # noqa: E402
+from emergency_numbers import emergency_number  # noqa: E402
+
+CONTENT_DIR = BACKEND_DIR / "content"
+INDEX_PATH = CONTENT_DIR / "countries.idx"
+GEOJSON_PATH = CONTENT_DIR / "ne_110m_admin_0_countries.geojson"
+
+
+@pytest.fixture(scope="module")
+def index():
+    index = CountryIndex(str(INDEX_PATH))
+    yield index
+    index.close()
+
+
+@pytest.mark.parametrize("latitude, longitude, country", [
+    (19.43, -99.13, "MX"),    # Mexico City
+    (4.71, -74.07, "CO"),     # Bogotá
+    (-12.05, -77.04, "PE"),   # Lima
+    (-33.45, -70.67, "CL"),   # Santiago
+    (-34.60, -58.38, "AR"),   # Buenos Aires
+    (-23.55, -46.63, "BR"),   # São Paulo
+    (40.71, -74.00, "US"),    # New York
+    (40.42, -3.70, "ES"),     # Madrid
+    (48.86, 2.35, "FR"),      # Paris
+    (35.68, 139.69, "JP"),    # Tokyo
+    (-33.87, 151.21, "AU"),   # Sydney
+])
+def test_lookup_known_cities(index, latitude, longitude, country):
+    assert index.lookup(latitude, longitude) == country
+
+
+@pytest.mark.parametrize("latitude, longitude", [
+    (30.0, -40.0),    # North Atlantic
+    (0.0, -140.0),    # Pacific
+    (-40.0, 80.0),    # Indian Ocean
+])
+def test_lookup_open_sea(index, latitude, longitude):
+    assert index.lookup(latitude, longitude) is None
+
+
+def test_lookup_clamps_out_of_range_coordinates(index):
+    assert index.lookup(91.0, 181.0) is None
+    assert index.lookup(-91.0, -181.0) == "AQ"
+
+
+def test_known_cities_resolve_to_emergency_numbers(index):
+    assert emergency_number(index.lookup(19.43, -99.13)) == "911"
+    assert emergency_number(index.lookup(40.42, -3.70)) == "112"
+    assert emergency_number(index.lookup(-34.60, -58.38)) == "107"
+
+
+def test_bundled_index_matches_its_source():
+    with open(GEOJSON_PATH, encoding="utf-8") as f:
+        features = list(features_from_geojson(json.load(f)))
+    assert build(features) == INDEX_PATH.read_bytes(), (
+        "backend/content/countries.idx is stale; rebuild it with backend/country_index.py"
+    )
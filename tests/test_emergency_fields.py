@@ -0,0 +1,118 @@
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+for module in ("fastapi", "motor", "dotenv"):
+    pytest.importorskip(module)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import server  # noqa: E402
+from app_state import current_resources  # noqa: E402
+from country_index import CountryIndex  # noqa: E402
+from pymongo.errors import OperationFailure  # noqa: E402
+
+from tests.fakes import FakeDatabase  # noqa: E402
+
+MEXICO_CITY = {"latitude": 19.43, "longitude": -99.13}
+MADRID = {"latitude": 40.42, "longitude": -3.70}
+BUENOS_AIRES = {"latitude": -34.60, "longitude": -58.38}
+
+
+class Recorder:
+    """Accepts any call, sync or awaited, and remembers it"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(None)
+            return future
+        return call
+
+
+class StandaloneClient:
+    async def start_session(self):
+        raise OperationFailure("Transaction numbers are only allowed on a replica set member", 20)
+
+
+@pytest.fixture
+def resources():
+    index = CountryIndex(str(BACKEND_DIR / "content" / "countries.idx"))
+    resources = SimpleNamespace(
+        country_index=index,
+        db=FakeDatabase(),
+        client=StandaloneClient(),
+        sns=SimpleNamespace(aget=lambda: asyncio.sleep(0, None)),
+        geocode_cache=SimpleNamespace(peek=lambda latitude, longitude: None),
+        outbox_dispatcher=Recorder(),
+        nearby_alerts=Recorder(),
+        sessions=Recorder(),
+        session_cache=Recorder(),
+        session_invalidations=Recorder(),
+    )
+    token = current_resources.set(resources)
+    yield resources
+    current_resources.reset(token)
+    index.close()
+
+
+def make_user(**fields):
+    return server.User(email="ana@example.com", name="Ana", **fields)
+
+
+def test_profile_update_uses_the_last_location_before_the_phone(resources):
+    fields = server.profile_emergency_fields({"name": "Ana"}, "default", "+34600000000", {**MEXICO_CITY})
+    assert fields == {"country": "MX", "emergency_number": "911", "emergency_number_source": "location"}
+
+
+def test_profile_update_without_location_falls_back_to_the_phone_region(resources):
+    fields = server.profile_emergency_fields({"phone": "+34600000000"}, "default", None, None)
+    assert fields == {"country": "ES", "emergency_number": "112", "emergency_number_source": "phone"}
+
+
+def test_profile_update_keeps_an_explicit_number_until_the_phone_changes(resources):
+    assert server.profile_emergency_fields({"emergency_number": "065"}, "location", None, None) == {
+        "emergency_number_source": "user"
+    }
+    assert server.profile_emergency_fields({"name": "Ana"}, "user", "+34600000000", {**MEXICO_CITY}) == {}
+    fields = server.profile_emergency_fields({"phone": "+5491100000000"}, "user", "+34600000000", None)
+    assert fields["country"] == "AR" and fields["emergency_number_source"] == "phone"
+
+
+def test_sos_respects_an_explicit_number_in_the_same_country(resources):
+    user = make_user(country="AR", emergency_number="101", emergency_number_source="user")
+    request = server.SOSRequest(location=server.LocationData(**BUENOS_AIRES))
+    _, _, response, fields = asyncio.run(server.build_sos_alert(request, user, []))
+    assert response["emergency_number"] == "101"
+    assert set(fields) == {"last_location"}
+
+    request = server.SOSRequest(location=server.LocationData(**MADRID))
+    _, _, response, fields = asyncio.run(server.build_sos_alert(request, user, []))
+    assert response["emergency_number"] == "112"
+    assert fields["country"] == "ES" and fields["emergency_number_source"] == "location"
+
+
+def test_sos_saves_its_location_for_later_profile_updates(resources):
+    user = make_user(phone="+34600000000")
+    asyncio.run(resources.db.users.insert_one(user.dict()))
+    request = server.SOSRequest(location=server.LocationData(**MEXICO_CITY))
+
+    response = asyncio.run(server.create_sos_alert(request, user))
+    assert response["emergency_number"] == "911" and response["country"] == "MX"
+
+    stored = asyncio.run(resources.db.users.find_one({"id": user.id}))
+    assert stored["last_location"]["latitude"] == MEXICO_CITY["latitude"]
+    assert stored["country"] == "MX"
+    # The next profile update resolves from where the SOS happened, not the phone
+    fields = server.profile_emergency_fields(
+        {"name": "Ana"}, stored["emergency_number_source"], stored["phone"], stored["last_location"]
+    )
+    assert fields["country"] == "MX"
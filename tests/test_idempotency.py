@@ -0,0 +1,121 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from idempotency import (  # noqa: E402
+    IDEMPOTENCY_COLLECTION, IdempotencyKeyReused, IdempotencyStore, request_hash
+)
+
+from tests.fakes import FakeDatabase  # noqa: E402
+
+
+class Handler:
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {"alert_id": f"a{self.calls}"}
+
+
+def test_replay_returns_the_first_response_and_runs_the_handler_once():
+    async def scenario():
+        store = IdempotencyStore(FakeDatabase())
+        handler = Handler()
+        first = await store.run("u1", "sos", "k1", {"lat": 1}, handler)
+        second = await store.run("u1", "sos", "k1", {"lat": 1}, handler)
+        assert first == ({"alert_id": "a1"}, False)
+        assert second == ({"alert_id": "a1"}, True)
+        assert handler.calls == 1
+        assert store.replays == 1
+
+        with pytest.raises(IdempotencyKeyReused):
+            await store.run("u1", "sos", "k1", {"lat": 2}, handler)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_duplicate_waits_for_the_original():
+    async def scenario():
+        store = IdempotencyStore(FakeDatabase())
+        handler = Handler(delay=0.05)
+        results = await asyncio.gather(
+            store.run("u1", "sos", "k1", {}, handler),
+            store.run("u1", "sos", "k1", {}, handler),
+        )
+        assert sorted(replayed for _, replayed in results) == [False, True]
+        assert handler.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_failed_handler_releases_the_key_for_a_retry():
+    async def scenario():
+        db = FakeDatabase()
+        store = IdempotencyStore(db)
+        with pytest.raises(RuntimeError):
+            await store.run("u1", "sos", "k1", {}, Handler(error=RuntimeError("boom")))
+        assert db[IDEMPOTENCY_COLLECTION].docs == []
+        assert store._inflight == {}
+
+        handler = Handler()
+        assert await store.run("u1", "sos", "k1", {}, handler) == ({"alert_id": "a1"}, False)
+
+    asyncio.run(scenario())
+
+
+def test_storage_failure_on_complete_stops_renewing_the_key():
+    async def scenario():
+        db = FakeDatabase()
+        store = IdempotencyStore(db, lease_seconds=60)
+        keys = db[IDEMPOTENCY_COLLECTION]
+        keys.fail("bulk_write", AutoReconnect("primary stepped down"))
+        handler = Handler(delay=0.05)
+
+        original, waiter = await asyncio.gather(
+            store.run("u1", "sos", "k1", {}, handler),
+            store.run("u1", "sos", "k1", {}, handler),
+        )
+        # The handler ran, so both callers get its response
+        assert original == ({"alert_id": "a1"}, False)
+        assert waiter[0] == {"alert_id": "a1"}
+        assert store._inflight == {}
+        assert await store.renew() == 0
+
+        # Nothing was stored; once the lease runs out a replay executes again
+        [doc] = keys.docs
+        assert doc["status"] == "in_progress"
+        doc["heartbeat_at"] = datetime.now(timezone.utc) - timedelta(seconds=61)
+        assert await store.run("u1", "sos", "k1", {}, handler) == ({"alert_id": "a2"}, False)
+
+    asyncio.run(scenario())
+
+
+def test_claim_many_owns_new_keys_and_replays_stored_ones():
+    async def scenario():
+        store = IdempotencyStore(FakeDatabase())
+        await store.run("u1", "add_contact", "k1", {"n": 1}, Handler())
+        claims = {
+            store.key_id("u1", "add_contact", "k1"): request_hash({"n": 1}),
+            store.key_id("u1", "add_contact", "k2"): request_hash({"n": 2}),
+        }
+        claimed = await store.claim_many(claims)
+        assert claimed == {"u1:add_contact:k1": {"alert_id": "a1"}, "u1:add_contact:k2": None}
+        assert list(store._inflight) == ["u1:add_contact:k2"]
+
+        await store.release(["u1:add_contact:k2"])
+        assert store._inflight == {}
+
+    asyncio.run(scenario())
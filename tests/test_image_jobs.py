@@ -0,0 +1,95 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from image_jobs import JOBS_COLLECTION, QUOTAS_COLLECTION, ImageJobQueue, QuotaExceeded  # noqa: E402
+from image_store import ImageStore, image_key  # noqa: E402
+
+from tests.fakes import FakeDatabase  # noqa: E402
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 16
+
+
+def make_queue(tmp_path, generate=None, **kwargs):
+    async def default_generate(prompt):
+        return PNG
+
+    db = FakeDatabase({JOBS_COLLECTION: ["id"]})
+    return db, ImageJobQueue(db, ImageStore(tmp_path), generate or default_generate, **kwargs)
+
+
+def test_submit_is_refused_past_the_per_user_limit(tmp_path):
+    async def scenario():
+        db, queue = make_queue(tmp_path, per_user_limit=2)
+        await queue.submit("u1", image_key("cpr", "m"), "cpr")
+        await queue.submit("u1", image_key("burns", "m"), "burns")
+        with pytest.raises(QuotaExceeded):
+            await queue.submit("u1", image_key("choking", "m"), "choking")
+        # Other users have their own counter
+        await queue.submit("u2", image_key("choking", "m"), "choking")
+
+        quotas = {doc["_id"]: doc["active"] for doc in db[QUOTAS_COLLECTION].docs}
+        assert quotas == {"u1": 2, "u2": 1}
+
+    asyncio.run(scenario())
+
+
+def test_drifted_quota_is_recounted_when_it_refuses(tmp_path):
+    async def scenario():
+        db, queue = make_queue(tmp_path, per_user_limit=2)
+        first = await queue.submit("u1", image_key("cpr", "m"), "cpr")
+        await queue.submit("u1", image_key("burns", "m"), "burns")
+        # A worker finished the job but died before giving the slot back
+        job = next(doc for doc in db[JOBS_COLLECTION].docs if doc["id"] == first["id"])
+        job["status"] = "done"
+
+        await queue.submit("u1", image_key("choking", "m"), "choking")
+        assert db[QUOTAS_COLLECTION].docs[0]["active"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_finished_job_gives_its_slot_back(tmp_path):
+    async def scenario():
+        db, queue = make_queue(tmp_path, per_user_limit=1)
+        job = await queue.submit("u1", image_key("cpr", "m"), "cpr")
+        queue.start()
+        try:
+            finished = await queue.wait(job["id"], "u1", timeout=2)
+        finally:
+            await queue.stop()
+        assert finished["status"] == "done"
+        assert db[QUOTAS_COLLECTION].docs[0]["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_a_watcher_leaving_does_not_strand_the_others(tmp_path):
+    async def scenario():
+        release = asyncio.Event()
+
+        async def generate(prompt):
+            await release.wait()
+            return PNG
+
+        # Polling alone would not notice the job finishing within the test
+        _, queue = make_queue(tmp_path, generate, poll_interval=10)
+        job = await queue.submit("u1", image_key("cpr", "m"), "cpr")
+        queue.start()
+        try:
+            staying = asyncio.create_task(queue.wait(job["id"], "u1", timeout=2))
+            leaving = asyncio.create_task(queue.wait(job["id"], "u1", timeout=0.1))
+            await leaving
+            release.set()
+            finished = await staying
+        finally:
+            await queue.stop()
+        assert finished["status"] == "done"
+        assert queue._finished == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+BENCH_DIR = Path(__file__).resolve().parent.parent / "benchmarks"
+sys.path.insert(0, str(BENCH_DIR))
+
+from import_profile import by_package  # noqa: E402
+
+
+def test_by_package_counts_each_package_where_it_is_first_imported():
+    # As -X importtime prints them: children before their parent
+    rows = [
+        ("pymongo.errors", 100, 100, 2),
+        ("pymongo", 200, 300, 1),
+        ("motor.core", 50, 50, 2),
+        ("motor", 100, 450, 1),
+        ("json", 20, 20, 1),
+        ("server", 30, 500, 0),
+    ]
+    totals = by_package(rows)
+    assert totals["server"] == 500
+    # A submodule's time is already in its package's cumulative time
+    assert totals["motor"] == 450
+    assert totals["pymongo"] == 300
+    assert totals["json"] == 20
+
+
+def test_server_import_within_budget():
+    for module in ("fastapi", "motor", "dotenv"):
+        pytest.importorskip(module)
+    result = subprocess.run(
+        [sys.executable, str(BENCH_DIR / "import_profile.py"), "--check"],
+        capture_output=True, text=True, timeout=300
+    )
+    # Fails on the time budget and on any of LAZY_MODULES imported eagerly
+    assert result.returncode == 0, result.stdout + result.stderr
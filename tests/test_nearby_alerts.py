@@ -0,0 +1,107 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("cachetools")
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from alert_trails import distance_m  # noqa: E402
+from cursors import decode_cursor, encode_cursor  # noqa: E402
+from geo import haversine_m  # noqa: E402
+from nearby_alerts import NearbyAlerts, decode_nearby_cursor, encode_nearby_cursor  # noqa: E402
+
+from tests.fakes import FakeDatabase  # noqa: E402
+
+ORIGIN = (19.4326, -99.1332)
+
+
+class InMemoryNearby(NearbyAlerts):
+    """``$geoNear`` over a list, returning equal distances in reverse id order"""
+
+    def __init__(self, alerts, **kwargs):
+        super().__init__(FakeDatabase(), **kwargs)
+        self.rows = alerts
+        self.queries = 0
+
+    async def _query(self, *args):
+        self.queries += 1
+        await asyncio.sleep(0.01)
+        return await super()._query(*args)
+
+    async def _near(self, latitude, longitude, bbox, after, min_distance, max_distance, limit):
+        if after is not None:
+            min_distance = after[0] if min_distance is None else max(min_distance, after[0])
+        found = []
+        for alert in self.rows:
+            distance = haversine_m(latitude, longitude, alert["lat"], alert["lon"])
+            if min_distance is not None and distance < min_distance:
+                continue
+            if max_distance is not None and distance > max_distance:
+                continue
+            if after is not None and (distance, alert["id"]) <= after:
+                continue
+            found.append({"id": alert["id"], "distance": distance})
+        found.sort(key=lambda alert: alert["id"], reverse=True)
+        found.sort(key=lambda alert: alert["distance"])
+        return found[:limit] if limit is not None else found
+
+
+def test_haversine_known_distance_and_trail_points_agree():
+    madrid, paris = (40.4168, -3.7038), (48.8566, 2.3522)
+    assert haversine_m(*madrid, *paris) == pytest.approx(1_053_000, rel=0.005)
+    a, b = {"lat": madrid[0], "lon": madrid[1]}, {"lat": paris[0], "lon": paris[1]}
+    assert distance_m(a, b) == haversine_m(*madrid, *paris)
+    # Antipodes: rounding must not push asin out of its domain
+    assert haversine_m(0.0, 0.0, 0.0, 180.0) == pytest.approx(haversine_m(0.0, 0.0, 0.0, -180.0))
+
+
+def test_cursor_round_trip_and_malformed_tokens():
+    token = encode_cursor({"c": "2026-01-01T00:00:00+00:00", "i": "a1"})
+    assert "=" not in token
+    assert decode_cursor(token) == {"c": "2026-01-01T00:00:00+00:00", "i": "a1"}
+    assert decode_nearby_cursor(encode_nearby_cursor({"distance": 12.5, "id": "x"})) == (12.5, "x")
+    for bad in ("not base64!", encode_cursor({"i": "x"}), "WzFd"):  # "WzFd" is [1]
+        with pytest.raises(ValueError):
+            decode_nearby_cursor(bad)
+
+
+def test_pages_walk_every_alert_once_across_distance_ties():
+    lat, lon = ORIGIN
+    alerts = [{"id": f"same-{i}", "lat": lat + 0.01, "lon": lon} for i in range(5)]
+    alerts += [{"id": f"near-{i}", "lat": lat + 0.001 * (i + 1), "lon": lon} for i in range(3)]
+    alerts.append({"id": "far", "lat": lat + 0.02, "lon": lon})
+    nearby = InMemoryNearby(alerts)
+
+    async def walk():
+        seen, cursor = [], None
+        while True:
+            after = decode_nearby_cursor(cursor) if cursor else None
+            page, cursor = await nearby.search(lat, lon, radius_m=5000, limit=2, after=after)
+            seen.extend(page)
+            if cursor is None:
+                return seen
+
+    seen = asyncio.run(walk())
+    assert [alert["id"] for alert in seen] == [
+        "near-0", "near-1", "near-2", "same-0", "same-1", "same-2", "same-3", "same-4", "far"
+    ]
+
+
+def test_concurrent_identical_searches_share_one_query():
+    lat, lon = ORIGIN
+    nearby = InMemoryNearby([{"id": "a", "lat": lat, "lon": lon}])
+
+    async def scenario():
+        pages = await asyncio.gather(*(nearby.search(lat, lon, radius_m=1000) for _ in range(5)))
+        assert all(page == pages[0] for page in pages)
+        # Cached until the area's generation changes
+        await nearby.search(lat, lon, radius_m=1000)
+        await nearby.touch([{"type": "Point", "coordinates": [lon, lat]}])
+        await nearby.search(lat, lon, radius_m=1000)
+
+    asyncio.run(scenario())
+    assert nearby.queries == 2
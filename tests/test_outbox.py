@@ -0,0 +1,144 @@
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from outbox import OUTBOX_COLLECTION, OutboxDispatcher, build_outbox_entries  # noqa: E402
+
+from tests.fakes import FakeDatabase  # noqa: E402
+
+
+class SlowSNS:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.published = []
+        self._lock = threading.Lock()
+
+    def publish(self, PhoneNumber, Message):
+        time.sleep(self.delay)
+        with self._lock:
+            self.published.append(PhoneNumber)
+            return {"MessageId": f"m-{len(self.published)}"}
+
+
+def contacts(priorities):
+    return [
+        {"id": f"c{i}", "name": f"Contact {i}", "phone": f"+5255000000{i}", "priority": priority}
+        for i, priority in enumerate(priorities)
+    ]
+
+
+async def seed(db, priorities):
+    entries = build_outbox_entries("alert-1", contacts(priorities), "SOS")
+    await db.emergency_alerts.insert_one({"id": "alert-1", "contacts_notified": []})
+    await db[OUTBOX_COLLECTION].insert_many(entries)
+    return entries
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        yield executor
+
+
+def test_expired_lease_is_reclaimed_and_the_old_owner_cannot_write(executor):
+    async def scenario():
+        db = FakeDatabase({OUTBOX_COLLECTION: ["id"]})
+        sns = SlowSNS()
+        first = OutboxDispatcher(db, sns, executor)
+        second = OutboxDispatcher(db, sns, executor)
+        await seed(db, [1])
+
+        [entry] = await first.claim_batch()
+        assert await second.claim_batch() == []
+
+        # The first worker stalls past its lease
+        doc = db[OUTBOX_COLLECTION].docs[0]
+        doc["lease_expires_at"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+        [reclaimed] = await second.claim_batch()
+        assert reclaimed["attempts"] == 2
+        assert reclaimed["lease_owner"] == second.worker_id
+
+        await first.deliver(entry)
+        assert doc["status"] == "in_flight" and doc["lease_owner"] == second.worker_id
+
+        await second.deliver(reclaimed)
+        assert doc["status"] == "sent"
+
+    asyncio.run(scenario())
+
+
+def test_waves_renew_the_lease_so_a_slow_alert_is_not_sent_twice(executor):
+    async def scenario():
+        db = FakeDatabase({OUTBOX_COLLECTION: ["id"]})
+        # Four waves of 0.15s outlast the 0.4s lease taken at claim time
+        sns = SlowSNS(delay=0.15)
+        first = OutboxDispatcher(db, sns, executor, lease_seconds=0.4)
+        second = OutboxDispatcher(db, sns, executor, lease_seconds=0.4)
+        entries = await seed(db, [1, 2, 3, 4])
+
+        batch = await first.claim_batch()
+        assert len(batch) == 4
+        draining = asyncio.create_task(first.deliver_in_waves(batch))
+        while not draining.done():
+            await second.drain_once()
+            await asyncio.sleep(0.02)
+        await draining
+
+        assert sorted(sns.published) == sorted(entry["phone"] for entry in entries)
+        assert all(doc["status"] == "sent" for doc in db[OUTBOX_COLLECTION].docs)
+
+    asyncio.run(scenario())
+
+
+def test_timed_out_publish_is_uncertain_and_settled_by_the_late_result(executor):
+    async def scenario():
+        db = FakeDatabase({OUTBOX_COLLECTION: ["id"]})
+        sns = SlowSNS(delay=0.2)
+        dispatcher = OutboxDispatcher(db, sns, executor, publish_timeout=0.05, uncertain_backoff=60)
+        await seed(db, [1])
+
+        assert await dispatcher.drain_once() == 1
+        doc = db[OUTBOX_COLLECTION].docs[0]
+        assert doc["status"] == "pending" and doc["uncertain"]
+        assert doc["next_attempt_at"] > datetime.now(timezone.utc) + timedelta(seconds=55)
+        # Not retried right away, unlike a failure
+        assert await dispatcher.claim_batch() == []
+
+        await asyncio.gather(*dispatcher._late)
+        assert doc["status"] == "sent" and not doc["uncertain"]
+        assert sns.published == [doc["phone"]]
+        alert = await db.emergency_alerts.find_one({"id": "alert-1"})
+        assert alert["contacts_notified"] == ["c0"]
+
+    asyncio.run(scenario())
+
+
+def test_failed_publish_is_retried_with_backoff(executor):
+    class FailingSNS:
+        def publish(self, PhoneNumber, Message):
+            raise RuntimeError("throttled")
+
+    async def scenario():
+        db = FakeDatabase({OUTBOX_COLLECTION: ["id"]})
+        dispatcher = OutboxDispatcher(db, FailingSNS(), executor, max_attempts=2, base_backoff=0.0)
+        await seed(db, [1])
+        doc = db[OUTBOX_COLLECTION].docs[0]
+
+        await dispatcher.drain_once()
+        assert doc["status"] == "pending" and doc["last_error"] == "throttled"
+        assert not doc["uncertain"]
+        await dispatcher.drain_once()
+        assert doc["status"] == "failed" and doc["attempts"] == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,65 @@
+import gzip
+import json
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from procedure_catalog import ProcedureCatalog  # noqa: E402
+from procedure_store import ProcedureStore  # noqa: E402
+
+PROCEDURES_DIR = BACKEND_DIR / "content" / "procedures"
+
+
+@pytest.fixture
+def store(tmp_path):
+    for path in PROCEDURES_DIR.glob("*.json"):
+        shutil.copy(path, tmp_path / path.name)
+    return ProcedureStore(tmp_path, poll_interval=0)
+
+
+def test_each_encoding_has_its_own_etag(store):
+    body = store.catalog.list_body()
+    identity = ProcedureCatalog.respond(body, {})
+    gzipped = ProcedureCatalog.respond(body, {"accept-encoding": "gzip, deflate"})
+
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(gzipped.body) == identity.body
+    assert identity.headers["etag"] == body.etag
+    assert gzipped.headers["etag"] == body.etag[:-1] + '-gz"'
+
+
+def test_if_none_match_revalidates_the_same_encoding_only(store):
+    body = store.catalog.list_body()
+    gzip_tag = body.etag_for("gzip")
+
+    cached = ProcedureCatalog.respond(body, {"accept-encoding": "gzip", "if-none-match": f"W/{gzip_tag}"})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == gzip_tag
+
+    # A gzip validator doesn't vouch for the identity bytes
+    fresh = ProcedureCatalog.respond(body, {"if-none-match": gzip_tag})
+    assert fresh.status_code == 200
+    assert "content-encoding" not in fresh.headers
+
+
+def test_duplicate_procedure_id_is_rejected_and_the_old_content_kept(store, tmp_path):
+    revision = store.revision
+    procedure = json.loads((tmp_path / "cpr-adult.json").read_text(encoding="utf-8"))
+    (tmp_path / "cpr-adult-copy.json").write_text(json.dumps(procedure), encoding="utf-8")
+
+    assert store.reload() is False
+    assert store.revision == revision
+    assert list(store.catalog.by_id).count(procedure["id"]) == 1
+
+
+def test_manifest_hashes_are_the_identity_content_hashes(store):
+    manifest = json.loads(store.manifest_body.identity)
+    for procedure_id, entry in manifest["procedures"].items():
+        assert entry["hash"] == store.catalog.procedure_body(procedure_id).etag.strip('"')
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+for module in ("fastapi", "motor", "dotenv", "cachetools"):
+    pytest.importorskip(module)
+
+from cachetools import TTLCache  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import server  # noqa: E402
+from app_state import current_resources  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+
+from tests.fakes import FakeDatabase  # noqa: E402
+
+
+class RejectingAuth:
+    """The auth service no longer accepts the session ID"""
+
+    def __init__(self):
+        self.calls = 0
+
+    @asynccontextmanager
+    async def get(self, url, headers):
+        self.calls += 1
+        yield SimpleNamespace(status=401)
+
+
+@pytest.fixture
+def resources():
+    resources = SimpleNamespace(
+        sessions=SessionStore(FakeDatabase()),
+        session_data_cache=TTLCache(maxsize=10, ttl=60),
+        http_session=RejectingAuth(),
+    )
+    token = current_resources.set(resources)
+    yield resources
+    current_resources.reset(token)
+
+
+def login(session_id):
+    return asyncio.run(server.process_session(
+        server.AuthSession(session_id=session_id), x_session_id=None, x_device_name=None, user_agent=None
+    ))
+
+
+def cache_login(resources, session_id, token):
+    user = {"id": "u1", "email": "ana@example.com", "name": "Ana"}
+    asyncio.run(resources.sessions.create(token, user, {"name": "phone"}))
+    resources.session_data_cache[session_id] = {**user, "picture": None, "session_token": token}
+
+
+def test_retried_login_gets_the_cached_session(resources):
+    cache_login(resources, "s1", "token-1")
+    response = login("s1")
+    # A dict, or an already-encoded response with FAST_RESPONSES
+    body = response if isinstance(response, dict) else json.loads(response.body)
+    assert body["session_token"] == "token-1"
+    assert resources.http_session.calls == 0
+
+
+def test_retried_login_after_logout_does_not_return_the_revoked_token(resources):
+    cache_login(resources, "s1", "token-1")
+    asyncio.run(resources.sessions.revoke_key(server.token_hash("token-1")))
+
+    with pytest.raises(HTTPException) as raised:
+        login("s1")
+    assert raised.value.status_code == 400
+    assert resources.http_session.calls == 1
+    assert "s1" not in resources.session_data_cache